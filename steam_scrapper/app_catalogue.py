@@ -0,0 +1,277 @@
+import click
+import datetime as dt
+import logging
+import os
+import sys
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import config
+from models import SteamAppListItem
+
+# type codes of the catalogue, the position of each type
+APP_TYPES = ["game", "dlc", "software", "video", "hardware"]
+GAME = "game"
+EMPTY_IDS = np.zeros(0, dtype=np.int64)
+
+
+class AppCatalogue:
+    """
+    Local index of the Steam store apps, with their name, type and last modification, synced from GetAppList.
+
+    Appids are stored as a sorted int64 array with their type codes and modification times next to them, and the
+    names as one utf-8 buffer sliced by name_offsets, so the catalogue of every store app loads from a compressed
+    npz file without one object per app. Updates are buffered and merged on the next query or flush.
+    """
+
+    def __init__(self):
+        self.appids = EMPTY_IDS
+        self.type_codes = np.zeros(0, dtype=np.int8)
+        self.last_modified = EMPTY_IDS
+        self.names = np.zeros(0, dtype=np.uint8)
+        self.name_offsets = np.zeros(1, dtype=np.int64)
+        # epoch of the start of the last sync, the next one only lists the apps modified since
+        self.synced_at: Optional[int] = None
+        self._pending: Dict[int, SteamAppListItem] = {}
+
+    # Building
+
+    def update(self, apps: Iterable[SteamAppListItem]) -> None:
+        """
+        Buffers listed apps, replacing the entries of their appids.
+        """
+        for app in apps:
+            self._pending[int(app.appid)] = app
+
+    def flush(self) -> None:
+        """
+        Merges the buffered apps into the sorted arrays.
+        """
+        if not self._pending:
+            return
+        updated_appids = np.fromiter(sorted(self._pending), dtype=np.int64, count=len(self._pending))
+        kept = np.flatnonzero(~np.isin(self.appids, updated_appids))
+        new_apps = [self._pending[appid] for appid in updated_appids.tolist()]
+        appids = np.concatenate([self.appids[kept], updated_appids])
+        type_codes = np.concatenate(
+            [self.type_codes[kept], np.array([APP_TYPES.index(app.app_type) for app in new_apps], dtype=np.int8)]
+        )
+        last_modified = np.concatenate(
+            [self.last_modified[kept], np.array([app.last_modified for app in new_apps], dtype=np.int64)]
+        )
+        names = [self._name_bytes(index) for index in kept.tolist()] + [app.name.encode() for app in new_apps]
+        order = np.argsort(appids, kind="stable")
+        self.appids = appids[order]
+        self.type_codes = type_codes[order]
+        self.last_modified = last_modified[order]
+        names = [names[index] for index in order.tolist()]
+        name_lengths = np.fromiter((len(name) for name in names), dtype=np.int64, count=len(names))
+        self.name_offsets = np.concatenate([[0], np.cumsum(name_lengths)]).astype(np.int64)
+        self.names = np.frombuffer(b"".join(names), dtype=np.uint8)
+        self._pending = {}
+
+    def replace_apps(self, catalogue: "AppCatalogue") -> None:
+        """
+        Replaces every app with the ones of the informed catalogue, keeping the sync time.
+        """
+        catalogue.flush()
+        self.appids = catalogue.appids
+        self.type_codes = catalogue.type_codes
+        self.last_modified = catalogue.last_modified
+        self.names = catalogue.names
+        self.name_offsets = catalogue.name_offsets
+        self._pending = {}
+
+    def _name_bytes(self, index: int) -> bytes:
+        return self.names[self.name_offsets[index] : self.name_offsets[index + 1]].tobytes()
+
+    # Persistence
+
+    def save(self, path: str) -> None:
+        """
+        Saves the catalogue as a compressed npz file, written under a temporary name and renamed.
+        """
+        self.flush()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as catalogue_file:
+            np.savez_compressed(
+                catalogue_file,
+                appids=self.appids,
+                type_codes=self.type_codes,
+                last_modified=self.last_modified,
+                names=self.names,
+                name_offsets=self.name_offsets,
+                synced_at=np.array([-1 if self.synced_at is None else self.synced_at], dtype=np.int64),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "AppCatalogue":
+        catalogue = cls()
+        with np.load(path) as arrays:
+            catalogue.appids = arrays["appids"]
+            catalogue.type_codes = arrays["type_codes"]
+            catalogue.last_modified = arrays["last_modified"]
+            catalogue.names = arrays["names"]
+            catalogue.name_offsets = arrays["name_offsets"]
+            synced_at = int(arrays["synced_at"][0])
+            catalogue.synced_at = None if synced_at < 0 else synced_at
+        return catalogue
+
+    # Queries
+
+    def __len__(self) -> int:
+        self.flush()
+        return len(self.appids)
+
+    def app_index(self, appid: str) -> Optional[int]:
+        self.flush()
+        appid_int = int(appid)
+        index = int(np.searchsorted(self.appids, appid_int))
+        if index < len(self.appids) and self.appids[index] == appid_int:
+            return index
+        return None
+
+    def get(self, appid: str) -> Optional[SteamAppListItem]:
+        """
+        Returns the catalogue entry of the app, None when the store does not list it.
+        """
+        index = self.app_index(appid)
+        if index is None:
+            return None
+        return SteamAppListItem(
+            appid=str(appid),
+            name=self._name_bytes(index).decode(),
+            app_type=APP_TYPES[self.type_codes[index]],
+            last_modified=int(self.last_modified[index]),
+        )
+
+    def triage(self, app_ids: List[str]) -> Tuple[List[str], List[str], List[str]]:
+        """
+        Splits the appids in the games, the apps the store does not list, like removed or unreleased ones, and the
+        listed apps that are not games, each keeping the order of app_ids.
+        """
+        self.flush()
+        # ids that are not numbers are never listed
+        app_id_array = np.array([int(app_id) if app_id.isdigit() else -1 for app_id in app_ids], dtype=np.int64)
+        indexes = np.minimum(np.searchsorted(self.appids, app_id_array), max(len(self.appids) - 1, 0))
+        if len(self.appids):
+            listed = self.appids[indexes] == app_id_array
+            is_game = listed & (self.type_codes[indexes] == APP_TYPES.index(GAME))
+        else:
+            listed = is_game = np.zeros(len(app_ids), dtype=bool)
+        games, unlisted, non_games = [], [], []
+        for app_id, app_listed, app_is_game in zip(app_ids, listed.tolist(), is_game.tolist()):
+            if app_is_game:
+                games.append(app_id)
+            elif app_listed:
+                non_games.append(app_id)
+            else:
+                unlisted.append(app_id)
+        return games, unlisted, non_games
+
+    def type_counts(self) -> Dict[str, int]:
+        self.flush()
+        return {APP_TYPES[code]: count for code, count in sorted(Counter(self.type_codes.tolist()).items())}
+
+
+def sync_app_catalogue(catalogue: AppCatalogue, full: bool = False, current_time: Optional[dt.datetime] = None) -> int:
+    """
+    Lists the store apps modified since the last sync, or all of them when full or never synced, into the
+    catalogue, returning the number of apps listed. The sync time is only recorded once every type is listed.
+    The incremental syncs only add and update apps, a full sync replaces the whole catalogue once every type
+    is listed, dropping the apps the store no longer lists.
+
+    :param catalogue: catalogue updated in place
+    :type catalogue: AppCatalogue
+    :param full: lists every app instead of the modified ones, and replaces the catalogue with them
+    :type full: bool
+    """
+    import steam_api
+
+    sync_started = int((current_time or dt.datetime.now()).timestamp())
+    if_modified_since = None if full else catalogue.synced_at
+    # a failed full sync leaves the catalogue untouched
+    listed_catalogue = AppCatalogue() if full else catalogue
+    listed_apps = 0
+    for app_type in APP_TYPES:
+        last_appid = None
+        while True:
+            apps, last_appid = steam_api.fetch_app_list(
+                app_type, if_modified_since=if_modified_since, last_appid=last_appid
+            )
+            listed_catalogue.update(apps)
+            listed_apps += len(apps)
+            if last_appid is None:
+                break
+    if full:
+        catalogue.replace_apps(listed_catalogue)
+    catalogue.flush()
+    catalogue.synced_at = sync_started
+    return listed_apps
+
+
+def load_app_catalogue(path: Optional[str]) -> Optional[AppCatalogue]:
+    """
+    Loads the catalogue of the informed path, None without a path or when the file does not exist yet.
+    """
+    if path is None:
+        return None
+    if not os.path.exists(path):
+        logging.warning(f"App catalogue {path} not found, run app_catalogue sync to create it.")
+        return None
+    return AppCatalogue.load(path)
+
+
+@click.group()
+def app_catalogue():
+    pass
+
+
+@app_catalogue.command()
+@click.argument("steam_key", envvar="STEAM_KEY", type=str)
+@click.option("--app_catalogue_path", type=str, default="app_catalogue.npz")
+@click.option(
+    "--full", is_flag=True, default=False,
+    help="Lists every app instead of the ones modified since, replacing the catalogue to drop the delisted apps.")
+def sync(steam_key, app_catalogue_path, full):
+    """
+    Creates or updates the local app catalogue with the store apps modified since its last sync.
+    """
+    config.steam_key = steam_key
+    catalogue = AppCatalogue.load(app_catalogue_path) if os.path.exists(app_catalogue_path) else AppCatalogue()
+    listed_apps = sync_app_catalogue(catalogue, full=full)
+    catalogue.save(app_catalogue_path)
+    logging.info(f"{listed_apps} app(s) listed, {len(catalogue)} in the catalogue saved to {app_catalogue_path}.")
+
+
+@app_catalogue.command()
+@click.option("--app_catalogue_path", type=str, default="app_catalogue.npz")
+def stats(app_catalogue_path):
+    """
+    Logs the number of apps of the catalogue by type and its last sync.
+    """
+    catalogue = AppCatalogue.load(app_catalogue_path)
+    synced_at = dt.datetime.fromtimestamp(catalogue.synced_at) if catalogue.synced_at is not None else None
+    logging.info(f"{len(catalogue)} app(s), last synced at {synced_at}.")
+    for app_type, count in catalogue.type_counts().items():
+        logging.info(f"{app_type}: {count}")
+
+
+def configure_logging():
+    logging.getLogger("pymongo").setLevel(logging.CRITICAL)
+    logging.getLogger("backoff").setLevel(logging.CRITICAL)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setLevel(logging.INFO)
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s - %(message)s")
+    handler.setFormatter(formatter)
+    root.addHandler(handler)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    app_catalogue()
@@ -0,0 +1,125 @@
+import logging
+import os
+from functools import reduce
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+EMPTY_IDS = np.zeros(0, dtype=np.int64)
+
+
+class AppIndex:
+    """
+    In memory appid to players index of one period, loaded from the app_players rows of the repo.
+
+    Every posting list is a sorted int64 array of steam ids, so intersections and unions are merges of
+    sorted arrays. On disk the lists are delta encoded into the smallest unsigned dtype that fits the
+    gaps and compressed, which keeps the index of a whole month small enough to ship with a report.
+    """
+
+    def __init__(self, postings: Dict[str, np.ndarray]):
+        self.postings = postings
+
+    @classmethod
+    def from_postings(cls, postings: Dict[str, Iterable[str]]) -> "AppIndex":
+        return cls(
+            {
+                str(appid): np.unique(np.array([int(steamid) for steamid in steamids], dtype=np.int64))
+                for appid, steamids in postings.items()
+            }
+        )
+
+    @classmethod
+    def from_repo(
+        cls, repo, created_year: int, created_month: int, source: str = "gameplay_info", batch_size: int = 1000
+    ) -> "AppIndex":
+        """
+        :param source: gameplay_info for the players with playtime in their library, gameplay_delta for the
+            players that played the game in the month
+        :type source: str
+        """
+        postings = {}
+        query = {"source": source, "created_year": created_year, "created_month": created_month}
+        for documents in repo.iter_documents("app_players", query=query, batch_size=batch_size):
+            for document in documents:
+                postings.setdefault(document["appid"], []).append(document["steamid"])
+        app_index = cls.from_postings(postings)
+        logging.info(f"App index loaded with {len(app_index.postings)} apps for {created_year}/{created_month:02d}.")
+        return app_index
+
+    # Persistence
+
+    def save(self, path: str) -> None:
+        appids = sorted(self.postings)
+        counts = np.array([len(self.postings[appid]) for appid in appids], dtype=np.int64)
+        values = np.concatenate([self.postings[appid] for appid in appids]) if appids else EMPTY_IDS
+        starts = np.cumsum(counts) - counts
+        non_empty = counts > 0
+        heads = np.zeros(len(appids), dtype=np.int64)
+        heads[non_empty] = values[starts[non_empty]]
+        # the gap from the previous steam id of the same list, the first of each list is kept in heads
+        gaps = np.diff(values, prepend=values[:1])
+        gaps[starts[non_empty]] = 0
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as index_file:
+            np.savez_compressed(
+                index_file,
+                appids=np.array(appids, dtype=str),
+                counts=counts,
+                heads=heads,
+                gaps=gaps.astype(np.min_scalar_type(int(gaps.max(initial=0)))),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "AppIndex":
+        with np.load(path) as arrays:
+            appids, counts, heads = arrays["appids"].tolist(), arrays["counts"], arrays["heads"]
+            sums = np.cumsum(arrays["gaps"].astype(np.int64))
+        starts = np.cumsum(counts) - counts
+        non_empty = counts > 0
+        list_offsets = np.zeros(len(appids), dtype=np.int64)
+        list_offsets[non_empty] = heads[non_empty] - sums[starts[non_empty]]
+        values = sums + np.repeat(list_offsets, counts)
+        return cls({appid: values[start : start + count] for appid, start, count in zip(appids, starts, counts)})
+
+    # Queries
+
+    def _posting(self, appid: str) -> np.ndarray:
+        return self.postings.get(str(appid), EMPTY_IDS)
+
+    @staticmethod
+    def to_steamids(steamids: np.ndarray) -> List[str]:
+        return [str(steamid) for steamid in steamids.tolist()]
+
+    def players(self, appid: str) -> List[str]:
+        return self.to_steamids(self._posting(appid))
+
+    def player_count(self, appid: str) -> int:
+        return len(self._posting(appid))
+
+    def intersect(self, appid_list: List[str]) -> List[str]:
+        """
+        Returns the players with playtime in every informed app, starting from the shortest posting list.
+        """
+        if not appid_list:
+            return []
+        postings = sorted((self._posting(appid) for appid in appid_list), key=len)
+        return self.to_steamids(
+            reduce(lambda result, posting: np.intersect1d(result, posting, assume_unique=True), postings)
+        )
+
+    def union(self, appid_list: List[str]) -> List[str]:
+        """
+        Returns the players with playtime in any of the informed apps.
+        """
+        if not appid_list:
+            return []
+        return self.to_steamids(np.unique(np.concatenate([self._posting(appid) for appid in appid_list])))
+
+    def filter_players(self, appid: str, steamid_list: List[str]) -> List[str]:
+        """
+        Returns the informed players with playtime in the app, such as the friends of a player that played it.
+        """
+        steamids = np.unique(np.array([int(steamid) for steamid in steamid_list], dtype=np.int64))
+        return self.to_steamids(np.intersect1d(self._posting(appid), steamids, assume_unique=True))
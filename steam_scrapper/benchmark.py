@@ -0,0 +1,96 @@
+import os
+
+# the scrapper progress bars would be timed with the scenarios, so they are disabled before tqdm is imported
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import click
+import datetime as dt
+import json
+import logging
+import platform
+import subprocess
+import sys
+
+from benchmarks.synthetic import SyntheticSteam
+from benchmarks.stand_in_api import StandInSteamApi
+from benchmarks.scenarios import SCENARIOS, run_scenario, compare_results
+
+RESULTS_VERSION = 1
+
+
+@click.command()
+@click.option("--scenario", "scenario_names", type=click.Choice(list(SCENARIOS)), multiple=True)
+@click.option("--repeat", type=click.IntRange(min=1), default=5)
+@click.option("--scale", type=float, default=1.0, help="Multiplies the number of players and apps of every scenario.")
+@click.option("--seed", type=int, default=42)
+@click.option("--output", type=str, default="benchmark_results.json")
+@click.option("--baseline", type=str, help="Results of a previous run to compare against.")
+@click.option("--threshold", type=float, default=0.1, help="Median slowdown reported as a regression.")
+def benchmark(scenario_names, repeat, scale, seed, output, baseline, threshold):
+    generator = SyntheticSteam(seed=seed)
+    results = {
+        "version": RESULTS_VERSION,
+        "metadata": {
+            "commit": get_commit(),
+            "created_at": dt.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": seed,
+            "scale": scale,
+            "repeat": repeat,
+        },
+        "results": {},
+    }
+    with StandInSteamApi(generator):
+        for name in scenario_names or SCENARIOS:
+            logging.info(f"Running scenario {name}...")
+            scenario = SCENARIOS[name](generator, scale)
+            result = run_scenario(scenario, repeat=repeat)
+            results["results"][name] = result
+            logging.info(
+                f"{name}: median {result['median_seconds']:.4f}s for {result['items']} {result['unit']} "
+                f"({result['items_per_second']:,.0f} {result['unit']}/s)."
+            )
+    with open(output, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+    logging.info(f"Results written to {output}.")
+
+    if baseline is not None:
+        with open(baseline) as baseline_file:
+            baseline_results = json.load(baseline_file)
+        if baseline_results["metadata"]["seed"] != seed or baseline_results["metadata"]["scale"] != scale:
+            logging.warning("The baseline was run with another seed or scale, only matching scenarios are compared.")
+        rows = compare_results(baseline_results, results, threshold)
+        for row in rows:
+            logging.info(
+                f"{row['scenario']}: {row['baseline_seconds']:.4f}s -> {row['current_seconds']:.4f}s "
+                f"({row['ratio']:.2f}x){' REGRESSION' if row['regressed'] else ''}"
+            )
+        if any(row["regressed"] for row in rows):
+            sys.exit(1)
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure_logging():
+    logging.getLogger("pymongo").setLevel(logging.CRITICAL)
+    logging.getLogger("backoff").setLevel(logging.CRITICAL)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setLevel(logging.INFO)
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s - %(message)s")
+    handler.setFormatter(formatter)
+    root.addHandler(handler)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    benchmark()
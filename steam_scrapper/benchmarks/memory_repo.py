@@ -0,0 +1,201 @@
+import datetime as dt
+from dataclasses import asdict
+from typing import Dict, List, Optional, Union
+
+from repos.repo import Repo
+from repos.mongo_repo import (
+    decode_steam_profile,
+    decode_friend_list,
+    decode_gameplay_list,
+    decode_compact_gameplay_list,
+    decode_gameplay_delta_list,
+    decode_game_info,
+    decode_player_rollup,
+    encode_gameplay_list,
+    encode_gameplay_delta_list,
+    encode_game_info,
+)
+from models import (
+    SteamProfile,
+    SteamFriendList,
+    SteamGameinfo,
+    GameplayList,
+    GameplayMonthDeltaList,
+    PlayerMonthRollup,
+    CompactGameplayList,
+)
+
+
+class MemoryRepo(Repo):
+    """
+    Repo kept in process memory, for the benchmarks.
+
+    Models are stored as the documents SteamMongo would save and decoded on every read with the same
+    decoders, so the scenarios measure the scrapper and the document mapping without a database round trip.
+    """
+
+    def __init__(self):
+        self.friend_lists: List[Dict] = []
+        self.player_info: Dict[str, Dict] = {}
+        self.gameplay_info: List[Dict] = []
+        self.gameplay_delta_info: List[Dict] = []
+        self.player_rollups: Dict[tuple, Dict] = {}
+        self.game_info: Dict[str, Dict] = {}
+
+    @staticmethod
+    def find(
+        documents: List[Dict],
+        player_id_list: Optional[List[str]] = None,
+        created_year: Optional[int] = None,
+        created_month: Optional[int] = None,
+    ) -> List[Dict]:
+        player_id_set = set(player_id_list) if player_id_list is not None else None
+        return [
+            document
+            for document in documents
+            if (player_id_set is None or document["steamid"] in player_id_set)
+            and (created_year is None or document["created_year"] == created_year)
+            and (created_month is None or document["created_month"] == created_month)
+        ]
+
+    @staticmethod
+    def replace(documents: List[Dict], document: Dict) -> None:
+        period_key = (document["steamid"], document["created_year"], document["created_month"])
+        documents[:] = [
+            existing
+            for existing in documents
+            if (existing["steamid"], existing["created_year"], existing["created_month"]) != period_key
+        ]
+        documents.append(document)
+
+    # Friend List
+    def get_existing_friend_list_ids(
+        self, player_id_list: List[str], created_year: Optional[int] = None, created_month: Optional[int] = None
+    ) -> List[str]:
+        return [
+            document["steamid"]
+            for document in self.find(self.friend_lists, player_id_list, created_year, created_month)
+        ]
+
+    def get_friend_list_by_id(
+        self, player_id: str, created_year: Optional[int] = None, created_month: Optional[int] = None
+    ) -> List[SteamFriendList]:
+        # the latest first, like SteamMongo
+        documents = self.find(self.friend_lists, [player_id], created_year, created_month)
+        return [
+            decode_friend_list(document)
+            for document in sorted(documents, key=lambda document: document["updated_at"], reverse=True)
+        ]
+
+    def save_friend_list(self, player_friend_list: SteamFriendList):
+        self.replace(self.friend_lists, asdict(player_friend_list))
+
+    # Player Info
+    def get_player_info_by_id_list(self, player_id_list: List[str]) -> List[SteamProfile]:
+        return [
+            decode_steam_profile(self.player_info[player_id])
+            for player_id in player_id_list
+            if player_id in self.player_info
+        ]
+
+    def save_player_info_list(self, player_info_list: List[SteamProfile]):
+        for player_info in player_info_list:
+            self.player_info[player_info.steamid] = asdict(player_info)
+
+    def delete_player_info_list(self, player_id_list: List[str]):
+        for player_id in player_id_list:
+            self.player_info.pop(player_id, None)
+
+    # Gameplay Info
+    def get_existing_gameplay_info_ids(
+        self, player_id_list: List[str], created_year: Optional[int] = None, created_month: Optional[int] = None
+    ) -> List[str]:
+        return [
+            document["steamid"]
+            for document in self.find(self.gameplay_info, player_id_list, created_year, created_month)
+        ]
+
+    def get_gameplay_info_by_id(
+        self, player_id: str, created_year: Optional[int] = None, created_month: Optional[int] = None
+    ) -> List[GameplayList]:
+        return self.get_gameplay_info_by_id_list([player_id], created_year, created_month)
+
+    def get_gameplay_info_by_id_list(
+        self,
+        player_id_list: List[str] = None,
+        created_year: Optional[int] = None,
+        created_month: Optional[int] = None,
+        sort_query: Optional[bool] = False,
+        compact: bool = False,
+    ) -> Union[List[GameplayList], List[CompactGameplayList]]:
+        documents = self.find(self.gameplay_info, player_id_list, created_year, created_month)
+        if sort_query:
+            documents = sorted(documents, key=lambda document: document["steamid"])
+        decode = decode_compact_gameplay_list if compact else decode_gameplay_list
+        return [decode(document) for document in documents]
+
+    def save_gameplay_info(self, gameplay_info: GameplayList):
+        self.replace(self.gameplay_info, encode_gameplay_list(gameplay_info))
+
+    def delete_gameplay_info(
+        self, player_id: Optional[str] = None, created_year: Optional[int] = None, created_month: Optional[int] = None
+    ):
+        self.delete_gameplay_info_by_id_list(
+            [player_id] if player_id is not None else None, created_year=created_year, created_month=created_month
+        )
+
+    def delete_gameplay_info_by_id_list(
+        self, player_id_list: List[str], created_year: Optional[int] = None, created_month: Optional[int] = None
+    ):
+        deleted = {
+            id(document) for document in self.find(self.gameplay_info, player_id_list, created_year, created_month)
+        }
+        self.gameplay_info = [document for document in self.gameplay_info if id(document) not in deleted]
+
+    # Gameplay Delta
+    def get_existing_gameplay_delta_info_id_list(
+        self,
+        steam_id_list: List[str],
+        created_year: Optional[int] = None,
+        created_month: Optional[int] = None,
+        updated_at: Optional[dt.datetime] = None,
+    ) -> Union[None, List[str]]:
+        return [
+            document["steamid"]
+            for document in self.find(self.gameplay_delta_info, steam_id_list, created_year, created_month)
+            if updated_at is None or document["updated_at"] == updated_at
+        ]
+
+    def get_existing_gameplay_delta_info_list(
+        self, steam_id_list: List[str], created_year: Optional[int] = None, created_month: Optional[int] = None
+    ) -> Union[None, List[GameplayMonthDeltaList]]:
+        return [
+            decode_gameplay_delta_list(document)
+            for document in self.find(self.gameplay_delta_info, steam_id_list, created_year, created_month)
+        ]
+
+    def save_gameplay_delta_info_list(self, gameplay_delta_info_list: List[GameplayMonthDeltaList]):
+        for gameplay_delta in gameplay_delta_info_list:
+            self.replace(self.gameplay_delta_info, encode_gameplay_delta_list(gameplay_delta))
+
+    # Player Rollups
+    def get_player_rollup_list(
+        self, player_id_list: List[str], created_year: Optional[int] = None, created_month: Optional[int] = None
+    ) -> List[PlayerMonthRollup]:
+        return [
+            decode_player_rollup(document)
+            for document in self.find(list(self.player_rollups.values()), player_id_list, created_year, created_month)
+        ]
+
+    def save_player_rollup_list(self, player_rollup_list: List[PlayerMonthRollup]):
+        for player_rollup in player_rollup_list:
+            period_key = (player_rollup.steamid, player_rollup.created_year, player_rollup.created_month)
+            self.player_rollups[period_key] = asdict(player_rollup)
+
+    # Game Info
+    def get_game_info_by_game_id_list(self, game_id_list: List[str]) -> List[SteamGameinfo]:
+        return [decode_game_info(self.game_info[appid]) for appid in game_id_list if appid in self.game_info]
+
+    def save_game_info_list(self, game_info_list: List[SteamGameinfo]):
+        for game_info in game_info_list:
+            self.game_info[str(game_info.appid)] = encode_game_info(game_info)
@@ -0,0 +1,277 @@
+import datetime as dt
+import gc
+import os
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List
+
+import steam_api
+from scrapper import SteamScrapper
+from delta_engine import calculate_gameplay_delta_batch
+from models import SteamFriendList
+from repos.mongo_repo import (
+    decode_steam_profile,
+    decode_friend_list,
+    decode_gameplay_list,
+    decode_compact_gameplay_list,
+    decode_game_info,
+    encode_gameplay_list,
+    encode_game_info,
+)
+from benchmarks.synthetic import SyntheticSteam
+from benchmarks.memory_repo import MemoryRepo
+
+USERS_PER_REQUEST = 100
+CLI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cli.py")
+# commands whose startup is tracked, the help of a command loads its module without running it
+CLI_STARTUP_COMMANDS = [["--help"], ["scrap", "--help"], ["db_ops", "--help"]]
+
+
+@dataclass
+class Scenario:
+    """
+    A prepared benchmark: run executes the measured work once, over items units of work.
+    """
+
+    run: Callable[[], None]
+    items: int
+    unit: str
+
+
+def scaled(count: int, scale: float) -> int:
+    return max(1, int(count * scale))
+
+
+def chunks(items: List, size: int) -> List[List]:
+    return [items[start : start + size] for start in range(0, len(items), size)]
+
+
+def new_scrapper() -> SteamScrapper:
+    return SteamScrapper(repo=MemoryRepo(), frequency="month")
+
+
+def gameplay_snapshots(generator: SyntheticSteam, scale: float):
+    """
+    Returns two consecutive monthly snapshots of the same players, a heavy player included.
+    """
+    steamids = generator.steamids(scaled(200, scale)) + generator.heavy_steamids(1)
+    previous_list = [generator.gameplay_list(steamid, 2024, 1) for steamid in steamids]
+    current_list = [generator.gameplay_list(steamid, 2024, 2, months_played=1) for steamid in steamids]
+    return previous_list, current_list
+
+
+# Scenarios, the API ones run against the stand-in API
+
+
+def scrap_users_scenario(generator: SyntheticSteam, scale: float) -> Scenario:
+    steamids = generator.steamids(scaled(1000, scale))
+
+    def run():
+        scrapper = new_scrapper()
+        for steamid_chunk in chunks(steamids, USERS_PER_REQUEST):
+            scrapper.scrap_users(",".join(steamid_chunk))
+
+    return Scenario(run=run, items=len(steamids), unit="profiles")
+
+
+def scrap_friend_list_scenario(generator: SyntheticSteam, scale: float) -> Scenario:
+    steamids = generator.heavy_steamids(scaled(5, scale))
+
+    def run():
+        scrapper = new_scrapper()
+        for steamid in steamids:
+            scrapper.scrap_friend_list(steamid)
+
+    return Scenario(run=run, items=len(steamids) * generator.max_friends, unit="friends")
+
+
+def scrap_gameplay_info_scenario(generator: SyntheticSteam, scale: float) -> Scenario:
+    steamids = generator.heavy_steamids(scaled(3, scale))
+
+    def run():
+        scrapper = new_scrapper()
+        for steamid in steamids:
+            scrapper.scrap_gameplay_info(steamid)
+
+    return Scenario(run=run, items=len(steamids) * generator.max_games, unit="games")
+
+
+def scrap_game_info_scenario(generator: SyntheticSteam, scale: float) -> Scenario:
+    appids = generator.appids(scaled(300, scale))
+
+    def run():
+        new_scrapper().scrap_game_info(",".join(appids))
+
+    return Scenario(run=run, items=len(appids), unit="apps")
+
+
+def calculate_gameplay_delta_scenario(generator: SyntheticSteam, scale: float) -> Scenario:
+    previous_list, current_list = gameplay_snapshots(generator, scale)
+    scrapper = new_scrapper()
+
+    def run():
+        for current_gameplay, previous_gameplay in zip(current_list, previous_list):
+            scrapper.calculate_gameplay_delta(current_gameplay, previous_gameplay)
+
+    return Scenario(run=run, items=sum(len(gameplay.gameplay_list) for gameplay in current_list), unit="games")
+
+
+def delta_engine_numpy_scenario(generator: SyntheticSteam, scale: float) -> Scenario:
+    previous_list, current_list = gameplay_snapshots(generator, scale)
+    previous_dict = {gameplay.steamid: gameplay for gameplay in previous_list}
+    current_time = dt.datetime.now()
+
+    def run():
+        calculate_gameplay_delta_batch(current_list, previous_dict, current_time=current_time)
+
+    return Scenario(run=run, items=sum(len(gameplay.gameplay_list) for gameplay in current_list), unit="games")
+
+
+def decode_gameplay_list_scenario(generator: SyntheticSteam, scale: float) -> Scenario:
+    _, current_list = gameplay_snapshots(generator, scale)
+    documents = [encode_gameplay_list(gameplay) for gameplay in current_list]
+
+    def run():
+        for document in documents:
+            decode_gameplay_list(document)
+
+    return Scenario(run=run, items=sum(len(document["gameplay_list"]) for document in documents), unit="games")
+
+
+def decode_compact_gameplay_list_scenario(generator: SyntheticSteam, scale: float) -> Scenario:
+    _, current_list = gameplay_snapshots(generator, scale)
+    documents = [encode_gameplay_list(gameplay) for gameplay in current_list]
+
+    def run():
+        for document in documents:
+            decode_compact_gameplay_list(document)
+
+    return Scenario(run=run, items=sum(len(document["gameplay_list"]) for document in documents), unit="games")
+
+
+def decode_friend_list_scenario(generator: SyntheticSteam, scale: float) -> Scenario:
+    current_time = dt.datetime.now()
+    documents = [
+        asdict(
+            SteamFriendList(
+                steamid=steamid,
+                friend_list=steam_api.fetch_player_friend_list(player_id=steamid),
+                created_at=current_time,
+                updated_at=current_time,
+                created_year=current_time.year,
+                created_month=current_time.month,
+            )
+        )
+        for steamid in generator.steamids(scaled(200, scale)) + generator.heavy_steamids(1)
+    ]
+
+    def run():
+        for document in documents:
+            decode_friend_list(document)
+
+    return Scenario(run=run, items=sum(len(document["friend_list"]) for document in documents), unit="friends")
+
+
+def decode_steam_profile_scenario(generator: SyntheticSteam, scale: float) -> Scenario:
+    steamids = generator.steamids(scaled(1000, scale))
+    documents = [
+        asdict(profile)
+        for steamid_chunk in chunks(steamids, USERS_PER_REQUEST)
+        for profile in steam_api.fetch_player_info(",".join(steamid_chunk))
+    ]
+
+    def run():
+        for document in documents:
+            decode_steam_profile(document)
+
+    return Scenario(run=run, items=len(documents), unit="profiles")
+
+
+def decode_game_info_scenario(generator: SyntheticSteam, scale: float) -> Scenario:
+    game_info_list = [steam_api.fetch_game_details(appid) for appid in generator.appids(scaled(300, scale))]
+    documents = [encode_game_info(game_info) for game_info in game_info_list if game_info is not None]
+
+    def run():
+        for document in documents:
+            decode_game_info(document)
+
+    return Scenario(run=run, items=len(documents), unit="apps")
+
+
+def cli_startup_scenario(generator: SyntheticSteam, scale: float) -> Scenario:
+    """
+    Measures the startup of the cli commands in new interpreters, which the lazy imports keep short.
+    """
+
+    def run():
+        for command in CLI_STARTUP_COMMANDS:
+            subprocess.run([sys.executable, CLI_PATH] + command, check=True, capture_output=True)
+
+    return Scenario(run=run, items=len(CLI_STARTUP_COMMANDS), unit="commands")
+
+
+SCENARIOS: Dict[str, Callable[[SyntheticSteam, float], Scenario]] = {
+    "scrap_users": scrap_users_scenario,
+    "scrap_friend_list": scrap_friend_list_scenario,
+    "scrap_gameplay_info": scrap_gameplay_info_scenario,
+    "scrap_game_info": scrap_game_info_scenario,
+    "calculate_gameplay_delta": calculate_gameplay_delta_scenario,
+    "delta_engine_numpy": delta_engine_numpy_scenario,
+    "decode_gameplay_list": decode_gameplay_list_scenario,
+    "decode_compact_gameplay_list": decode_compact_gameplay_list_scenario,
+    "decode_friend_list": decode_friend_list_scenario,
+    "decode_steam_profile": decode_steam_profile_scenario,
+    "decode_game_info": decode_game_info_scenario,
+    "cli_startup": cli_startup_scenario,
+}
+
+
+def run_scenario(scenario: Scenario, repeat: int, warmup: int = 1) -> Dict:
+    """
+    Runs the scenario warmup times unmeasured, then repeat times, returning the timings summary.
+    """
+    for _ in range(warmup):
+        scenario.run()
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        scenario.run()
+        timings.append(time.perf_counter() - start)
+    median = statistics.median(timings)
+    return {
+        "unit": scenario.unit,
+        "items": scenario.items,
+        "repeat": repeat,
+        "min_seconds": min(timings),
+        "median_seconds": median,
+        "mean_seconds": statistics.mean(timings),
+        "stdev_seconds": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "items_per_second": scenario.items / median if median else 0.0,
+    }
+
+
+def compare_results(baseline: Dict, results: Dict, threshold: float) -> List[Dict]:
+    """
+    Compares the median of every scenario present in both result files. A scenario regressed when its
+    median grew by more than threshold, as a fraction of the baseline median.
+    """
+    rows = []
+    for name, result in results["results"].items():
+        baseline_result = baseline["results"].get(name)
+        if baseline_result is None or baseline_result["items"] != result["items"]:
+            continue
+        ratio = result["median_seconds"] / baseline_result["median_seconds"]
+        rows.append(
+            {
+                "scenario": name,
+                "baseline_seconds": baseline_result["median_seconds"],
+                "current_seconds": result["median_seconds"],
+                "ratio": ratio,
+                "regressed": ratio > 1 + threshold,
+            }
+        )
+    return rows
@@ -0,0 +1,72 @@
+import json
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from config import config
+from benchmarks.synthetic import SyntheticSteam
+
+
+class StandInSteamApi:
+    """
+    Local HTTP server answering the Steam API endpoints used by steam_api with synthetic payloads.
+
+    Used as a context manager, it starts on a free localhost port and points config.steam_api_url and
+    config.steam_store_url to itself, restoring them on exit. Payloads are rendered once per request url,
+    so after a warm up round the scenarios only measure the client side of each request.
+    """
+
+    def __init__(self, generator: SyntheticSteam):
+        self.generator = generator
+        self.render = lru_cache(maxsize=None)(self._render)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._previous_urls = None
+
+    def _render(self, path: str, query: str) -> bytes:
+        params = {name: values[0] for name, values in parse_qs(query).items()}
+        if path == "/ISteamUser/GetPlayerSummaries/v0002/":
+            payload = self.generator.player_summaries(params["steamids"].split(","))
+        elif path == "/ISteamUser/GetFriendList/v0001/":
+            payload = self.generator.friend_list(params["steamid"])
+        elif path == "/IPlayerService/GetOwnedGames/v0001/":
+            payload = self.generator.owned_games(params["steamid"])
+        elif path == "/IPlayerService/GetRecentlyPlayedGames/v0001/":
+            payload = self.generator.recently_played_games(params["steamid"])
+        elif path == "/api/appdetails":
+            payload = self.generator.app_details(params["appids"])
+        else:
+            return b""
+        return json.dumps(payload).encode()
+
+    def _handler_class(self):
+        stand_in_api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                body = stand_in_api.render(url.path, url.query)
+                self.send_response(200 if body else 404)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self) -> "StandInSteamApi":
+        self._thread.start()
+        self._previous_urls = (config.steam_api_url, config.steam_store_url)
+        config.steam_api_url = self.url
+        config.steam_store_url = self.url
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        config.steam_api_url, config.steam_store_url = self._previous_urls
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,204 @@
+import datetime as dt
+import random
+from typing import Dict, List
+
+from models import GameplayItem, GameplayList
+
+FIRST_STEAMID = 76561197960265728
+# steam ids from this offset are heavy players, with the largest friend lists and libraries
+HEAVY_STEAMID_OFFSET = 10**9
+FIRST_APPID = 10
+# window of the recently played games endpoint
+RECENTLY_PLAYED_SECONDS = 86400 * 14
+GENRES = ["Action", "Adventure", "Casual", "Indie", "RPG", "Simulation", "Strategy", "Sports", "Racing", "Puzzle"]
+CATEGORIES = ["Single-player", "Multi-player", "Co-op", "Steam Achievements", "Full controller support", "Steam Cloud"]
+COUNTRIES = ["US", "BR", "DE", "GB", "FR", "RU", "CN", "CA", "PL", "JP"]
+WORDS = ["space", "dungeon", "farm", "racing", "tactics", "legend", "survival", "city", "puzzle", "night", "hero"]
+
+
+class SyntheticSteam:
+    """
+    Seeded generator of Steam API payloads with realistic shapes and sizes.
+
+    Every payload is derived from its own random stream, seeded by the generator seed and the requested id,
+    so the same id always produces the same payload whatever the order of the requests. Friend counts and
+    library sizes follow heavy tailed distributions capped at max_friends and max_games, and the heavy
+    players always have the capped sizes.
+
+    :param seed: the seed of every generated payload
+    :type seed: int
+    :param catalogue_size: number of apps that can be owned, the first ones being the most popular
+    :type catalogue_size: int
+    """
+
+    def __init__(self, seed: int = 42, max_friends: int = 2000, max_games: int = 20000, catalogue_size: int = 50000):
+        self.seed = seed
+        self.max_friends = max_friends
+        self.max_games = max_games
+        self.catalogue_size = catalogue_size
+        self.base_time = dt.datetime(2024, 1, 1)
+
+    def rng(self, *keys) -> random.Random:
+        return random.Random(":".join(str(key) for key in (self.seed,) + keys))
+
+    # Ids
+
+    def steamids(self, count: int, start: int = 0) -> List[str]:
+        return [str(FIRST_STEAMID + start + offset) for offset in range(count)]
+
+    def heavy_steamids(self, count: int) -> List[str]:
+        return self.steamids(count, start=HEAVY_STEAMID_OFFSET)
+
+    def is_heavy(self, steamid: str) -> bool:
+        return int(steamid) - FIRST_STEAMID >= HEAVY_STEAMID_OFFSET
+
+    def appids(self, count: int, start: int = 0) -> List[str]:
+        return [str(FIRST_APPID + (start + offset) * 10) for offset in range(count)]
+
+    def capped_size(self, rng: random.Random, median: int, cap: int) -> int:
+        return min(cap, int(median * rng.paretovariate(1.2) / 1.78))
+
+    # Payloads
+
+    def player_summary(self, steamid: str) -> Dict:
+        rng = self.rng("profile", steamid)
+        name = f"{rng.choice(WORDS)}_{rng.choice(WORDS)}{rng.randint(0, 9999)}"
+        avatar = f"https://avatars.steamstatic.com/{rng.getrandbits(160):040x}"
+        summary = {
+            "steamid": steamid,
+            "communityvisibilitystate": 3,
+            "profilestate": 1,
+            "personaname": name,
+            "profileurl": f"https://steamcommunity.com/id/{name}/",
+            "avatar": f"{avatar}.jpg",
+            "avatarmedium": f"{avatar}_medium.jpg",
+            "avatarfull": f"{avatar}_full.jpg",
+            "lastlogoff": int(self.base_time.timestamp()) - rng.randint(0, 86400 * 90),
+            "personastate": rng.randint(0, 6),
+            "timecreated": int(self.base_time.timestamp()) - rng.randint(86400, 86400 * 365 * 15),
+        }
+        if rng.random() < 0.6:
+            summary["loccountrycode"] = rng.choice(COUNTRIES)
+        if rng.random() < 0.3:
+            summary["realname"] = f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}"
+        return summary
+
+    def player_summaries(self, steamids: List[str]) -> Dict:
+        return {"response": {"players": [self.player_summary(steamid) for steamid in steamids]}}
+
+    def friend_list(self, steamid: str) -> Dict:
+        rng = self.rng("friends", steamid)
+        friend_count = self.max_friends if self.is_heavy(steamid) else self.capped_size(rng, 60, self.max_friends)
+        friend_offsets = rng.sample(range(HEAVY_STEAMID_OFFSET), friend_count)
+        return {
+            "friendslist": {
+                "friends": [
+                    {
+                        "steamid": str(FIRST_STEAMID + offset),
+                        "relationship": "friend",
+                        "friend_since": int(self.base_time.timestamp()) - rng.randint(0, 86400 * 365 * 10),
+                    }
+                    for offset in friend_offsets
+                ]
+            }
+        }
+
+    def owned_games(self, steamid: str, months_played: int = 0) -> Dict:
+        """
+        Returns the library of a player after months_played extra months of play, for building the
+        consecutive snapshots of a gameplay delta.
+        """
+        rng = self.rng("games", steamid)
+        game_count = self.max_games if self.is_heavy(steamid) else self.capped_size(rng, 80, self.max_games)
+        game_count = min(game_count, self.catalogue_size)
+        # popular apps are owned more often, the exponent skews the picks to the start of the catalogue
+        appid_offsets = set()
+        while len(appid_offsets) < game_count:
+            appid_offsets.add(int(self.catalogue_size * rng.random() ** 3))
+        games = []
+        for appid_offset in sorted(appid_offsets):
+            playtime = int(rng.lognormvariate(5, 2)) if rng.random() < 0.7 else 0
+            games.append({"appid": FIRST_APPID + appid_offset * 10, "playtime_forever": playtime})
+        for month in range(1, months_played + 1):
+            month_rng = self.rng("games", steamid, month)
+            for game in games:
+                if month_rng.random() < 0.1:
+                    game["playtime_forever"] += int(month_rng.lognormvariate(4, 1.5))
+        for game in games:
+            game["rtime_last_played"] = (
+                int(self.base_time.timestamp()) - rng.randint(0, 86400 * 365) if game["playtime_forever"] else 0
+            )
+        return {"response": {"game_count": len(games), "games": games}}
+
+    def recently_played_games(self, steamid: str) -> Dict:
+        """
+        Returns the games of the library last played in the two weeks before the base time.
+        """
+        window_start = int(self.base_time.timestamp()) - RECENTLY_PLAYED_SECONDS
+        games = [
+            {"appid": game["appid"], "playtime_2weeks": 0, "playtime_forever": game["playtime_forever"]}
+            for game in self.owned_games(steamid)["response"]["games"]
+            if game["rtime_last_played"] >= window_start
+        ]
+        return {"response": {"total_count": len(games), "games": games}}
+
+    def app_details(self, appid: str) -> Dict:
+        rng = self.rng("app", appid)
+        if rng.random() < 0.05:
+            return {appid: {"success": False}}
+        name = " ".join(rng.choice(WORDS).title() for _ in range(rng.randint(1, 4)))
+        description = " ".join(rng.choice(WORDS) for _ in range(rng.randint(100, 1500)))
+        release_date = self.base_time - dt.timedelta(days=rng.randint(0, 365 * 20))
+        studio = f"{rng.choice(WORDS).title()} {rng.choice(['Games', 'Studios', 'Interactive', 'Software'])}"
+        data = {
+            "type": "game" if rng.random() < 0.85 else "dlc",
+            "name": name,
+            "steam_appid": int(appid),
+            "required_age": rng.choice([0, 0, 0, 12, 16, 18, "18+"]),
+            "is_free": rng.random() < 0.1,
+            "detailed_description": f"<p>{description}</p>",
+            "about_the_game": f"<p>{description[: len(description) // 2]}</p>",
+            "short_description": description[:200],
+            "developers": [studio],
+            "publishers": [studio if rng.random() < 0.5 else f"{rng.choice(WORDS).title()} Publishing"],
+            "genres": [
+                {"id": str(GENRES.index(genre) + 1), "description": genre}
+                for genre in rng.sample(GENRES, rng.randint(1, 4))
+            ],
+            "categories": [
+                {"id": CATEGORIES.index(category) + 1, "description": category}
+                for category in rng.sample(CATEGORIES, rng.randint(1, 5))
+            ],
+            "release_date": {"coming_soon": rng.random() < 0.02, "date": release_date.strftime("%d %b, %Y")},
+        }
+        if rng.random() < 0.3:
+            data["metacritic"] = {"score": rng.randint(40, 97), "url": f"https://www.metacritic.com/game/{appid}"}
+        return {appid: {"success": True, "data": data}}
+
+    # Models
+
+    def gameplay_list(
+        self, steamid: str, created_year: int, created_month: int, months_played: int = 0
+    ) -> GameplayList:
+        """
+        Returns the owned games of a player as the GameplayList snapshot the scrapper would save.
+        """
+        games = self.owned_games(steamid, months_played=months_played)["response"]["games"]
+        snapshot_time = dt.datetime(created_year, created_month, 1)
+        return GameplayList(
+            steamid=steamid,
+            gameplay_list=[
+                GameplayItem(
+                    appid=str(game["appid"]),
+                    playtime=game["playtime_forever"],
+                    last_time_played=(
+                        dt.datetime.fromtimestamp(game["rtime_last_played"]) if game["rtime_last_played"] else None
+                    ),
+                )
+                for game in games
+            ],
+            created_at=snapshot_time,
+            updated_at=snapshot_time,
+            created_year=created_year,
+            created_month=created_month,
+        )
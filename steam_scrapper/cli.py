@@ -0,0 +1,78 @@
+import importlib
+import logging
+import sys
+
+import click
+
+# command name -> "module:command", the module is only imported when its command runs or shows its help
+LAZY_COMMANDS = {
+    "scrap": "main:steam_scrap",
+    "db_ops": "db_ops:db_ops",
+    "export": "export:export",
+    "report": "reports:report",
+    "benchmark": "benchmark:benchmark",
+    "scheduler": "scheduler:scheduler",
+    "work_queue": "work_queue:work_queue",
+    "app_catalogue": "app_catalogue:app_catalogue",
+}
+
+
+class LazyGroup(click.Group):
+    """
+    Click group loading the modules of its subcommands on demand, so a command only pays for the
+    backends and dependencies it uses, and listing the commands imports none of them.
+    """
+
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_commands:
+            module_name, command_name = self.lazy_commands[cmd_name].split(":")
+            return getattr(importlib.import_module(module_name), command_name)
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        # the help of the lazy commands would import them, so only their names are listed
+        with formatter.section("Commands"):
+            formatter.write_dl([(cmd_name, "") for cmd_name in self.list_commands(ctx)])
+
+
+@click.group(cls=LazyGroup, lazy_commands=LAZY_COMMANDS)
+def cli():
+    pass
+
+
+@cli.command()
+def ping():
+    """
+    Checks the connection to the MongoDB configured in MONGO_DB_URL.
+    """
+    from config import config
+    from repos.mongo_repo import SteamMongo
+
+    if config.mongodb_url is None:
+        raise ValueError("Missing MongoDB URL Env Variable.")
+    SteamMongo(mongo_url=config.mongodb_url).ping()
+    logging.info("Connected to MongoDB.")
+
+
+def configure_logging():
+    logging.getLogger("pymongo").setLevel(logging.CRITICAL)
+    logging.getLogger("backoff").setLevel(logging.CRITICAL)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setLevel(logging.INFO)
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s - %(message)s")
+    handler.setFormatter(formatter)
+    root.addHandler(handler)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    cli()
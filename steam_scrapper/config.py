@@ -14,13 +14,25 @@ class SteamApiConfig:
     player_id: str
     mongodb_url: Optional[str]
     sleep_time_in_ms: Optional[int]
+    gameplay_partitioned: bool
+    gameplay_retention_months: Optional[int]
+    gameplay_retention_action: str
+    friend_list_history: bool
+    app_players_index: bool
 
     def __init__(self, steam_key:str=None, player_id:str=None, mongodb_url:str=None):
-        self.steam_api_url = "https://api.steampowered.com"
-        self.steam_api_url = "http://store.steampowered.com"
+        # overridable so the benchmarks can point the scrapper to a local stand-in API
+        self.steam_api_url = os.getenv("STEAM_API_URL", "http://api.steampowered.com")
+        self.steam_store_url = os.getenv("STEAM_STORE_URL", "http://store.steampowered.com")
         self.steam_key = steam_key or os.getenv("STEAM_KEY")
         self.player_id = player_id or os.getenv("PLAYER_ID")
         self.mongodb_url = mongodb_url or os.getenv("MONGO_DB_URL")
+        self.gameplay_partitioned = os.getenv("GAMEPLAY_PARTITIONED") == "True"
+        retention_months = os.getenv("GAMEPLAY_RETENTION_MONTHS")
+        self.gameplay_retention_months = int(retention_months) if retention_months else None
+        self.gameplay_retention_action = os.getenv("GAMEPLAY_RETENTION_ACTION", "drop")
+        self.friend_list_history = os.getenv("FRIEND_LIST_HISTORY") == "True"
+        self.app_players_index = os.getenv("APP_PLAYERS_INDEX") == "True"
 
 
 config = SteamApiConfig()
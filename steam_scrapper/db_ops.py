@@ -1,17 +1,33 @@
 import click
 import datetime as dt
 import logging
-from typing import Optional
+import time
+import queue
+import threading
+import multiprocessing
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Optional, List, Tuple
 
 from tqdm import tqdm
 
-from repos.mongo_repo import SteamMongo
 from config import config
-from scrapper import SteamScrapper
 from models import GameplayMonthDeltaItem, GameplayItem, GameplayMonthDeltaList
-from errors import WrongScriptInput
+from errors import WrongScriptInput, ShardedJobError, DatabaseUpdateError
+from utils import get_last_month_and_year, get_month_range
+from rollups import create_month_rollups
+from metrics import metrics, stage, InstrumentedRepo
+from profiling import Profiler, profile_dir
 
 CREATE_BATCH_SIZE = 200
+DELTA_ENGINES = ["python", "numpy", "server"]
+# engines reading the snapshots as compact models
+COMPACT_ENGINES = ["numpy"]
+BACKFILL_JOB_ID = "gameplay_delta_backfill"
+# batches computed ahead of the writer thread, bounds the memory used by the backfill pipeline
+BACKFILL_QUEUE_SIZE = 8
+# start method of the shard workers, forking would copy the live MongoClient of the parent
+SHARD_START_METHOD = "spawn"
 
 
 @click.command()
@@ -22,39 +38,216 @@ CREATE_BATCH_SIZE = 200
 @click.option("--created_year", type=int)
 @click.option("--existing_value", type=str)
 @click.option("--new_value", type=str)
-def db_ops(delete_type, create_type, update_type, created_month, created_year, existing_value, new_value):
+@click.option(
+    "--engine", type=click.Choice(DELTA_ENGINES), default="python",
+    help="How the deltas are calculated, server runs an aggregation pipeline that needs MongoDB 5.0 or later.")
+@click.option("--workers", type=click.IntRange(min=1), default=1)
+@click.option("--end_month", type=int)
+@click.option("--end_year", type=int)
+@click.option("--recompute", is_flag=True, default=False)
+@click.option("--batch_size", type=click.IntRange(min=1))
+@click.option("--max_docs_per_second", type=float)
+@click.option("--dry_run", is_flag=True, default=False)
+@click.option("--friend_graph_path", type=str, default="friend_graph.npz")
+@click.option("--metrics_textfile", type=str, help="Prometheus textfile written with the run metrics.")
+@click.option("--metrics_json", type=str, help="JSON summary written with the run metrics.")
+@click.option("--profile", is_flag=True, default=False, help="Profiles CPU and allocations per operation.")
+@click.option("--profile_dir", "profile_dir_base", default="profiles", type=str)
+def db_ops(
+    delete_type,
+    create_type,
+    update_type,
+    created_month,
+    created_year,
+    existing_value,
+    new_value,
+    engine,
+    workers,
+    end_month,
+    end_year,
+    recompute,
+    batch_size,
+    max_docs_per_second,
+    dry_run,
+    friend_graph_path,
+    metrics_textfile,
+    metrics_json,
+    profile,
+    profile_dir_base,
+):
     repo = None
 
     logging.info("Connecting to Mongo DB...")
     if config.mongodb_url is None:
         raise ValueError("Missing MongoDB URL Env Variable.")
-    repo = SteamMongo(mongo_url=config.mongodb_url)
+    from repos.mongo_repo import SteamMongo
+
+    repo = InstrumentedRepo(
+        SteamMongo(
+            mongo_url=config.mongodb_url,
+            gameplay_partitioned=config.gameplay_partitioned,
+            friend_list_history=config.friend_list_history,
+            app_players_index=config.app_players_index,
+        )
+    )
     logging.info("Connected.")
 
-    if delete_type is not None:
-        delete_by_type(delete_type, repo, created_month, created_year)
-    elif create_type is not None:
-        create_by_type(create_type, repo, created_month, created_year)
-    elif update_type is not None:
-        if existing_value is None or new_value is None:
-            raise WrongScriptInput("existing_value and new_value are missing.")
-        update_by_type(repo=repo, update_type=update_type, existing_value=existing_value, new_value=new_value)
+    try:
+        with Profiler(profile_dir(profile_dir_base, "db_ops")) if profile else nullcontext():
+            if delete_type is not None:
+                delete_by_type(delete_type, repo, created_month, created_year)
+            elif create_type is not None:
+                if end_month is not None or end_year is not None:
+                    if create_type != "gameplay_delta" or None in (created_month, created_year, end_month, end_year):
+                        raise WrongScriptInput(
+                            "Backfills require create_type gameplay_delta, created_month/created_year "
+                            "and end_month/end_year."
+                        )
+                    backfill_gameplay_delta(
+                        repo=repo,
+                        start_month=created_month,
+                        start_year=created_year,
+                        end_month=end_month,
+                        end_year=end_year,
+                        engine=engine,
+                        workers=workers,
+                        recompute=recompute,
+                    )
+                else:
+                    create_by_type(
+                        create_type,
+                        repo,
+                        created_month,
+                        created_year,
+                        engine=engine,
+                        workers=workers,
+                        friend_graph_path=friend_graph_path,
+                    )
+            elif update_type is not None:
+                if existing_value is None or new_value is None:
+                    raise WrongScriptInput("existing_value and new_value are missing.")
+                update_by_type(
+                    repo=repo,
+                    update_type=update_type,
+                    existing_value=existing_value,
+                    new_value=new_value,
+                    batch_size=batch_size,
+                    max_docs_per_second=max_docs_per_second,
+                    dry_run=dry_run,
+                )
+    finally:
+        # shard worker processes keep their own metrics, only the parent process calls are reported
+        metrics.write_outputs(textfile_path=metrics_textfile, json_path=metrics_json)
 
 
+@stage()
 def delete_by_type(delete_type, repo, created_month, created_year):
     if delete_type == "friend_list":
         repo.delete_friend_list(created_month=created_month, created_year=created_year)
     elif delete_type == "gameplay_info":
         repo.delete_gameplay_info(created_month=created_month, created_year=created_year)
+    elif delete_type == "gameplay_retention":
+        if config.gameplay_retention_months is None:
+            raise WrongScriptInput("GAMEPLAY_RETENTION_MONTHS must be set to apply the gameplay retention.")
+        current_time = dt.datetime.now()
+        expired_periods = repo.apply_gameplay_retention(
+            current_year=created_year or current_time.year,
+            current_month=created_month or current_time.month,
+            retention_months=config.gameplay_retention_months,
+            action=config.gameplay_retention_action,
+        )
+        logging.info(f"Gameplay retention applied to {len(expired_periods)} period(s).")
 
 
-def create_by_type(create_type, repo, created_month, created_year):
+@stage()
+def create_by_type(
+    create_type, repo, created_month, created_year, engine="python", workers=1, friend_graph_path="friend_graph.npz"
+):
     if create_type == "gameplay_delta":
-        create_gameplay_delta(repo=repo, created_month=created_month, created_year=created_year)
+        if created_month is None or created_year is None:
+            raise WrongScriptInput("created_month and created_year are required to create the gameplay delta.")
+        create_gameplay_delta_month(
+            repo=repo, created_month=created_month, created_year=created_year, engine=engine, workers=workers
+        )
+        # the deltas are stored under the previous month, the period their playtime was played in
+        previous_month, previous_year = get_last_month_and_year(current_year=created_year, current_month=created_month)
+        create_month_rollups(repo, created_year=previous_year, created_month=previous_month)
+    elif create_type == "player_rollups":
+        if created_month is None or created_year is None:
+            raise WrongScriptInput("created_month and created_year are required to create the player rollups.")
+        create_month_rollups(repo, created_year=created_year, created_month=created_month)
+    elif create_type == "friend_graph":
+        from friend_graph import FriendGraph
+
+        friend_graph = FriendGraph.from_repo(repo)
+        friend_graph.save(friend_graph_path)
+        logging.info(f"Friend graph saved to {friend_graph_path}.")
+    elif create_type == "app_players":
+        if created_month is None or created_year is None:
+            raise WrongScriptInput("created_month and created_year are required to rebuild the app players index.")
+        for source in ["gameplay_info", "gameplay_delta"]:
+            indexed_apps = repo.rebuild_app_players(source, created_year=created_year, created_month=created_month)
+            logging.info(f"App players index of {source} for {created_year}/{created_month:02d}: {indexed_apps} apps.")
+    elif create_type == "gameplay_partitions":
+        repo.migrate_gameplay_to_buckets()
+    elif create_type == "friend_list_history":
+        migrated = repo.migrate_friend_lists_to_history()
+        logging.info(f"{migrated} friend lists copied to the history.")
+
 
+@stage()
+def create_gameplay_delta_month(
+    repo, created_month, created_year, engine="python", workers=1, current_time: Optional[dt.datetime] = None
+) -> int:
+    """
+    Creates the gameplay deltas of a month with the informed engine, returning the number of deltas saved.
 
-def update_by_type(update_type, repo, existing_value, new_value):
-    repo.batch_update_type(doc_type=update_type, query=existing_value, new_value=new_value)
+    :param current_time: created_at and updated_at of every delta, whatever the engine, so the deltas of the run
+        can be told apart from the ones left by previous runs
+    :type current_time: datetime
+    """
+    current_time = current_time or dt.datetime.now()
+    if engine == "server":
+        # the deltas are computed by an aggregation pipeline, no snapshot leaves the database
+        saved_documents = repo.create_gameplay_delta_server_side(
+            created_year=created_year, created_month=created_month, current_time=current_time
+        )
+        logging.info(f"Gameplay deltas for {created_year}/{created_month:02d}: {saved_documents} saved.")
+        return saved_documents
+    if workers > 1:
+        return create_gameplay_delta_sharded(
+            repo=repo,
+            created_month=created_month,
+            created_year=created_year,
+            engine=engine,
+            workers=workers,
+            current_time=current_time,
+        )
+    return create_gameplay_delta(
+        repo=repo, created_month=created_month, created_year=created_year, engine=engine, current_time=current_time
+    )
+
+
+@stage()
+def update_by_type(
+    update_type, repo, existing_value, new_value, batch_size=None, max_docs_per_second=None, dry_run=False
+):
+    summary = repo.batch_update_type(
+        doc_type=update_type,
+        query=existing_value,
+        new_value=new_value,
+        batch_size=batch_size,
+        max_docs_per_second=max_docs_per_second,
+        dry_run=dry_run,
+    )
+    if dry_run:
+        logging.info(
+            f"Dry run for {update_type}: {summary['matched']} matched documents in {summary['batches']} batch(es), "
+            f"about {summary['estimated_bytes']} bytes rewritten"
+            + (f" in {summary['estimated_seconds']:.1f}s." if summary["estimated_seconds"] is not None else ".")
+        )
+    else:
+        logging.info(f"Updated {update_type}: {summary['matched']} matched, {summary['modified']} modified.")
 
 
 def calculate_gameplay_delta(
@@ -80,29 +273,372 @@ def calculate_gameplay_delta(
         total_playtime=total_gameplay,
         created_year=previous_gameplay.created_year,
         created_month=previous_gameplay.created_month,
-        created_at=dt.datetime.now(),
-        updated_at=dt.datetime.now(),
+        created_at=current_time,
+        updated_at=current_time,
     )
 
 
-def create_gameplay_delta(repo, created_month, created_year):
-    current_time = dt.datetime.now()
-    existing_gameplay_list = repo.get_gameplay_info_by_id(created_year=created_year, created_month=created_month)
-    for batch_start in tqdm(range(0, len(existing_gameplay_list), CREATE_BATCH_SIZE)):
-        current_items = existing_gameplay_list[batch_start : batch_start + CREATE_BATCH_SIZE]
-        current_items_ids = [item.steamid for item in current_items]
-        previous_month = (created_month - 1) if created_month > 1 else 12
-        previous_year = created_year if previous_month != 12 else (created_year - 1)
-        previous_month_gameplay_list = repo.get_gameplay_info_by_id_list(
-            player_id_list=current_items_ids, created_year=previous_year, created_month=previous_month
+def calculate_gameplay_delta_items(
+    repo, current_items, previous_month, previous_year, engine="python", current_time: Optional[dt.datetime] = None
+) -> List[GameplayMonthDeltaList]:
+    """
+    Calculates the deltas of a batch of current month snapshots against their previous month snapshots.
+    """
+    current_items_ids = [str(item.steamid) for item in current_items]
+    previous_month_gameplay_list = repo.get_gameplay_info_by_id_list(
+        player_id_list=current_items_ids,
+        created_year=previous_year,
+        created_month=previous_month,
+        compact=engine in COMPACT_ENGINES,
+    )
+    previous_month_gameplay_dict = {item.steamid: item for item in previous_month_gameplay_list}
+    if engine == "numpy":
+        from delta_engine import calculate_gameplay_delta_batch
+
+        return calculate_gameplay_delta_batch(current_items, previous_month_gameplay_dict, current_time=current_time)
+    return [
+        calculate_gameplay_delta(current, previous_month_gameplay_dict[current.steamid], current_time=current_time)
+        for current in current_items
+        if current.steamid in previous_month_gameplay_dict
+    ]
+
+
+def create_gameplay_delta_batch(
+    repo, current_items, previous_month, previous_year, engine="python", current_time: Optional[dt.datetime] = None
+) -> int:
+    """
+    Calculates and saves the deltas of a batch of current month snapshots, returning the number saved.
+    """
+    items_to_save = calculate_gameplay_delta_items(
+        repo, current_items, previous_month, previous_year, engine=engine, current_time=current_time
+    )
+    repo.save_gameplay_delta_info_list(gameplay_delta_info_list=items_to_save)
+    return len(items_to_save)
+
+
+def create_gameplay_delta(
+    repo, created_month, created_year, engine="python", current_time: Optional[dt.datetime] = None
+) -> int:
+    """
+    Creates the gameplay deltas between the informed month and the previous one.
+    The current month snapshots are streamed in steamid order, and the previous month snapshots are
+    fetched for each batch only, so memory stays flat regardless of the collection size.
+    The numpy engine diffs each whole batch at once instead of looping over every player, reading the
+    snapshots as compact models.
+    """
+    current_time = current_time or dt.datetime.now()
+    previous_month, previous_year = get_last_month_and_year(current_year=created_year, current_month=created_month)
+    total_documents = repo.count_gameplay_info(created_year=created_year, created_month=created_month)
+    processed_documents = 0
+    saved_documents = 0
+    start_time = time.monotonic()
+    with tqdm(total=total_documents, desc="Gameplay Delta", unit="docs") as progress:
+        for current_items in repo.iter_gameplay_info_batches(
+            created_year=created_year,
+            created_month=created_month,
+            batch_size=CREATE_BATCH_SIZE,
+            compact=engine in COMPACT_ENGINES,
+        ):
+            saved_documents += create_gameplay_delta_batch(
+                repo, current_items, previous_month, previous_year, engine=engine, current_time=current_time
+            )
+            processed_documents += len(current_items)
+            progress.update(len(current_items))
+    log_gameplay_delta_summary(created_year, created_month, saved_documents, processed_documents, start_time)
+    return saved_documents
+
+
+def log_gameplay_delta_summary(created_year, created_month, saved_documents, processed_documents, start_time):
+    elapsed_time = time.monotonic() - start_time
+    logging.info(
+        f"Gameplay deltas for {created_year}/{created_month:02d}: {saved_documents} saved from {processed_documents} "
+        f"snapshots in {elapsed_time:.1f}s ({processed_documents / elapsed_time if elapsed_time else 0:.1f} docs/s)."
+    )
+
+
+def gameplay_delta_job_id(created_year: int, created_month: int) -> str:
+    return f"gameplay_delta_{created_year:04d}_{created_month:02d}"
+
+
+def run_gameplay_delta_shard(
+    shard_idx: int,
+    min_steamid: Optional[str],
+    max_steamid: Optional[str],
+    created_month: int,
+    created_year: int,
+    engine: str,
+    progress_queue,
+    repo_settings: Dict,
+    current_time: dt.datetime,
+) -> Tuple[int, int, int]:
+    """
+    Creates the gameplay deltas of one steamid range. Runs in a worker process with its own connection,
+    reporting the processed snapshots of each batch through progress_queue.
+
+    :param repo_settings: SteamMongo arguments of the parent, the spawned process does not share its config
+    :type repo_settings: Dict
+    :param current_time: time of the whole run, every shard stamps its deltas with it
+    :type current_time: datetime
+    """
+    from repos.mongo_repo import SteamMongo
+
+    repo = SteamMongo(**repo_settings)
+    previous_month, previous_year = get_last_month_and_year(current_year=created_year, current_month=created_month)
+    processed_documents = 0
+    saved_documents = 0
+    for current_items in repo.iter_gameplay_info_batches(
+        created_year=created_year,
+        created_month=created_month,
+        batch_size=CREATE_BATCH_SIZE,
+        min_steamid=min_steamid,
+        max_steamid=max_steamid,
+        compact=engine in COMPACT_ENGINES,
+    ):
+        saved_documents += create_gameplay_delta_batch(
+            repo, current_items, previous_month, previous_year, engine=engine, current_time=current_time
+        )
+        processed_documents += len(current_items)
+        progress_queue.put(len(current_items))
+    return shard_idx, processed_documents, saved_documents
+
+
+def create_gameplay_delta_sharded(
+    repo, created_month, created_year, engine="python", workers=2, current_time: Optional[dt.datetime] = None
+) -> int:
+    """
+    Creates the gameplay deltas like create_gameplay_delta, with the steamid space split in disjoint
+    ranges processed by a pool of worker processes.
+    The shard boundaries and the finished shards are kept in a job marker, so a rerun after a failure
+    keeps the same shards and only processes the ones that did not finish.
+    """
+    current_time = current_time or dt.datetime.now()
+    job_id = gameplay_delta_job_id(created_year, created_month)
+    marker = repo.get_job_marker(job_id)
+    if marker is None:
+        boundaries = repo.get_gameplay_steamid_boundaries(
+            created_year=created_year, created_month=created_month, shard_count=workers
         )
-        previous_month_gameplay_dict = {item.steamid: item for item in previous_month_gameplay_list}
-        items_to_save = [
-            calculate_gameplay_delta(current, previous_month_gameplay_dict[current.steamid], current_time=current_time)
-            for current in current_items
-            if current.steamid in previous_month_gameplay_dict
-        ]
-        repo.save_gameplay_delta_info_list(gameplay_delta_info_list=items_to_save)
+        marker = repo.start_job_marker(job_id, plan={"boundaries": boundaries})
+    else:
+        logging.info(f"Resuming {job_id}, {len(marker['completed'])} shard(s) already completed.")
+    boundaries = marker["plan"]["boundaries"]
+    shards: List[Tuple[int, Optional[str], Optional[str]]] = [
+        (shard_idx, boundaries[shard_idx], boundaries[shard_idx + 1])
+        for shard_idx in range(len(boundaries) - 1)
+        if str(shard_idx) not in marker["completed"]
+    ]
+
+    total_documents = repo.count_gameplay_info(created_year=created_year, created_month=created_month)
+    processed_documents = 0
+    saved_documents = 0
+    failed_shards = []
+    start_time = time.monotonic()
+    repo_settings = {
+        "mongo_url": config.mongodb_url,
+        "gameplay_partitioned": config.gameplay_partitioned,
+        "friend_list_history": config.friend_list_history,
+        "app_players_index": config.app_players_index,
+    }
+    # MongoClient is not fork safe, the workers are spawned and connect on their own
+    mp_context = multiprocessing.get_context(SHARD_START_METHOD)
+    with mp_context.Manager() as manager, ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as executor:
+        progress_queue = manager.Queue()
+        futures = {
+            executor.submit(
+                run_gameplay_delta_shard,
+                shard_idx,
+                min_steamid,
+                max_steamid,
+                created_month,
+                created_year,
+                engine,
+                progress_queue,
+                repo_settings,
+                current_time,
+            ): shard_idx
+            for shard_idx, min_steamid, max_steamid in shards
+        }
+        pending = set(futures)
+        with tqdm(total=total_documents, desc="Gameplay Delta", unit="docs") as progress:
+            while pending:
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                drain_progress_queue(progress_queue, progress)
+                for future in done:
+                    shard_idx = futures[future]
+                    try:
+                        _, shard_processed, shard_saved = future.result()
+                    except Exception as e:
+                        logging.error(f"Shard {shard_idx} of {job_id} failed: {e}")
+                        failed_shards.append(shard_idx)
+                        continue
+                    repo.complete_job_step(job_id, str(shard_idx))
+                    processed_documents += shard_processed
+                    saved_documents += shard_saved
+            drain_progress_queue(progress_queue, progress)
+
+    log_gameplay_delta_summary(created_year, created_month, saved_documents, processed_documents, start_time)
+    if failed_shards:
+        raise ShardedJobError(f"Shards {sorted(failed_shards)} of {job_id} failed, rerun to retry them.")
+    repo.delete_job_marker(job_id)
+    return saved_documents
+
+
+def backfill_step(created_year: int, created_month: int) -> str:
+    return f"{created_year:04d}_{created_month:02d}"
+
+
+@stage()
+def verify_gameplay_delta_month(
+    repo, created_month, created_year, current_time: dt.datetime, saved_documents: int
+) -> None:
+    """
+    Checks the deltas created for a month were persisted, rolls them up and records the month as completed
+    in the backfill marker. Deltas are stored under the previous month, the period their playtime was played in.
+    Every engine stamps the deltas of a run with its current_time, so only the deltas written by this run are
+    counted: one left by a previous run does not stand in for a write that was lost.
+
+    :param current_time: updated_at of the deltas written by the run
+    :type current_time: datetime
+    :param saved_documents: number of deltas the engine reported as saved
+    :type saved_documents: int
+    """
+    previous_month, previous_year = get_last_month_and_year(current_year=created_year, current_month=created_month)
+    stored_documents = repo.count_gameplay_delta_info(
+        created_year=previous_year, created_month=previous_month, updated_at=current_time
+    )
+    if stored_documents < saved_documents:
+        raise DatabaseUpdateError(
+            f"Gameplay deltas for {created_year}/{created_month:02d} not verified, "
+            f"{saved_documents} saved but {stored_documents} stored by this run."
+        )
+    create_month_rollups(repo, created_year=previous_year, created_month=previous_month)
+    repo.complete_job_step(BACKFILL_JOB_ID, backfill_step(created_year, created_month))
+
+
+class GameplayDeltaWriter(threading.Thread):
+    """
+    Background thread saving the backfill deltas, so the reads and calculations of the next batches and
+    months overlap with the writes of the previous ones. A month is verified and marked as completed
+    once all of its batches were written.
+    """
+
+    def __init__(self, repo):
+        super().__init__(daemon=True)
+        self.repo = repo
+        self.write_queue = queue.Queue(maxsize=BACKFILL_QUEUE_SIZE)
+        self.error: Optional[Exception] = None
+
+    def run(self):
+        while (task := self.write_queue.get()) is not None:
+            if self.error is not None:
+                # after a failure the queue is only drained, so the producer is never blocked
+                continue
+            try:
+                if isinstance(task, list):
+                    self.repo.save_gameplay_delta_info_list(gameplay_delta_info_list=task)
+                else:
+                    verify_gameplay_delta_month(self.repo, *task)
+            except Exception as e:
+                self.error = e
+
+    def save(self, gameplay_delta_list: List[GameplayMonthDeltaList]) -> None:
+        self.raise_if_failed()
+        self.write_queue.put(gameplay_delta_list)
+
+    def complete_month(
+        self, created_month: int, created_year: int, current_time: dt.datetime, saved_documents: int
+    ) -> None:
+        self.raise_if_failed()
+        self.write_queue.put((created_month, created_year, current_time, saved_documents))
+
+    def close(self) -> None:
+        self.write_queue.put(None)
+        self.join()
+        self.raise_if_failed()
+
+    def raise_if_failed(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+
+@stage()
+def backfill_gameplay_delta(
+    repo, start_month, start_year, end_month, end_year, engine="python", workers=1, recompute=False
+) -> List[Tuple[int, int]]:
+    """
+    Creates the gameplay deltas of every month from the start to the end period, both included.
+    Completed months are recorded in the backfill job marker and skipped by later runs, unless recompute
+    is set. With the python and numpy engines the months are pipelined: a writer thread saves the deltas
+    while the next batches are read and calculated. Returns the months processed.
+
+    :param recompute: clears the completion markers of the range, so every month is created again
+    :type recompute: bool
+    """
+    periods = get_month_range(start_year=start_year, start_month=start_month, end_year=end_year, end_month=end_month)
+    if not periods:
+        raise WrongScriptInput("The backfill end period must not be before the start period.")
+    marker = repo.start_job_marker(BACKFILL_JOB_ID, plan={})
+    if recompute:
+        repo.reset_job_steps(BACKFILL_JOB_ID, [backfill_step(year, month) for year, month in periods])
+        marker = repo.get_job_marker(BACKFILL_JOB_ID)
+    pending_periods = [
+        (year, month) for year, month in periods if backfill_step(year, month) not in marker["completed"]
+    ]
+    logging.info(
+        f"Backfilling {len(pending_periods)} month(s), {len(periods) - len(pending_periods)} already completed."
+    )
+
+    if engine == "server" or workers > 1:
+        # these engines already parallelise each month, so the months run one after the other
+        for year, month in pending_periods:
+            current_time = dt.datetime.now()
+            saved_documents = create_gameplay_delta_month(
+                repo=repo,
+                created_month=month,
+                created_year=year,
+                engine=engine,
+                workers=workers,
+                current_time=current_time,
+            )
+            verify_gameplay_delta_month(repo, month, year, current_time, saved_documents)
+        return pending_periods
+
+    writer = GameplayDeltaWriter(repo)
+    writer.start()
+    try:
+        for year, month in pending_periods:
+            current_time = dt.datetime.now()
+            previous_month, previous_year = get_last_month_and_year(current_year=year, current_month=month)
+            saved_documents = 0
+            with tqdm(
+                total=repo.count_gameplay_info(created_year=year, created_month=month),
+                desc=f"Gameplay Delta {year}/{month:02d}",
+                unit="docs",
+            ) as progress:
+                for current_items in repo.iter_gameplay_info_batches(
+                    created_year=year,
+                    created_month=month,
+                    batch_size=CREATE_BATCH_SIZE,
+                    compact=engine in COMPACT_ENGINES,
+                ):
+                    items_to_save = calculate_gameplay_delta_items(
+                        repo, current_items, previous_month, previous_year, engine=engine, current_time=current_time
+                    )
+                    writer.save(items_to_save)
+                    saved_documents += len(items_to_save)
+                    progress.update(len(current_items))
+            writer.complete_month(month, year, current_time, saved_documents)
+    finally:
+        writer.close()
+    return pending_periods
+
+
+def drain_progress_queue(progress_queue, progress) -> None:
+    while True:
+        try:
+            progress.update(progress_queue.get_nowait())
+        except queue.Empty:
+            return
 
 
 def configure_logging():
@@ -0,0 +1,131 @@
+import datetime as dt
+from itertools import chain
+from operator import attrgetter
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from models import CompactGameplayList, GameplayList, GameplayMonthDeltaItem, GameplayMonthDeltaList
+
+
+def flatten_gameplay(gameplay_info_list: List[GameplayList]):
+    """
+    Flattens the gameplay snapshots into parallel arrays of player index, appid and playtime.
+    """
+    counts = np.fromiter((len(item.gameplay_list) for item in gameplay_info_list), dtype=np.int64)
+    player_index = np.repeat(np.arange(len(gameplay_info_list), dtype=np.int64), counts)
+    gameplay_items = list(chain.from_iterable(item.gameplay_list for item in gameplay_info_list))
+    appids = [str(appid) for appid in map(attrgetter("appid"), gameplay_items)]
+    playtimes = np.fromiter(map(attrgetter("playtime"), gameplay_items), dtype=np.int64, count=len(gameplay_items))
+    return player_index, appids, playtimes
+
+
+def flatten_compact_gameplay(gameplay_info_list: List[CompactGameplayList]):
+    """
+    Flattens compact snapshots like flatten_gameplay, their appid and playtime columns being read as
+    int64 arrays without going through python objects.
+    """
+    counts = np.fromiter((len(item) for item in gameplay_info_list), dtype=np.int64)
+    player_index = np.repeat(np.arange(len(gameplay_info_list), dtype=np.int64), counts)
+    appids = np.concatenate([np.frombuffer(item.appids, dtype=np.int64) for item in gameplay_info_list])
+    playtimes = np.concatenate([np.frombuffer(item.playtimes, dtype=np.int64) for item in gameplay_info_list])
+    return player_index, appids, playtimes
+
+
+def encode_appids(current_appids: List[str], previous_appids: List[str]):
+    """
+    Converts the appids to integer codes. Steam appids are numeric, other values fall back to dense codes.
+    """
+    try:
+        return (
+            np.fromiter(map(int, current_appids), dtype=np.int64, count=len(current_appids)),
+            np.fromiter(map(int, previous_appids), dtype=np.int64, count=len(previous_appids)),
+        )
+    except ValueError:
+        _, codes = np.unique(np.array(current_appids + previous_appids, dtype=str), return_inverse=True)
+        codes = codes.reshape(-1).astype(np.int64)
+        return codes[: len(current_appids)], codes[len(current_appids) :]
+
+
+def calculate_gameplay_delta_batch(
+    current_gameplay_list: Union[List[GameplayList], List[CompactGameplayList]],
+    previous_gameplay_dict: Union[Dict[str, GameplayList], Dict[int, CompactGameplayList]],
+    current_time: Optional[dt.datetime] = None,
+) -> List[GameplayMonthDeltaList]:
+    """
+    Vectorised version of calculate_gameplay_delta for a batch of players.
+
+    Every (player, appid) pair is encoded as a single int64 key, the previous month keys are sorted
+    once and the current month keys are matched with searchsorted, so the whole batch is diffed
+    with array operations. Model objects are only built for the positive deltas of the result.
+    Players without a previous month snapshot are skipped, like in the per player version.
+    Compact snapshots skip the appid encoding, their appids being ints already, and both months must
+    be of the same kind. The deltas are returned as GameplayMonthDeltaList in both cases.
+
+    :param current_gameplay_list: the snapshots of the month being closed
+    :type current_gameplay_list: List[GameplayList] or List[CompactGameplayList]
+    :param previous_gameplay_dict: the previous month snapshots by steamid
+    :type previous_gameplay_dict: Dict[str, GameplayList] or Dict[int, CompactGameplayList]
+    """
+    current_time = current_time or dt.datetime.now()
+    current_list = [item for item in current_gameplay_list if item.steamid in previous_gameplay_dict]
+    if not current_list:
+        return []
+    previous_list = [previous_gameplay_dict[item.steamid] for item in current_list]
+
+    if isinstance(current_list[0], CompactGameplayList):
+        current_player, current_codes, current_playtime = flatten_compact_gameplay(current_list)
+        previous_player, previous_codes, previous_playtime = flatten_compact_gameplay(previous_list)
+        current_appids = None
+    else:
+        current_player, current_appids, current_playtime = flatten_gameplay(current_list)
+        previous_player, previous_appids, previous_playtime = flatten_gameplay(previous_list)
+        current_codes, previous_codes = encode_appids(current_appids, previous_appids)
+
+    # each (player, appid) pair is packed in a single sortable int64 key
+    code_count = int(max(current_codes.max(initial=0), previous_codes.max(initial=0))) + 1
+    current_keys = current_player * code_count + current_codes
+    previous_keys = previous_player * code_count + previous_codes
+
+    # a stable sort plus side="right" matches the last duplicate appid, like the dict in the per player version
+    matched_playtime = np.zeros(len(current_keys), dtype=np.int64)
+    if len(previous_keys):
+        previous_order = np.argsort(previous_keys, kind="stable")
+        previous_sorted_keys = previous_keys[previous_order]
+        previous_sorted_playtime = previous_playtime[previous_order]
+        positions = np.searchsorted(previous_sorted_keys, current_keys, side="right") - 1
+        safe_positions = np.clip(positions, 0, None)
+        matched = (positions >= 0) & (previous_sorted_keys[safe_positions] == current_keys)
+        matched_playtime[matched] = previous_sorted_playtime[safe_positions[matched]]
+
+    deltas = current_playtime - matched_playtime
+    positive = deltas > 0
+    positive_player = current_player[positive]
+    totals = np.bincount(positive_player, weights=deltas[positive], minlength=len(current_list)).astype(np.int64)
+    boundaries = np.searchsorted(positive_player, np.arange(len(current_list) + 1)).tolist()
+
+    # model objects are only created for the positive deltas, from plain python lists
+    if current_appids is None:
+        positive_appids = list(map(str, current_codes[positive].tolist()))
+    else:
+        positive_appids = [current_appids[idx] for idx in np.nonzero(positive)[0].tolist()]
+    positive_deltas = deltas[positive].tolist()
+    result = []
+    for player_idx, current_gameplay in enumerate(current_list):
+        start, end = boundaries[player_idx], boundaries[player_idx + 1]
+        previous_gameplay = previous_list[player_idx]
+        result.append(
+            GameplayMonthDeltaList(
+                steamid=str(current_gameplay.steamid),
+                gameplay_delta_list=[
+                    GameplayMonthDeltaItem(appid=appid, playtime=playtime)
+                    for appid, playtime in zip(positive_appids[start:end], positive_deltas[start:end])
+                ],
+                total_playtime=int(totals[player_idx]),
+                created_year=previous_gameplay.created_year,
+                created_month=previous_gameplay.created_month,
+                created_at=current_time,
+                updated_at=current_time,
+            )
+        )
+    return result
@@ -33,3 +33,19 @@ class WrongScriptInput(Exception):
     """
 
     pass
+
+
+class ShardedJobError(Exception):
+    """
+    One or more shards of a sharded job failed, the completed ones are skipped on the next run.
+    """
+
+    pass
+
+
+class AppCatalogueSyncError(Exception):
+    """
+    The Steam app catalogue could not be listed, the local catalogue is left as it was.
+    """
+
+    pass
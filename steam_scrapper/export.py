@@ -0,0 +1,279 @@
+import click
+import datetime as dt
+import json
+import logging
+import os
+from typing import Dict, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from repos.mongo_repo import SteamMongo
+from config import config
+from errors import WrongScriptInput
+from utils import to_epoch
+
+EXPORT_BATCH_SIZE = 5000
+EXPORT_FILE_NAME = "part-0.parquet"
+# beside the parquet file, readers skip files starting with an underscore
+WATERMARK_FILE_NAME = "_watermark.json"
+
+GAMEPLAY_SCHEMA = pa.schema(
+    [
+        ("steamid", pa.string()),
+        ("appid", pa.string()),
+        ("playtime", pa.int64()),
+        ("last_time_played", pa.timestamp("us")),
+        ("created_at", pa.timestamp("us")),
+        ("updated_at", pa.timestamp("us")),
+    ]
+)
+
+GAMEPLAY_DELTA_SCHEMA = pa.schema(
+    [
+        ("steamid", pa.string()),
+        ("appid", pa.string()),
+        ("playtime", pa.int64()),
+        ("total_playtime", pa.int64()),
+        ("created_at", pa.timestamp("us")),
+        ("updated_at", pa.timestamp("us")),
+    ]
+)
+
+STEAM_PROFILE_SCHEMA = pa.schema(
+    [
+        ("steamid", pa.string()),
+        ("persona_name", pa.string()),
+        ("profile_url", pa.string()),
+        ("avatar", pa.string()),
+        ("avatar_medium", pa.string()),
+        ("avatar_full", pa.string()),
+        ("last_logoff", pa.int64()),
+        ("time_created", pa.int64()),
+        ("real_name", pa.string()),
+        ("loc_country", pa.string()),
+        ("loc_state", pa.string()),
+        ("missing_in_action", pa.bool_()),
+        ("killed_in_action", pa.bool_()),
+        ("persona_state", pa.int64()),
+        ("created_at", pa.timestamp("us")),
+        ("updated_at", pa.timestamp("us")),
+        ("last_failed_update_attempt", pa.timestamp("us")),
+    ]
+)
+
+GAME_INFO_SCHEMA = pa.schema(
+    [
+        ("appid", pa.string()),
+        ("name", pa.string()),
+        ("type", pa.string()),
+        ("min_age", pa.int64()),
+        ("description", pa.string()),
+        ("developers", pa.list_(pa.string())),
+        ("publishers", pa.list_(pa.string())),
+        ("genres", pa.list_(pa.string())),
+        ("categories", pa.list_(pa.string())),
+        ("about", pa.string()),
+        ("is_free", pa.bool_()),
+        ("release_date", pa.timestamp("us")),
+        ("metacritic_score", pa.int64()),
+        ("created_at", pa.timestamp("us")),
+        ("updated_at", pa.timestamp("us")),
+        ("last_failed_update_attempt", pa.timestamp("us")),
+    ]
+)
+
+
+def gameplay_rows(document: Dict) -> List[Dict]:
+    return [
+        {
+            "steamid": document["steamid"],
+            "appid": str(item["appid"]),
+            "playtime": item["playtime"],
+            "last_time_played": item.get("last_time_played"),
+            "created_at": document.get("created_at"),
+            "updated_at": document.get("updated_at"),
+        }
+        for item in document.get("gameplay_list", [])
+    ]
+
+
+def gameplay_delta_rows(document: Dict) -> List[Dict]:
+    return [
+        {
+            "steamid": document["steamid"],
+            "appid": str(item["appid"]),
+            "playtime": item["playtime"],
+            "total_playtime": document.get("total_playtime"),
+            "created_at": document.get("created_at"),
+            "updated_at": document.get("updated_at"),
+        }
+        for item in document.get("gameplay_delta_list", [])
+    ]
+
+
+def steam_profile_rows(document: Dict) -> List[Dict]:
+    row = {field.name: document.get(field.name) for field in STEAM_PROFILE_SCHEMA}
+    row["last_logoff"] = to_epoch(row["last_logoff"])
+    row["time_created"] = to_epoch(row["time_created"])
+    return [row]
+
+
+def game_info_rows(document: Dict) -> List[Dict]:
+    row = {field.name: document.get(field.name) for field in GAME_INFO_SCHEMA}
+    row["appid"] = str(row["appid"])
+    return [row]
+
+
+# doc_type => (schema, row builder, partitioned by created period)
+EXPORT_TYPES = {
+    "gameplay_info": (GAMEPLAY_SCHEMA, gameplay_rows, True),
+    "gameplay_delta": (GAMEPLAY_DELTA_SCHEMA, gameplay_delta_rows, True),
+    "steam_profile": (STEAM_PROFILE_SCHEMA, steam_profile_rows, False),
+    "game_info": (GAME_INFO_SCHEMA, game_info_rows, False),
+}
+
+
+@click.command()
+@click.option("--doc_type", "doc_types", type=click.Choice(list(EXPORT_TYPES)), multiple=True)
+@click.option("--output_dir", type=str, default="exports")
+@click.option("--created_month", type=int)
+@click.option("--created_year", type=int)
+@click.option("--incremental/--full", default=False)
+@click.option("--batch_size", type=int, default=EXPORT_BATCH_SIZE)
+def export(doc_types, output_dir, created_month, created_year, incremental, batch_size):
+    """
+    Exports the MongoDB collections into Parquet datasets partitioned by year and month.
+    """
+    logging.info("Connecting to Mongo DB...")
+    if config.mongodb_url is None:
+        raise ValueError("Missing MongoDB URL Env Variable.")
+    repo = SteamMongo(mongo_url=config.mongodb_url)
+    logging.info("Connected.")
+
+    for doc_type in doc_types or EXPORT_TYPES.keys():
+        export_doc_type(
+            repo=repo,
+            doc_type=doc_type,
+            output_dir=output_dir,
+            created_month=created_month,
+            created_year=created_year,
+            incremental=incremental,
+            batch_size=batch_size,
+        )
+
+
+def export_doc_type(
+    repo: SteamMongo,
+    doc_type: str,
+    output_dir: str,
+    created_month: Optional[int] = None,
+    created_year: Optional[int] = None,
+    incremental: bool = False,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    current_time: Optional[dt.datetime] = None,
+) -> List[str]:
+    """
+    Writes one Parquet partition per period for a document type and returns the written paths.
+
+    Gameplay and delta documents are immutable snapshots, so they are partitioned by their
+    created_year/created_month. Profiles and game info are overwritten in place by the scrapper,
+    so they are exported as a snapshot of the whole collection under the current year/month.
+
+    :param incremental: skips the partitions whose documents did not change since a previous export, compared by
+        the watermark, the document count and latest updated_at, written beside each partition
+    :type incremental: bool
+    """
+    if doc_type not in EXPORT_TYPES:
+        raise WrongScriptInput(f"Invalid export type {doc_type}.")
+    current_time = current_time or dt.datetime.now()
+    schema, row_builder, by_created_period = EXPORT_TYPES[doc_type]
+
+    if by_created_period:
+        periods = [
+            (year, month)
+            for year, month in repo.get_created_periods(doc_type)
+            if (created_year is None or year == created_year) and (created_month is None or month == created_month)
+        ]
+        period_keys = ("created_year", "created_month")
+    else:
+        periods = [(current_time.year, current_time.month)]
+        period_keys = ("snapshot_year", "snapshot_month")
+
+    written_paths = []
+    for year, month in periods:
+        partition_dir = os.path.join(
+            output_dir, doc_type, f"{period_keys[0]}={year}", f"{period_keys[1]}={month:02d}"
+        )
+        partition_path = os.path.join(partition_dir, EXPORT_FILE_NAME)
+        query = {"created_year": year, "created_month": month} if by_created_period else {}
+        watermark = repo.get_documents_watermark(doc_type, query=query)
+        if incremental and os.path.exists(partition_path) and read_watermark(partition_dir) == watermark:
+            logging.info(f"Skipping unchanged partition {partition_dir}.")
+            continue
+        row_count = write_partition(
+            partition_path=partition_path,
+            schema=schema,
+            row_batches=(
+                [row for document in batch for row in row_builder(document)]
+                for batch in repo.iter_documents(doc_type, query=query, batch_size=batch_size)
+            ),
+            desc=f"{doc_type} {year}/{month:02d}",
+        )
+        write_watermark(partition_dir, watermark)
+        logging.info(f"Exported {row_count} rows to {partition_path}.")
+        written_paths.append(partition_path)
+    return written_paths
+
+
+def read_watermark(partition_dir: str) -> Optional[Dict]:
+    watermark_path = os.path.join(partition_dir, WATERMARK_FILE_NAME)
+    if not os.path.exists(watermark_path):
+        return None
+    with open(watermark_path) as watermark_file:
+        return json.load(watermark_file)
+
+
+def write_watermark(partition_dir: str, watermark: Dict) -> None:
+    """
+    Written after the partition, so a watermark never describes a partition that was not fully exported.
+    """
+    with open(os.path.join(partition_dir, WATERMARK_FILE_NAME), "w") as watermark_file:
+        json.dump(watermark, watermark_file)
+
+
+def write_partition(partition_path: str, schema: pa.Schema, row_batches: Iterator[List[Dict]], desc: str) -> int:
+    """
+    Streams row batches into a single Parquet file. The file is written under a temporary name
+    and renamed at the end, so an interrupted export never leaves a partition that looks complete.
+    """
+    os.makedirs(os.path.dirname(partition_path), exist_ok=True)
+    tmp_path = f"{partition_path}.tmp"
+    row_count = 0
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for rows in tqdm(row_batches, desc=desc, unit="batch"):
+            if not rows:
+                continue
+            writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+            row_count += len(rows)
+    os.replace(tmp_path, partition_path)
+    return row_count
+
+
+def configure_logging():
+    import sys
+
+    logging.getLogger("pymongo").setLevel(logging.CRITICAL)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setLevel(logging.INFO)
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s - %(message)s")
+    handler.setFormatter(formatter)
+    root.addHandler(handler)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    export()
@@ -0,0 +1,196 @@
+import logging
+import os
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from models import SteamFriendList
+
+EMPTY_IDS = np.zeros(0, dtype=np.int64)
+
+
+class FriendGraph:
+    """
+    Undirected friend graph in CSR form, built from the friend lists saved by the scrapper.
+
+    Steam ids are stored as int64 and mapped to dense node indexes through the sorted nodes array, so
+    the neighbours of a node are the sorted slice indices[indptr[node]:indptr[node + 1]]. An edge exists
+    when either player lists the other, as friend lists are only fetched for some of the players.
+
+    The asserted (owner, friend) edges are kept next to the CSR arrays, so saving a newer friend list
+    only replaces the edges of its owner. Updates are buffered and applied on the next query or flush,
+    which rebuilds the CSR arrays with vectorised operations instead of once per list.
+    """
+
+    def __init__(self, owners: np.ndarray = EMPTY_IDS, friends: np.ndarray = EMPTY_IDS):
+        self.owners = owners.astype(np.int64)
+        self.friends = friends.astype(np.int64)
+        self._pending: Dict[int, np.ndarray] = {}
+        self._build()
+
+    # Building
+
+    @classmethod
+    def from_friend_lists(cls, friend_lists: Iterable[SteamFriendList]) -> "FriendGraph":
+        graph = cls()
+        graph.update_friend_lists(friend_lists)
+        graph.flush()
+        return graph
+
+    @classmethod
+    def from_repo(cls, repo, batch_size: int = 1000) -> "FriendGraph":
+        """
+        Builds the graph from the latest friend list of every player, streaming the raw documents.
+        """
+        latest_lists = {}
+        for documents in repo.iter_documents("friend_list", batch_size=batch_size):
+            for document in documents:
+                period = (document.get("created_year") or 0, document.get("created_month") or 0)
+                if document["steamid"] not in latest_lists or latest_lists[document["steamid"]][0] <= period:
+                    latest_lists[document["steamid"]] = (
+                        period,
+                        [friend["steamid"] for friend in document.get("friend_list") or []],
+                    )
+        graph = cls()
+        for steamid, (_, friend_ids) in latest_lists.items():
+            graph._pending[int(steamid)] = np.array(friend_ids, dtype=np.int64)
+        graph.flush()
+        logging.info(f"Friend graph built with {graph.node_count} players and {graph.edge_count} friendships.")
+        return graph
+
+    def update_friend_lists(self, friend_lists: Iterable[SteamFriendList]) -> None:
+        """
+        Buffers newer friend lists, replacing every edge previously asserted by their owners.
+        """
+        for friend_list in friend_lists:
+            self._pending[int(friend_list.steamid)] = np.array(
+                [friend.steamid for friend in friend_list.friend_list], dtype=np.int64
+            )
+
+    def flush(self) -> None:
+        """
+        Applies the buffered friend lists and rebuilds the CSR arrays.
+        """
+        if not self._pending:
+            return
+        updated_owners = np.fromiter(self._pending.keys(), dtype=np.int64, count=len(self._pending))
+        kept = ~np.isin(self.owners, updated_owners)
+        new_friends = list(self._pending.values())
+        new_owners = [np.full(len(friends), owner, dtype=np.int64) for owner, friends in self._pending.items()]
+        self.owners = np.concatenate([self.owners[kept]] + new_owners)
+        self.friends = np.concatenate([self.friends[kept]] + new_friends)
+        self._pending = {}
+        self._build()
+
+    def _build(self) -> None:
+        self.nodes = np.unique(np.concatenate([self.owners, self.friends]))
+        node_count = len(self.nodes)
+        key_base = max(node_count, 1)
+        sources = np.searchsorted(self.nodes, self.owners)
+        targets = np.searchsorted(self.nodes, self.friends)
+        # both directions of every asserted edge, deduplicated and sorted through a packed int64 key
+        keys = np.unique(np.concatenate([sources * key_base + targets, targets * key_base + sources]))
+        rows = keys // key_base
+        self.indices = keys % key_base
+        not_self = rows != self.indices
+        rows, self.indices = rows[not_self], self.indices[not_self]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=node_count))]).astype(np.int64)
+
+    # Persistence
+
+    def save(self, path: str) -> None:
+        """
+        Saves the graph as a compressed npz file, written under a temporary name and renamed.
+        """
+        self.flush()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as graph_file:
+            np.savez_compressed(
+                graph_file,
+                owners=self.owners,
+                friends=self.friends,
+                nodes=self.nodes,
+                indptr=self.indptr,
+                indices=self.indices,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "FriendGraph":
+        with np.load(path) as arrays:
+            graph = cls.__new__(cls)
+            graph.owners = arrays["owners"]
+            graph.friends = arrays["friends"]
+            graph.nodes = arrays["nodes"]
+            graph.indptr = arrays["indptr"]
+            graph.indices = arrays["indices"]
+            graph._pending = {}
+        return graph
+
+    # Queries
+
+    @property
+    def node_count(self) -> int:
+        self.flush()
+        return len(self.nodes)
+
+    @property
+    def edge_count(self) -> int:
+        self.flush()
+        return len(self.indices) // 2
+
+    def node_index(self, steamid: str) -> Optional[int]:
+        self.flush()
+        steamid_int = int(steamid)
+        node = int(np.searchsorted(self.nodes, steamid_int))
+        if node < len(self.nodes) and self.nodes[node] == steamid_int:
+            return node
+        return None
+
+    def to_steamids(self, node_indexes: np.ndarray) -> List[str]:
+        return [str(steamid) for steamid in self.nodes[node_indexes].tolist()]
+
+    def _neighbour_indexes(self, steamid: str) -> np.ndarray:
+        node = self.node_index(steamid)
+        if node is None:
+            return EMPTY_IDS
+        return self.indices[self.indptr[node] : self.indptr[node + 1]]
+
+    def neighbours(self, steamid: str) -> List[str]:
+        return self.to_steamids(self._neighbour_indexes(steamid))
+
+    def degree(self, steamid: str) -> int:
+        return len(self._neighbour_indexes(steamid))
+
+    def mutual_friends(self, steamid: str, other_steamid: str) -> List[str]:
+        return self.to_steamids(
+            np.intersect1d(
+                self._neighbour_indexes(steamid), self._neighbour_indexes(other_steamid), assume_unique=True
+            )
+        )
+
+    def k_hop(self, steamid: str, k: int) -> Dict[str, int]:
+        """
+        Returns the players reachable in at most k hops, with their distance, excluding the player itself.
+        Each hop expands the whole frontier at once by gathering the CSR slices of its nodes.
+        """
+        node = self.node_index(steamid)
+        if node is None:
+            return {}
+        distances = np.full(len(self.nodes), -1, dtype=np.int64)
+        distances[node] = 0
+        frontier = np.array([node], dtype=np.int64)
+        for hop in range(1, k + 1):
+            starts = self.indptr[frontier]
+            counts = self.indptr[frontier + 1] - starts
+            if not counts.sum():
+                break
+            # positions of every neighbour slice of the frontier, without a python loop over the nodes
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            candidates = np.unique(self.indices[np.repeat(starts, counts) + offsets])
+            frontier = candidates[distances[candidates] < 0]
+            if not len(frontier):
+                break
+            distances[frontier] = hop
+        reached = np.nonzero(distances > 0)[0]
+        return dict(zip(self.to_steamids(reached), distances[reached].tolist()))
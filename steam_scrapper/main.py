@@ -1,12 +1,13 @@
 import click
 import datetime as dt
 import logging
+import os
+from contextlib import nullcontext
 
-from tqdm import tqdm
-
-from repos.mongo_repo import SteamMongo
 from config import config
-from scrapper import SteamScrapper
+from metrics import metrics, InstrumentedRepo
+from profiling import Profiler, profile_dir
+from refresh_policy import REFRESH_POLICIES
 
 @click.command()
 @click.argument("player_ids", type=str)
@@ -15,29 +16,98 @@ from scrapper import SteamScrapper
 @click.option("--output", default="mongo")
 @click.option("--frequency", default="month")
 @click.option("--fetch_friends/--dont_fetch_friends", default=False)
-def steam_scrap(player_ids,steam_key, mongo_db_url, output,frequency,fetch_friends):
+@click.option("--cache_size", default=1024, type=int, help="Repo cache entries for the run, 0 disables it.")
+@click.option("--friend_graph_path", type=str, help="Friend graph index file kept up to date with the friend lists.")
+@click.option(
+    "--refresh_policy", type=click.Choice(list(REFRESH_POLICIES)), default="fixed",
+    help="How often the friend lists and libraries are refreshed, activity lengthens it for inactive players.")
+@click.option(
+    "--probe_libraries", is_flag=True, default=False,
+    help="Checks cheap signals before fetching a library, renewing the unchanged ones instead.")
+@click.option("--app_catalogue_path", type=str, help="App catalogue used to prefill and triage the game info.")
+@click.option("--metrics_textfile", type=str, help="Prometheus textfile written with the run metrics.")
+@click.option("--metrics_json", type=str, help="JSON summary written with the run metrics.")
+@click.option("--profile", is_flag=True, default=False, help="Profiles CPU and allocations per stage.")
+@click.option("--profile_dir", "profile_dir_base", default="profiles", type=str)
+def steam_scrap(
+    player_ids,steam_key, mongo_db_url, output,frequency,fetch_friends,cache_size,friend_graph_path,
+    refresh_policy,probe_libraries,app_catalogue_path,metrics_textfile,metrics_json,profile,profile_dir_base):
+    # the metrics are written even when the run fails, so a failed night is visible too
+    try:
+        with Profiler(profile_dir(profile_dir_base, "main")) if profile else nullcontext():
+            scrap(
+                player_ids, output, frequency, fetch_friends, cache_size, friend_graph_path, refresh_policy,
+                probe_libraries, app_catalogue_path)
+    finally:
+        metrics.write_outputs(textfile_path=metrics_textfile, json_path=metrics_json)
+
+
+def scrap(
+    player_ids, output, frequency, fetch_friends, cache_size, friend_graph_path, refresh_policy="fixed",
+    probe_libraries=False, app_catalogue_path=None):
+    # the backends and the scrapper are imported here, so --help and the other cli commands start fast
+    from repos.mongo_repo import SteamMongo
+    from repos.cached_repo import CachedRepo
+    from scrapper import SteamScrapper
+    from friend_graph import FriendGraph
+    from app_catalogue import load_app_catalogue
+
     repo = None
     # gets repo
     if output == "mongo":
         logging.info("Creating output type Mongo DB...")
         if config.mongodb_url is None:
             raise ValueError("Missing MongoDB URL Env Variable.")
-        repo = SteamMongo(mongo_url=config.mongodb_url)
+        repo = SteamMongo(
+            mongo_url=config.mongodb_url,
+            gameplay_partitioned=config.gameplay_partitioned,
+            friend_list_history=config.friend_list_history,
+            app_players_index=config.app_players_index,
+        )
         logging.info("Mongo DB output created.")
     if repo is None:
         raise ValueError("No Repository has been assigned to scrap.")
+    # under the cache, so only the calls reaching the database are timed
+    repo = InstrumentedRepo(repo)
+    if cache_size > 0:
+        repo = CachedRepo(repo=repo, max_size=cache_size)
     
+    friend_graph = None
+    if friend_graph_path is not None:
+        if os.path.exists(friend_graph_path):
+            friend_graph = FriendGraph.load(friend_graph_path)
+        else:
+            friend_graph = FriendGraph.from_repo(repo)
+
     logging.info(f"Scrapping for Player ID(s) {player_ids}")
     
+    # with a retention policy the previous snapshots are expired as whole periods after the run
     steam_scrapper = SteamScrapper(
         repo = repo, 
-        frequency = frequency)
+        frequency = frequency,
+        delete_previous_gameplay = config.gameplay_retention_months is None,
+        friend_graph = friend_graph,
+        refresh_policy = REFRESH_POLICIES[refresh_policy](),
+        probe_libraries = probe_libraries,
+        app_catalogue = load_app_catalogue(app_catalogue_path))
     player_id_list = player_ids.split(",")
     for idx, player_id in enumerate(player_id_list):
         logging.info(f"Scrapping user {idx+1} out of {len(player_id_list)}")
         steam_scrapper.scrap_all_user_data(
             player_id=player_id,
             fetch_friends=fetch_friends)
+
+    if config.gameplay_retention_months is not None and output == "mongo":
+        repo.apply_gameplay_retention(
+            current_year=steam_scrapper.current_time.year,
+            current_month=steam_scrapper.current_time.month,
+            retention_months=config.gameplay_retention_months,
+            action=config.gameplay_retention_action)
+    if friend_graph is not None:
+        friend_graph.save(friend_graph_path)
+        logging.info(f"Friend graph saved with {friend_graph.node_count} players to {friend_graph_path}.")
+    if isinstance(repo, CachedRepo):
+        repo.log_cache_stats()
     
 
 def configure_logging():
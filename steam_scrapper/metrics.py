@@ -0,0 +1,329 @@
+import bisect
+import datetime as dt
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from typing import Callable, ContextManager, Dict, List, Optional, Tuple
+
+METRIC_PREFIX = "steam_opera"
+# seconds, from a cached Mongo read up to an appdetails call stuck in 429 backoff
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key: LabelKey, extra: Optional[Dict[str, str]] = None) -> str:
+    labels = list(key) + list((extra or {}).items())
+    if not labels:
+        return ""
+    escaped = [
+        (name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in labels
+    ]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Histogram:
+    """
+    Cumulative latency histogram with fixed buckets, as exposed by Prometheus.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, quantile: float) -> float:
+        """
+        Estimates a quantile as the upper bound of the bucket holding it, capped by the largest observation.
+        """
+        if not self.count:
+            return 0.0
+        rank = quantile * self.count
+        seen = 0
+        for upper_bound, bucket_count in zip(self.buckets, self.bucket_counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(upper_bound, self.max)
+        return self.max
+
+
+class MetricsRegistry:
+    """
+    Process wide counters, gauges and histograms of a run, written as a Prometheus textfile and a JSON summary.
+
+    Metrics are identified by name plus labels and created on first use, so instrumented code never has to
+    declare them. Every update takes the registry lock, as the repo and API calls may come from worker threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = dt.datetime.now()
+        self._started = time.perf_counter()
+        self.counters: Dict[str, Dict[LabelKey, float]] = defaultdict(lambda: defaultdict(float))
+        self.gauges: Dict[str, Dict[LabelKey, float]] = defaultdict(dict)
+        self.histograms: Dict[str, Dict[LabelKey, Histogram]] = defaultdict(dict)
+        self.help: Dict[str, str] = {}
+        self.stage_hooks: List[Callable[[str], ContextManager]] = []
+
+    def describe(self, name: str, help_text: str) -> None:
+        self.help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        with self._lock:
+            self.counters[name][label_key(labels)] += value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self.gauges[name][label_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = label_key(labels)
+        with self._lock:
+            if key not in self.histograms[name]:
+                self.histograms[name][key] = Histogram()
+            self.histograms[name][key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Observes the duration of the block in the histogram name, counting failures in name_errors_total.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as error:
+            self.inc(f"{name}_errors_total", error=type(error).__name__, **labels)
+            raise
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def stage(self, stage: str):
+        """
+        Times a stage, also entering the registered stage hooks, such as the profiler, around it.
+        """
+        with ExitStack() as hooks:
+            for stage_hook in self.stage_hooks:
+                hooks.enter_context(stage_hook(stage))
+            with self.timer("stage_duration", stage=stage):
+                yield
+
+    # Output
+
+    def write_textfile(self, path: str) -> None:
+        """
+        Writes the metrics in the Prometheus text format, under a temporary name and renamed so the
+        node exporter textfile collector never reads a partial file.
+        """
+        self.set_gauge("run_duration_seconds", time.perf_counter() - self._started)
+        self.set_gauge("run_finished_timestamp_seconds", time.time())
+        lines = []
+        with self._lock:
+            for kind, metric_dict in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted(metric_dict):
+                    full_name = f"{METRIC_PREFIX}_{name}"
+                    if name in self.help:
+                        lines.append(f"# HELP {full_name} {self.help[name]}")
+                    lines.append(f"# TYPE {full_name} {kind}")
+                    for key, value in sorted(metric_dict[name].items()):
+                        lines.append(f"{full_name}{format_labels(key)} {value}")
+            for name in sorted(self.histograms):
+                full_name = f"{METRIC_PREFIX}_{name}"
+                if name in self.help:
+                    lines.append(f"# HELP {full_name} {self.help[name]}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for key, histogram in sorted(self.histograms[name].items()):
+                    cumulative = 0
+                    for upper_bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                        cumulative += bucket_count
+                        lines.append(f"{full_name}_bucket{format_labels(key, {'le': str(upper_bound)})} {cumulative}")
+                    lines.append(f"{full_name}_bucket{format_labels(key, {'le': '+Inf'})} {histogram.count}")
+                    lines.append(f"{full_name}_sum{format_labels(key)} {histogram.sum}")
+                    lines.append(f"{full_name}_count{format_labels(key)} {histogram.count}")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as textfile:
+            textfile.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+    def summary(self) -> Dict:
+        """
+        Returns the run summary: counters and gauges by labels, and count, total, mean, p50, p95 and max
+        of every histogram.
+        """
+        with self._lock:
+            return {
+                "started_at": self.started_at.isoformat(),
+                "duration_seconds": time.perf_counter() - self._started,
+                "counters": {
+                    name: [{"labels": dict(key), "value": value} for key, value in sorted(values.items())]
+                    for name, values in sorted(self.counters.items())
+                },
+                "gauges": {
+                    name: [{"labels": dict(key), "value": value} for key, value in sorted(values.items())]
+                    for name, values in sorted(self.gauges.items())
+                },
+                "histograms": {
+                    name: [
+                        {
+                            "labels": dict(key),
+                            "count": histogram.count,
+                            "total_seconds": histogram.sum,
+                            "mean_seconds": histogram.sum / histogram.count if histogram.count else 0.0,
+                            "p50_seconds": histogram.quantile(0.5),
+                            "p95_seconds": histogram.quantile(0.95),
+                            "max_seconds": histogram.max,
+                        }
+                        for key, histogram in sorted(histograms.items())
+                    ]
+                    for name, histograms in sorted(self.histograms.items())
+                },
+            }
+
+    def write_json(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as summary_file:
+            json.dump(self.summary(), summary_file, indent=2)
+        os.replace(tmp_path, path)
+
+    def log_summary(self) -> None:
+        """
+        Logs where the time of the run went, by stage.
+        """
+        for stage_summary in self.summary()["histograms"].get("stage_duration_seconds", []):
+            logging.info(
+                f"Stage {stage_summary['labels']['stage']}: {stage_summary['count']} call(s), "
+                f"{stage_summary['total_seconds']:.2f}s total, p95 {stage_summary['p95_seconds']:.3f}s."
+            )
+
+    def write_outputs(self, textfile_path: Optional[str] = None, json_path: Optional[str] = None) -> None:
+        if textfile_path is None and json_path is None:
+            return
+        self.log_summary()
+        if textfile_path is not None:
+            self.write_textfile(textfile_path)
+            logging.info(f"Metrics textfile written to {textfile_path}.")
+        if json_path is not None:
+            self.write_json(json_path)
+            logging.info(f"Metrics summary written to {json_path}.")
+
+
+metrics = MetricsRegistry()
+metrics.describe("stage_duration_seconds", "Duration of the scrapper and db_ops stages.")
+metrics.describe("stage_duration_errors_total", "Stages that raised.")
+metrics.describe("api_call_duration_seconds", "Duration of the steam_api fetch calls, including retries.")
+metrics.describe("api_call_duration_errors_total", "steam_api fetch calls that gave up.")
+metrics.describe("api_request_duration_seconds", "Duration of the single HTTP requests to the Steam API.")
+metrics.describe("api_requests_total", "HTTP requests to the Steam API by status code.")
+metrics.describe("api_response_bytes_total", "Bytes received from the Steam API.")
+metrics.describe("api_retries_total", "Steam API retries by reason, 429s included.")
+metrics.describe("api_backoff_seconds_total", "Time spent waiting between Steam API retries.")
+metrics.describe("repo_call_duration_seconds", "Duration of the repo method calls.")
+metrics.describe("repo_call_duration_errors_total", "Repo method calls that raised.")
+metrics.describe("run_duration_seconds", "Duration of the run when the metrics were written.")
+metrics.describe("run_finished_timestamp_seconds", "Unix time the metrics were written, to alert on stale runs.")
+
+
+def stage(name: Optional[str] = None) -> Callable:
+    """
+    Decorator timing every call of the function as a stage, named after the function by default.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        stage_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with metrics.stage(stage_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def api_call(function: Callable) -> Callable:
+    """
+    Decorator timing a steam_api fetch call, applied over its backoff decorator so retries are included.
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with metrics.timer("api_call_duration", endpoint=function.__name__):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def record_api_request(endpoint: str, status_code: int, duration: float, response_bytes: int) -> None:
+    metrics.inc("api_requests_total", endpoint=endpoint, status=status_code)
+    metrics.inc("api_response_bytes_total", response_bytes, endpoint=endpoint)
+    metrics.observe("api_request_duration_seconds", duration, endpoint=endpoint)
+
+
+def record_api_backoff(details: Dict) -> None:
+    """
+    backoff on_backoff handler, counting the retry and the wait before it.
+    """
+    exception = details.get("exception")
+    endpoint = details["target"].__name__
+    metrics.inc("api_retries_total", endpoint=endpoint, reason=type(exception).__name__ if exception else "value")
+    metrics.inc("api_backoff_seconds_total", details.get("wait") or 0, endpoint=endpoint)
+
+
+class InstrumentedRepo:
+    """
+    Wraps a repo and times every method call, by method name.
+
+    It is meant to sit directly over the database repo and under the CachedRepo, so only the calls that
+    actually reach the database are measured. Any other attribute is delegated untouched.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+
+    def __getattr__(self, name: str):
+        if name == "repo":
+            raise AttributeError(name)
+        attribute = getattr(self.repo, name)
+        if not callable(attribute) or name.startswith("_"):
+            return attribute
+
+        if name.startswith("iter_"):
+
+            @functools.wraps(attribute)
+            def timed_iterator(*args, **kwargs):
+                # generators are timed per batch pulled, the caller's work between batches is left out
+                iterator = iter(attribute(*args, **kwargs))
+                while True:
+                    with metrics.timer("repo_call_duration", method=name):
+                        try:
+                            batch = next(iterator)
+                        except StopIteration:
+                            return
+                    yield batch
+
+            return timed_iterator
+
+        @functools.wraps(attribute)
+        def timed_call(*args, **kwargs):
+            with metrics.timer("repo_call_duration", method=name):
+                return attribute(*args, **kwargs)
+
+        return timed_call
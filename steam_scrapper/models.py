@@ -1,7 +1,15 @@
-from typing import Optional,List
-from dataclasses import dataclass
+from typing import Optional,List,Dict
+from dataclasses import dataclass, field
+from array import array
 import datetime as dt
 
+from utils import to_epoch, from_epoch
+
+# typecode of the int64 columns of the compact models
+INT64 = "q"
+# epoch stored for a missing last_time_played, the value the Steam API reports for never played games
+NO_TIMESTAMP = 0
+
 @dataclass(kw_only=True)
 class TimestampedBaseClass:
     created_at: dt.datetime
@@ -22,6 +30,8 @@ class SteamProfile(TimestampedBaseClass):
     loc_state: Optional[str] = None
     missing_in_action: Optional[bool] = False
     killed_in_action: Optional[bool] = False
+    # 0 when the player was offline when the profile was fetched
+    persona_state: Optional[int] = None
 
 
 @dataclass
@@ -79,3 +89,272 @@ class SteamGameinfo(TimestampedBaseClass):
     is_free: bool
     release_date: Optional[dt.datetime]=None
     metacritic_score: Optional[int]=None
+
+
+@dataclass
+class SteamAppListItem:
+    """
+    Entry of the Steam app catalogue, last_modified in epoch seconds.
+    """
+    appid: str
+    name: str
+    app_type: str
+    last_modified: int
+
+
+@dataclass
+class RollupItem:
+    key: str
+    playtime: int
+    games_count: int
+    name: Optional[str] = None
+
+
+@dataclass(kw_only=True)
+class PlayerMonthRollup(TimestampedBaseClass):
+    steamid: str
+    created_year: int
+    created_month: int
+    total_playtime: int
+    games_count: int
+    genres: List[RollupItem]
+    developers: List[RollupItem]
+    publishers: List[RollupItem]
+    top_games: List[RollupItem]
+    missing_game_info_count: int = 0
+
+
+@dataclass(kw_only=True)
+class WorkItem(TimestampedBaseClass):
+    """
+    Entry of the work queue, identified by its kind and key, like the friend_list of a steamid.
+    A worker holds it while lease_expires_at is in the future, lease_id identifying the claim.
+    """
+    item_id: str
+    kind: str
+    key: str
+    status: str
+    available_at: dt.datetime
+    attempts: int = 0
+    payload: Dict = field(default_factory=dict)
+    lease_id: Optional[str] = None
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[dt.datetime] = None
+    last_error: Optional[str] = None
+    completed_at: Optional[dt.datetime] = None
+
+# Compact models, used by the bulk reads. Ids are ints, timestamps whole epoch seconds, the items are
+# slotted and the lists keep their items in int64 arrays, so a loaded snapshot holds no per item objects.
+
+def int64_array(values=()) -> array:
+    return array(INT64, values)
+
+
+@dataclass(slots=True)
+class CompactGameplayItem:
+    appid: int
+    playtime: int
+    last_time_played: int = NO_TIMESTAMP
+
+    @classmethod
+    def from_model(cls, gameplay_item: GameplayItem) -> "CompactGameplayItem":
+        return cls(
+            appid=int(gameplay_item.appid),
+            playtime=gameplay_item.playtime,
+            last_time_played=to_epoch(gameplay_item.last_time_played) or NO_TIMESTAMP,
+        )
+
+    def to_model(self) -> GameplayItem:
+        return GameplayItem(
+            appid=str(self.appid),
+            playtime=self.playtime,
+            last_time_played=from_epoch(self.last_time_played) if self.last_time_played != NO_TIMESTAMP else None,
+        )
+
+
+@dataclass(slots=True)
+class CompactSteamFriendItem:
+    steamid: int
+    friend_since: int
+
+    @classmethod
+    def from_model(cls, friend_item: SteamFriendItem) -> "CompactSteamFriendItem":
+        return cls(steamid=int(friend_item.steamid), friend_since=to_epoch(friend_item.friend_since))
+
+    def to_model(self) -> SteamFriendItem:
+        return SteamFriendItem(steamid=str(self.steamid), friend_since=from_epoch(self.friend_since))
+
+
+@dataclass(slots=True)
+class CompactGameplayMonthDeltaItem:
+    appid: int
+    playtime: int
+
+    @classmethod
+    def from_model(cls, gameplay_delta_item: GameplayMonthDeltaItem) -> "CompactGameplayMonthDeltaItem":
+        return cls(appid=int(gameplay_delta_item.appid), playtime=gameplay_delta_item.playtime)
+
+    def to_model(self) -> GameplayMonthDeltaItem:
+        return GameplayMonthDeltaItem(appid=str(self.appid), playtime=self.playtime)
+
+
+@dataclass(slots=True, kw_only=True)
+class CompactTimestampedBaseClass:
+    created_at: int
+    updated_at: int
+    last_failed_update_attempt: Optional[int] = None
+
+    def timestamps(self) -> dict:
+        return dict(
+            created_at=from_epoch(self.created_at),
+            updated_at=from_epoch(self.updated_at),
+            last_failed_update_attempt=from_epoch(self.last_failed_update_attempt),
+        )
+
+    @staticmethod
+    def compact_timestamps(model: TimestampedBaseClass) -> dict:
+        return dict(
+            created_at=to_epoch(model.created_at),
+            updated_at=to_epoch(model.updated_at),
+            last_failed_update_attempt=to_epoch(model.last_failed_update_attempt),
+        )
+
+
+@dataclass(slots=True, kw_only=True)
+class CompactGameplayList(CompactTimestampedBaseClass):
+    """
+    GameplayList with its games held in the appids, playtimes and last_times_played columns.
+    """
+
+    steamid: int
+    created_year: int
+    created_month: int
+    appids: array = field(default_factory=int64_array)
+    playtimes: array = field(default_factory=int64_array)
+    last_times_played: array = field(default_factory=int64_array)
+
+    def __len__(self) -> int:
+        return len(self.appids)
+
+    @property
+    def gameplay_list(self) -> List[CompactGameplayItem]:
+        return list(map(CompactGameplayItem, self.appids, self.playtimes, self.last_times_played))
+
+    def append(self, gameplay_item: CompactGameplayItem) -> None:
+        self.appids.append(gameplay_item.appid)
+        self.playtimes.append(gameplay_item.playtime)
+        self.last_times_played.append(gameplay_item.last_time_played)
+
+    @classmethod
+    def from_model(cls, gameplay_info: GameplayList) -> "CompactGameplayList":
+        compact_gameplay = cls(
+            steamid=int(gameplay_info.steamid),
+            created_year=gameplay_info.created_year,
+            created_month=gameplay_info.created_month,
+            **cls.compact_timestamps(gameplay_info),
+        )
+        for gameplay_item in gameplay_info.gameplay_list:
+            compact_gameplay.append(CompactGameplayItem.from_model(gameplay_item))
+        return compact_gameplay
+
+    def to_model(self) -> GameplayList:
+        return GameplayList(
+            steamid=str(self.steamid),
+            gameplay_list=[gameplay_item.to_model() for gameplay_item in self.gameplay_list],
+            created_year=self.created_year,
+            created_month=self.created_month,
+            **self.timestamps(),
+        )
+
+
+@dataclass(slots=True, kw_only=True)
+class CompactSteamFriendList(CompactTimestampedBaseClass):
+    """
+    SteamFriendList with its friends held in the steamids and friend_since columns.
+    """
+
+    steamid: int
+    created_year: int
+    created_month: int
+    steamids: array = field(default_factory=int64_array)
+    friend_since: array = field(default_factory=int64_array)
+
+    def __len__(self) -> int:
+        return len(self.steamids)
+
+    @property
+    def friend_list(self) -> List[CompactSteamFriendItem]:
+        return list(map(CompactSteamFriendItem, self.steamids, self.friend_since))
+
+    def append(self, friend_item: CompactSteamFriendItem) -> None:
+        self.steamids.append(friend_item.steamid)
+        self.friend_since.append(friend_item.friend_since)
+
+    @classmethod
+    def from_model(cls, friend_list: SteamFriendList) -> "CompactSteamFriendList":
+        compact_friend_list = cls(
+            steamid=int(friend_list.steamid),
+            created_year=friend_list.created_year,
+            created_month=friend_list.created_month,
+            **cls.compact_timestamps(friend_list),
+        )
+        for friend_item in friend_list.friend_list:
+            compact_friend_list.append(CompactSteamFriendItem.from_model(friend_item))
+        return compact_friend_list
+
+    def to_model(self) -> SteamFriendList:
+        return SteamFriendList(
+            steamid=str(self.steamid),
+            friend_list=[friend_item.to_model() for friend_item in self.friend_list],
+            created_year=self.created_year,
+            created_month=self.created_month,
+            **self.timestamps(),
+        )
+
+
+@dataclass(slots=True, kw_only=True)
+class CompactGameplayMonthDeltaList(CompactTimestampedBaseClass):
+    """
+    GameplayMonthDeltaList with its deltas held in the appids and playtimes columns.
+    """
+
+    steamid: int
+    total_playtime: int
+    created_year: int
+    created_month: int
+    appids: array = field(default_factory=int64_array)
+    playtimes: array = field(default_factory=int64_array)
+
+    def __len__(self) -> int:
+        return len(self.appids)
+
+    @property
+    def gameplay_delta_list(self) -> List[CompactGameplayMonthDeltaItem]:
+        return list(map(CompactGameplayMonthDeltaItem, self.appids, self.playtimes))
+
+    def append(self, gameplay_delta_item: CompactGameplayMonthDeltaItem) -> None:
+        self.appids.append(gameplay_delta_item.appid)
+        self.playtimes.append(gameplay_delta_item.playtime)
+
+    @classmethod
+    def from_model(cls, gameplay_delta: GameplayMonthDeltaList) -> "CompactGameplayMonthDeltaList":
+        compact_gameplay_delta = cls(
+            steamid=int(gameplay_delta.steamid),
+            total_playtime=gameplay_delta.total_playtime,
+            created_year=gameplay_delta.created_year,
+            created_month=gameplay_delta.created_month,
+            **cls.compact_timestamps(gameplay_delta),
+        )
+        for gameplay_delta_item in gameplay_delta.gameplay_delta_list:
+            compact_gameplay_delta.append(CompactGameplayMonthDeltaItem.from_model(gameplay_delta_item))
+        return compact_gameplay_delta
+
+    def to_model(self) -> GameplayMonthDeltaList:
+        return GameplayMonthDeltaList(
+            steamid=str(self.steamid),
+            gameplay_delta_list=[gameplay_delta_item.to_model() for gameplay_delta_item in self.gameplay_delta_list],
+            total_playtime=self.total_playtime,
+            created_year=self.created_year,
+            created_month=self.created_month,
+            **self.timestamps(),
+        )
@@ -0,0 +1,180 @@
+import cProfile
+import datetime as dt
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from metrics import metrics
+
+RUN_STAGE = "run"
+TOP_N = 30
+SAMPLE_INTERVAL_SECONDS = 0.005
+TRACEMALLOC_FRAMES = 25
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stacks of every thread at a fixed interval, counting them in the collapsed stack format
+    read by flamegraph.pl, speedscope and most flamegraph viewers. The stacks of the profiled thread start
+    with its current stage, the others with the thread name.
+    """
+
+    def __init__(self, profiler: "Profiler", interval: float = SAMPLE_INTERVAL_SECONDS):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.profiler = profiler
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame))
+                    frame = frame.f_back
+                if thread_id == self.profiler.thread_id:
+                    root = "/".join(self.profiler.stage_stack)
+                else:
+                    root = thread_names.get(thread_id, str(thread_id))
+                self.stacks[";".join([root] + labels[::-1])] += 1
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as stacks_file:
+            for stack, count in self.stacks.most_common():
+                stacks_file.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """
+    Opt-in profiler of a CLI run, entered around the whole command.
+
+    Every stage timed by the metrics module gets its own cProfile profile, switched on the stage boundaries,
+    so each one holds the time spent in the stage itself while its nested stages are kept in their own
+    profiles. Code outside of any stage goes to the run profile. A sampler thread records the stacks of all
+    threads for flamegraphs, and tracemalloc records the allocations of the run.
+
+    Only the thread entering the profiler is profiled with cProfile, the worker processes of db_ops are
+    not profiled.
+
+    :param output_dir: folder of the profile files, created when missing
+    :type output_dir: str
+    :param top_n: functions and allocation sites listed in the summary
+    :type top_n: int
+    """
+
+    def __init__(self, output_dir: str, top_n: int = TOP_N):
+        self.output_dir = output_dir
+        self.top_n = top_n
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self.stage_stack: List[str] = []
+        self.thread_id: Optional[int] = None
+        self.stage_allocations: Counter = Counter()
+        self.sampler = StackSampler(self)
+
+    def _profile(self, stage: str) -> cProfile.Profile:
+        if stage not in self.profiles:
+            self.profiles[stage] = cProfile.Profile()
+        return self.profiles[stage]
+
+    @contextmanager
+    def stage(self, stage: str):
+        if threading.get_ident() != self.thread_id or (self.stage_stack and self.stage_stack[-1] == stage):
+            yield
+            return
+        self._profile(self.stage_stack[-1]).disable()
+        self.stage_stack.append(stage)
+        allocated_before = tracemalloc.get_traced_memory()[0]
+        self._profile(stage).enable()
+        try:
+            yield
+        finally:
+            self._profile(stage).disable()
+            self.stage_allocations[stage] += tracemalloc.get_traced_memory()[0] - allocated_before
+            self.stage_stack.pop()
+            self._profile(self.stage_stack[-1]).enable()
+
+    def __enter__(self) -> "Profiler":
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.thread_id = threading.get_ident()
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.stage_stack = [RUN_STAGE]
+        metrics.stage_hooks.append(self.stage)
+        self.sampler.start()
+        self._profile(RUN_STAGE).enable()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._profile(RUN_STAGE).disable()
+        self.sampler.stop()
+        metrics.stage_hooks.remove(self.stage)
+        snapshot = tracemalloc.take_snapshot()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.write(snapshot, peak_memory)
+
+    # Output
+
+    def write(self, snapshot: tracemalloc.Snapshot, peak_memory: int) -> None:
+        """
+        Writes one .prof file per stage plus run_total.prof with all of them, the collapsed stacks,
+        the tracemalloc snapshot and a summary of the top functions and allocation sites.
+        """
+        summary = io.StringIO()
+        summary.write(
+            f"Profile written at {dt.datetime.now().isoformat()}, peak traced memory {peak_memory:,} bytes.\n"
+        )
+        total_stats = None
+        for stage, profile in self.profiles.items():
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            profile.dump_stats(os.path.join(self.output_dir, f"{stage}.prof"))
+            stats = pstats.Stats(profile, stream=summary)
+            summary.write(
+                f"\n=== Stage {stage}: {stats.total_tt:.3f}s own time, "
+                f"{self.stage_allocations.get(stage, 0):,} bytes retained ===\n"
+            )
+            stats.sort_stats(pstats.SortKey.TIME).print_stats(self.top_n)
+            if total_stats is None:
+                total_stats = pstats.Stats(profile, stream=summary)
+            else:
+                total_stats.add(profile)
+        if total_stats is not None:
+            total_stats.dump_stats(os.path.join(self.output_dir, "run_total.prof"))
+            summary.write("\n=== Whole run, by cumulative time ===\n")
+            total_stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_n)
+        self.sampler.write(os.path.join(self.output_dir, "stacks.collapsed"))
+        snapshot.dump(os.path.join(self.output_dir, "memory.snapshot"))
+        summary.write(f"\n=== Top {self.top_n} allocation sites still allocated at the end of the run ===\n")
+        for statistic in snapshot.statistics("lineno")[: self.top_n]:
+            summary.write(f"{statistic}\n")
+        with open(os.path.join(self.output_dir, "summary.txt"), "w") as summary_file:
+            summary_file.write(summary.getvalue())
+        logging.info(f"Profile written to {self.output_dir}.")
+
+
+def profile_dir(base_dir: str, command: str) -> str:
+    """
+    Returns a new folder for the profile of a command run, named after the command and the start time.
+    """
+    return os.path.join(base_dir, f"{command}_{dt.datetime.now():%Y%m%d_%H%M%S}")
@@ -0,0 +1,138 @@
+import datetime as dt
+from dataclasses import dataclass
+from typing import Dict, Optional, Type, Union
+
+FRIEND_LIST = "friend_list"
+LIBRARY = "library"
+REFRESH_KINDS = [FRIEND_LIST, LIBRARY]
+
+
+@dataclass
+class ActivitySignals:
+    """
+    Activity of a player, read from what is already stored: its profile and its last monthly delta.
+    """
+
+    last_logoff: Optional[dt.datetime] = None
+    missing_in_action: bool = False
+    # online players keep their last logoff until they log off, it says nothing of their activity
+    online: bool = False
+    # total_playtime of the last monthly delta stored, None when there is none
+    last_month_playtime: Optional[int] = None
+
+
+def logoff_datetime(last_logoff: Union[dt.datetime, int, None]) -> Optional[dt.datetime]:
+    """
+    The profiles store lastlogoff as returned by the API, in epoch seconds, and private profiles have none.
+    """
+    if last_logoff is None or isinstance(last_logoff, dt.datetime):
+        return last_logoff
+    return dt.datetime.fromtimestamp(last_logoff)
+
+
+def periods_between(start: dt.datetime, end: dt.datetime, frequency: str) -> int:
+    if frequency == "month":
+        return (end.year - start.year) * 12 + end.month - start.month
+    return end.year - start.year
+
+
+class RefreshPolicy:
+    """
+    Decides whether the friend list or library of a player is fetched again in the current period.
+    The base policy refreshes every player every period.
+    """
+
+    # False when every player is refreshed every period, sparing the reads of the activity signals
+    adaptive = False
+
+    def refresh_interval(self, kind: str, signals: ActivitySignals, current_time: dt.datetime) -> int:
+        """
+        Number of periods a fetched friend list or library stays valid.
+
+        :param kind: FRIEND_LIST or LIBRARY
+        :type kind: str
+        :param signals: stored activity of the player
+        :type signals: ActivitySignals
+        :param current_time: time of the run
+        :type current_time: dt.datetime
+        """
+        return 1
+
+    def is_due(
+        self,
+        kind: str,
+        last_refresh: dt.datetime,
+        signals: ActivitySignals,
+        current_time: dt.datetime,
+        frequency: str,
+    ) -> bool:
+        """
+        Checks if the data fetched at last_refresh must be fetched again in the period of current_time.
+        """
+        return periods_between(last_refresh, current_time, frequency) >= self.refresh_interval(
+            kind, signals, current_time
+        )
+
+
+class ActivityAwareRefreshPolicy(RefreshPolicy):
+    """
+    Refreshes the players who played in their last monthly delta or logged off recently every period, and
+    lengthens the interval of the dormant ones with the time since their last logoff. Profiles are still fetched
+    every period, so a dormant player coming back is refreshed in the period its new last_logoff is seen.
+    """
+
+    adaptive = True
+
+    def __init__(
+        self,
+        dormant_after_days: int = 90,
+        dormant_interval: int = 3,
+        abandoned_after_days: int = 365,
+        abandoned_interval: int = 6,
+        missing_interval: int = 12,
+        friend_list_factor: int = 2,
+    ):
+        """
+        :param dormant_after_days: days since the last logoff after which a player is dormant
+        :type dormant_after_days: int
+        :param dormant_interval: refresh interval of the dormant players, in periods
+        :type dormant_interval: int
+        :param abandoned_after_days: days since the last logoff after which a player is abandoned
+        :type abandoned_after_days: int
+        :param abandoned_interval: refresh interval of the abandoned players, in periods
+        :type abandoned_interval: int
+        :param missing_interval: refresh interval of the profiles missing in the API, in periods
+        :type missing_interval: int
+        :param friend_list_factor: multiplier of the intervals for the friend lists, which change less than libraries
+        :type friend_list_factor: int
+        """
+        self.dormant_after_days = dormant_after_days
+        self.dormant_interval = dormant_interval
+        self.abandoned_after_days = abandoned_after_days
+        self.abandoned_interval = abandoned_interval
+        self.missing_interval = missing_interval
+        self.friend_list_factor = friend_list_factor
+
+    def refresh_interval(self, kind: str, signals: ActivitySignals, current_time: dt.datetime) -> int:
+        if signals.last_month_playtime or signals.online:
+            return 1
+        if signals.missing_in_action:
+            interval = self.missing_interval
+        elif signals.last_logoff is None:
+            # private profiles do not report their logoff, nothing tells they are inactive
+            return 1
+        else:
+            idle_days = (current_time - signals.last_logoff).days
+            if idle_days >= self.abandoned_after_days:
+                interval = self.abandoned_interval
+            elif idle_days >= self.dormant_after_days:
+                interval = self.dormant_interval
+            else:
+                return 1
+        return interval * self.friend_list_factor if kind == FRIEND_LIST else interval
+
+
+REFRESH_POLICIES: Dict[str, Type[RefreshPolicy]] = {
+    "fixed": RefreshPolicy,
+    "activity": ActivityAwareRefreshPolicy,
+}
@@ -0,0 +1,321 @@
+import click
+import datetime as dt
+import hashlib
+import html
+import json
+import logging
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List
+
+import plotly.graph_objects as go
+from plotly.offline import get_plotlyjs_version
+from tqdm import tqdm
+
+from repos.repo import Repo
+from repos.mongo_repo import SteamMongo
+from config import config
+from errors import WrongScriptInput
+
+# bump when the report data or layout changes, so every report is rendered again
+REPORT_VERSION = 1
+MANIFEST_FILE_NAME = "manifest.json"
+TOP_COUNT = 10
+CHART_COLORS = ["#66C5CC", "#F6CF71", "#F89C74", "#DCB0F2", "#87C55F", "#9EB9F3", "#FE88B1", "#C9DB74", "#8BE0A4"]
+
+
+@click.command()
+@click.option("--player_ids", type=str, required=True, help="Comma separated steam ids.")
+@click.option("--output_dir", type=str, default="reports")
+@click.option("--created_month", type=int)
+@click.option("--created_year", type=int)
+@click.option("--friends/--no-friends", default=True)
+@click.option("--workers", type=click.IntRange(min=1), default=os.cpu_count() or 1)
+@click.option("--force", is_flag=True, default=False, help="Renders the reports even if their inputs did not change.")
+def report(player_ids, output_dir, created_month, created_year, friends, workers, force):
+    """
+    Renders one HTML report per player, loading the shared data once for the whole batch.
+    """
+    logging.info("Connecting to Mongo DB...")
+    if config.mongodb_url is None:
+        raise ValueError("Missing MongoDB URL Env Variable.")
+    repo = SteamMongo(
+        mongo_url=config.mongodb_url,
+        gameplay_partitioned=config.gameplay_partitioned,
+        friend_list_history=config.friend_list_history,
+        app_players_index=config.app_players_index,
+    )
+    logging.info("Connected.")
+
+    current_time = dt.datetime.now()
+    generate_reports(
+        repo=repo,
+        player_id_list=[player_id.strip() for player_id in player_ids.split(",") if player_id.strip()],
+        output_dir=output_dir,
+        created_year=created_year or current_time.year,
+        created_month=created_month or current_time.month,
+        include_friends=friends,
+        workers=workers,
+        force=force,
+    )
+
+
+def generate_reports(
+    repo: Repo,
+    player_id_list: List[str],
+    output_dir: str,
+    created_year: int,
+    created_month: int,
+    include_friends: bool = True,
+    workers: int = 1,
+    force: bool = False,
+) -> Dict[str, List[str]]:
+    """
+    Loads the report inputs of all players in a few batched reads, skips the players whose inputs hash
+    matches the manifest of the last run and renders the remaining reports on a pool of worker processes.
+    Returns the steam ids rendered, skipped and failed.
+
+    :param force: renders every report, ignoring the manifest
+    :type force: bool
+    """
+    if not player_id_list:
+        raise WrongScriptInput("At least one player id is required to generate reports.")
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+
+    report_inputs = load_report_inputs(repo, player_id_list, created_year, created_month, include_friends)
+    input_hashes = {steamid: report_input_hash(report_input) for steamid, report_input in report_inputs.items()}
+    summary = {"rendered": [], "skipped": [], "failed": []}
+    pending_inputs = []
+    for steamid, report_input in report_inputs.items():
+        report_path = player_report_path(output_dir, steamid)
+        if not force and manifest.get(steamid) == input_hashes[steamid] and os.path.exists(report_path):
+            summary["skipped"].append(steamid)
+        else:
+            pending_inputs.append(report_input)
+    logging.info(f"Rendering {len(pending_inputs)} report(s), {len(summary['skipped'])} unchanged.")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(write_player_report, report_input, output_dir): report_input["steamid"]
+            for report_input in pending_inputs
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Reports", unit="report"):
+            steamid = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"Report for {steamid} failed: {e}")
+                summary["failed"].append(steamid)
+                manifest.pop(steamid, None)
+                continue
+            manifest[steamid] = input_hashes[steamid]
+            summary["rendered"].append(steamid)
+
+    tmp_manifest_path = f"{manifest_path}.tmp"
+    with open(tmp_manifest_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(tmp_manifest_path, manifest_path)
+    logging.info(
+        f"Reports: {len(summary['rendered'])} rendered, {len(summary['skipped'])} skipped, "
+        f"{len(summary['failed'])} failed."
+    )
+    return summary
+
+
+def load_report_inputs(
+    repo: Repo, player_id_list: List[str], created_year: int, created_month: int, include_friends: bool = True
+) -> Dict[str, Dict]:
+    """
+    Builds the plain data each report needs. Profiles, gameplay and game info are read once for the union
+    of players and friends, so a game or a friend shared by many players is only loaded once.
+    """
+    friend_ids_by_player = {}
+    if include_friends:
+        for player_id in player_id_list:
+            # the friend lists are sorted by updated_at, the latest first
+            friend_lists = repo.get_friend_list_by_id(player_id=player_id)
+            friend_ids_by_player[player_id] = (
+                [friend.steamid for friend in friend_lists[0].friend_list] if friend_lists else []
+            )
+    friend_ids = [friend_id for player_friend_ids in friend_ids_by_player.values() for friend_id in player_friend_ids]
+    all_player_ids = list(dict.fromkeys(player_id_list + friend_ids))
+
+    profiles = {profile.steamid: profile for profile in repo.get_player_info_by_id_list(all_player_ids)}
+    gameplay_by_player = {
+        gameplay.steamid: {str(item.appid): item.playtime for item in gameplay.gameplay_list}
+        for gameplay in repo.get_gameplay_info_by_id_list(
+            player_id_list=all_player_ids, created_year=created_year, created_month=created_month
+        )
+    }
+    appids = sorted({appid for player_id in player_id_list for appid in gameplay_by_player.get(player_id, {})})
+    games = {
+        str(game_info.appid): {
+            "name": game_info.name,
+            "genres": game_info.genres or [],
+            "developers": game_info.developers or [],
+            "release_year": game_info.release_date.year if game_info.release_date else None,
+            "metacritic_score": game_info.metacritic_score,
+        }
+        for game_info in repo.get_game_info_by_game_id_list(game_id_list=appids)
+    }
+
+    report_inputs = {}
+    for player_id in player_id_list:
+        profile = profiles.get(player_id)
+        if profile is None:
+            logging.info(f"No profile for steam id {player_id}, report not created.")
+            continue
+        gameplay = gameplay_by_player.get(player_id, {})
+        report_inputs[player_id] = {
+            "steamid": player_id,
+            "persona_name": profile.persona_name,
+            "created_year": created_year,
+            "created_month": created_month,
+            "gameplay": sorted(gameplay.items()),
+            "games": {appid: games[appid] for appid in sorted(gameplay) if appid in games},
+            "friends": [
+                {
+                    "steamid": friend_id,
+                    "persona_name": profiles[friend_id].persona_name,
+                    "loc_country": profiles[friend_id].loc_country,
+                    "total_playtime": sum(gameplay_by_player.get(friend_id, {}).values()),
+                }
+                for friend_id in friend_ids_by_player.get(player_id, [])
+                if friend_id in profiles
+            ],
+        }
+    return report_inputs
+
+
+def report_input_hash(report_input: Dict) -> str:
+    serialized = json.dumps([REPORT_VERSION, report_input], sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def player_report_path(output_dir: str, steamid: str) -> str:
+    return os.path.join(output_dir, f"{steamid}.html")
+
+
+def top_items(values: Dict[str, int], count: int = TOP_COUNT) -> List[List]:
+    return [[key, value] for key, value in sorted(values.items(), key=lambda item: (-item[1], item[0]))[:count]]
+
+
+def build_report_data(report_input: Dict) -> Dict:
+    """
+    Aggregates the chart series of a report, the same ones the profile notebook plots.
+    Playtimes are converted from minutes to hours.
+    """
+    games = report_input["games"]
+    count_by_genre = defaultdict(int)
+    playtime_by_genre = defaultdict(int)
+    count_by_developer = defaultdict(int)
+    playtime_by_developer = defaultdict(int)
+    count_by_release_year = defaultdict(int)
+    playtime_by_game = {}
+    for appid, playtime in report_input["gameplay"]:
+        game = games.get(appid)
+        if game is None:
+            continue
+        playtime_by_game[game["name"]] = playtime // 60
+        for genre in game["genres"]:
+            count_by_genre[genre] += 1
+            playtime_by_genre[genre] += playtime // 60
+        for developer in game["developers"][:1]:
+            count_by_developer[developer] += 1
+            playtime_by_developer[developer] += playtime // 60
+        if game["release_year"]:
+            count_by_release_year[str(game["release_year"])] += 1
+
+    count_by_country = defaultdict(int)
+    for friend in report_input["friends"]:
+        count_by_country[friend["loc_country"] or "Not Informed"] += 1
+    total_playtime_by_player = {
+        friend["persona_name"]: friend["total_playtime"] // 60 for friend in report_input["friends"]
+    }
+    total_playtime_by_player[report_input["persona_name"]] = sum(
+        playtime for _, playtime in report_input["gameplay"]
+    ) // 60
+
+    return {
+        "steamid": report_input["steamid"],
+        "persona_name": report_input["persona_name"],
+        "period": f"{report_input['created_year']}/{report_input['created_month']:02d}",
+        "charts": [
+            ("Top 10 Most Played Games", "Playtime in Hours", top_items(playtime_by_game)),
+            ("Count of Games by Genre", "Count of Games", top_items(count_by_genre)),
+            ("Total Playtime by Genre", "Playtime in Hours", top_items(playtime_by_genre)),
+            ("Count of Games per Developer", "Count of Games", top_items(count_by_developer)),
+            ("Playtime by Game Developer", "Playtime in Hours", top_items(playtime_by_developer)),
+            ("Games by Year Released", "Count of Games", sorted(map(list, count_by_release_year.items()))),
+            ("Friends per Country", "Count of Friends", top_items(count_by_country, count=len(count_by_country))),
+            ("Who played the most?", "Playtime in Hours", top_items(total_playtime_by_player)),
+        ],
+    }
+
+
+def render_chart(title: str, axis_title: str, items: List[List]) -> str:
+    labels = [str(label) for label, _ in items]
+    values = [value for _, value in items]
+    figure = go.Figure(
+        go.Bar(
+            x=values,
+            y=labels,
+            orientation="h",
+            marker_color=[CHART_COLORS[idx % len(CHART_COLORS)] for idx in range(len(items))],
+        )
+    )
+    figure.update_layout(
+        title=title, xaxis_title=axis_title, yaxis={"autorange": "reversed"}, width=640, height=480, showlegend=False
+    )
+    return figure.to_html(full_html=False, include_plotlyjs=False)
+
+
+def render_report(report_data: Dict) -> str:
+    charts = "\n".join(
+        render_chart(title, axis_title, items) for title, axis_title, items in report_data["charts"] if items
+    )
+    persona_name = html.escape(report_data["persona_name"])
+    return (
+        "<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n"
+        f"<title>Steam Profile Opera - {persona_name}</title>\n"
+        f"<script src=\"https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js\"></script>\n</head>\n<body>\n"
+        f"<h1>Steam Profile Opera - {persona_name}</h1>\n"
+        f"<p>Gameplay data for {report_data['period']}, generated on {dt.datetime.now().strftime('%d/%m/%Y')}.</p>\n"
+        f"{charts}\n</body>\n</html>\n"
+    )
+
+
+def write_player_report(report_input: Dict, output_dir: str) -> str:
+    """
+    Computes and renders the report of a player, runs on the worker processes.
+    """
+    report_path = player_report_path(output_dir, report_input["steamid"])
+    tmp_path = f"{report_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as report_file:
+        report_file.write(render_report(build_report_data(report_input)))
+    os.replace(tmp_path, report_path)
+    return report_path
+
+
+def configure_logging():
+    import sys
+
+    logging.getLogger("pymongo").setLevel(logging.CRITICAL)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setLevel(logging.INFO)
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s - %(message)s")
+    handler.setFormatter(formatter)
+    root.addHandler(handler)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    report()
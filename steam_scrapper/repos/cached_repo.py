@@ -0,0 +1,345 @@
+from typing import List, Optional, Dict, Union, Callable, Any
+from collections import OrderedDict
+import copy
+import datetime as dt
+import inspect
+import logging
+
+from repos.repo import Repo
+from models import (
+    SteamProfile,
+    SteamFriendList,
+    SteamGameinfo,
+    GameplayList,
+    GameplayMonthDeltaList,
+    PlayerMonthRollup,
+    CompactGameplayList,
+)
+
+FRIEND_LIST = "friend_list"
+PLAYER_INFO = "player_info"
+GAMEPLAY = "gameplay"
+GAMEPLAY_DELTA = "gameplay_delta"
+GAME_INFO = "game_info"
+PLAYER_ROLLUP = "player_rollup"
+CACHE_FAMILIES = [FRIEND_LIST, PLAYER_INFO, GAMEPLAY, GAMEPLAY_DELTA, GAME_INFO, PLAYER_ROLLUP]
+
+# read methods of the wrapped repo that are not part of the Repo interface but are safe to delegate untouched
+READ_ONLY_PREFIXES = ("get_", "iter_", "count_")
+# argument names used by the repo reads to filter by player
+PLAYER_ARGUMENTS = ("player_id", "player_id_list", "steam_id_list")
+
+
+def freeze(value) -> Any:
+    """
+    Turns call arguments into a hashable cache key.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class CachedRepo(Repo):
+    """
+    Read-through cache layered over any Repo, meant to live for a single scrapping run.
+
+    Profiles and game info are cached per id and written through on save, so a profile saved by
+    scrap_users is served from memory on the next lookup. The remaining reads are cached per call
+    arguments and their whole family is invalidated by any save or delete touching it.
+    Cached values are deep copied on the way out, so callers can mutate them like a fresh read.
+    """
+
+    def __init__(self, repo: Repo, max_size: int = 1024):
+        self.repo = repo
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self.hits = {family: 0 for family in CACHE_FAMILIES}
+        self.misses = {family: 0 for family in CACHE_FAMILIES}
+
+    def __getattr__(self, name: str):
+        # repo specific operations (batch updates, retention, ...) are delegated, and clear the cache
+        # when they may write since their effect on the cached queries is unknown
+        if name == "repo":
+            raise AttributeError(name)
+        attribute = getattr(self.repo, name)
+        if not callable(attribute) or name.startswith(READ_ONLY_PREFIXES):
+            return attribute
+
+        def clear_after_call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            self.clear()
+            return result
+
+        return clear_after_call
+
+    # Cache handling
+
+    def cache_stats(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        """
+        Returns the hits, misses and hit rate for each cached family plus the overall totals.
+        """
+        stats = {}
+        for family in CACHE_FAMILIES:
+            total = self.hits[family] + self.misses[family]
+            stats[family] = {
+                "hits": self.hits[family],
+                "misses": self.misses[family],
+                "hit_rate": self.hits[family] / total if total else 0.0,
+            }
+        total_hits = sum(self.hits.values())
+        total = total_hits + sum(self.misses.values())
+        stats["total"] = {
+            "hits": total_hits,
+            "misses": total - total_hits,
+            "hit_rate": total_hits / total if total else 0.0,
+            "size": len(self._cache),
+        }
+        return stats
+
+    def log_cache_stats(self) -> None:
+        total = self.cache_stats()["total"]
+        logging.info(
+            f"Repo cache: {total['hits']} hits, {total['misses']} misses "
+            f"({total['hit_rate']:.1%} hit rate), {total['size']} entries."
+        )
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def invalidate(self, family: str, entry_ids: Optional[List[str]] = None) -> None:
+        """
+        Drops the cached entries of a family affected by a write on the informed ids.
+        Cached queries not filtered by player are always dropped, as are all entries when no id is informed.
+        """
+        if entry_ids is not None:
+            for entry_id in entry_ids:
+                self._cache.pop((family, entry_id), None)
+        entry_id_set = set(entry_ids) if entry_ids is not None else None
+        for key in [key for key in self._cache if key[0] == family and len(key) == 3]:
+            key_player_ids = self._key_player_ids(key)
+            if entry_id_set is None or not key_player_ids or key_player_ids.intersection(entry_id_set):
+                del self._cache[key]
+
+    @staticmethod
+    def _key_player_ids(key) -> set:
+        player_ids = set()
+        for name, value in key[2]:
+            if name in PLAYER_ARGUMENTS and value is not None:
+                player_ids.update(value if isinstance(value, tuple) else [value])
+        return player_ids
+
+    def _store(self, key, value) -> None:
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def _read_through(self, family: str, method: Callable, *args, **kwargs) -> Any:
+        bound_arguments = inspect.signature(method).bind(*args, **kwargs)
+        bound_arguments.apply_defaults()
+        key = (family, method.__name__, freeze(bound_arguments.arguments))
+        if key in self._cache:
+            self.hits[family] += 1
+            self._cache.move_to_end(key)
+            value = self._cache[key]
+        else:
+            self.misses[family] += 1
+            value = method(*args, **kwargs)
+            self._store(key, value)
+        return copy.deepcopy(value)
+
+    def _read_through_by_id(
+        self, family: str, id_list: List[str], loader: Callable[[List[str]], List], id_getter: Callable[[Any], str]
+    ) -> List:
+        found = {}
+        missing_ids = []
+        for entry_id in dict.fromkeys(id_list):
+            if (family, entry_id) in self._cache:
+                self._cache.move_to_end((family, entry_id))
+                found[entry_id] = self._cache[(family, entry_id)]
+            else:
+                missing_ids.append(entry_id)
+        self.hits[family] += len(found)
+        if missing_ids:
+            self.misses[family] += len(missing_ids)
+            loaded = {id_getter(item): item for item in loader(missing_ids)}
+            for entry_id in missing_ids:
+                # ids missing from the repo are cached as None, so unknown ids are not queried again
+                found[entry_id] = loaded.get(entry_id)
+                self._store((family, entry_id), found[entry_id])
+        return [copy.deepcopy(item) for item in found.values() if item is not None]
+
+    def _write_through_by_id(self, family: str, item_list: List, id_getter: Callable[[Any], str]) -> None:
+        for item in item_list:
+            self._store((family, id_getter(item)), copy.deepcopy(item))
+
+    # Friend List
+
+    def get_existing_friend_list_ids(
+        self, player_id_list: List[str], created_year: Optional[int] = None, created_month: Optional[int] = None
+    ) -> List[str]:
+        return self._read_through(
+            FRIEND_LIST,
+            self.repo.get_existing_friend_list_ids,
+            player_id_list=player_id_list,
+            created_year=created_year,
+            created_month=created_month,
+        )
+
+    def get_friend_list_by_id(
+        self, player_id: str, created_year: Optional[int] = None, created_month: Optional[int] = None
+    ) -> List[SteamFriendList]:
+        return self._read_through(
+            FRIEND_LIST,
+            self.repo.get_friend_list_by_id,
+            player_id=player_id,
+            created_year=created_year,
+            created_month=created_month,
+        )
+
+    def save_friend_list(self, player_friend_list: SteamFriendList):
+        self.repo.save_friend_list(player_friend_list)
+        self.invalidate(FRIEND_LIST, [player_friend_list.steamid])
+
+    # Player Info
+
+    def get_player_info_by_id_list(self, player_id_list: List[str]) -> List[SteamProfile]:
+        return self._read_through_by_id(
+            PLAYER_INFO, player_id_list, self.repo.get_player_info_by_id_list, lambda profile: profile.steamid
+        )
+
+    def save_player_info_list(self, player_info_list: List[SteamProfile]):
+        self.repo.save_player_info_list(player_info_list)
+        self._write_through_by_id(PLAYER_INFO, player_info_list, lambda profile: profile.steamid)
+
+    def delete_player_info_list(self, player_id_list: List[str]):
+        self.repo.delete_player_info_list(player_id_list)
+        self.invalidate(PLAYER_INFO, player_id_list)
+
+    # Gameplay Info
+
+    def get_existing_gameplay_info_ids(
+        self, player_id_list: List[str], created_year: Optional[int] = None, created_month: Optional[int] = None
+    ) -> List[str]:
+        return self._read_through(
+            GAMEPLAY,
+            self.repo.get_existing_gameplay_info_ids,
+            player_id_list=player_id_list,
+            created_year=created_year,
+            created_month=created_month,
+        )
+
+    def get_gameplay_info_by_id(
+        self,
+        player_id: Optional[str] = None,
+        created_year: Optional[int] = None,
+        created_month: Optional[int] = None,
+        **kwargs,
+    ) -> List[GameplayList]:
+        return self._read_through(
+            GAMEPLAY,
+            self.repo.get_gameplay_info_by_id,
+            player_id=player_id,
+            created_year=created_year,
+            created_month=created_month,
+            **kwargs,
+        )
+
+    def get_gameplay_info_by_id_list(
+        self,
+        player_id_list: List[str] = None,
+        created_year: Optional[int] = None,
+        created_month: Optional[int] = None,
+        sort_query: Optional[bool] = False,
+        compact: bool = False,
+    ) -> Union[List[GameplayList], List[CompactGameplayList]]:
+        return self._read_through(
+            GAMEPLAY,
+            self.repo.get_gameplay_info_by_id_list,
+            player_id_list=player_id_list,
+            created_year=created_year,
+            created_month=created_month,
+            sort_query=sort_query,
+            compact=compact,
+        )
+
+    def save_gameplay_info(self, gameplay_info: GameplayList):
+        self.repo.save_gameplay_info(gameplay_info)
+        self.invalidate(GAMEPLAY, [gameplay_info.steamid])
+
+    def delete_gameplay_info(
+        self, player_id: Optional[str] = None, created_year: Optional[int] = None, created_month: Optional[int] = None
+    ):
+        self.repo.delete_gameplay_info(player_id=player_id, created_year=created_year, created_month=created_month)
+        self.invalidate(GAMEPLAY, [player_id] if player_id else None)
+
+    def delete_gameplay_info_by_id_list(
+        self, player_id_list: List[str], created_year: Optional[int] = None, created_month: Optional[int] = None
+    ):
+        self.repo.delete_gameplay_info_by_id_list(
+            player_id_list=player_id_list, created_year=created_year, created_month=created_month
+        )
+        self.invalidate(GAMEPLAY, player_id_list)
+
+    # Gameplay Delta
+
+    def get_existing_gameplay_delta_info_id_list(
+        self,
+        steam_id_list: List[str],
+        created_year: Optional[int] = None,
+        created_month: Optional[int] = None,
+        updated_at: Optional[dt.datetime] = None,
+    ) -> Union[None, List[str]]:
+        return self._read_through(
+            GAMEPLAY_DELTA,
+            self.repo.get_existing_gameplay_delta_info_id_list,
+            steam_id_list=steam_id_list,
+            created_year=created_year,
+            created_month=created_month,
+            updated_at=updated_at,
+        )
+
+    def get_existing_gameplay_delta_info_list(
+        self, steam_id_list: List[str], created_year: Optional[int] = None, created_month: Optional[int] = None
+    ) -> Union[None, List[GameplayMonthDeltaList]]:
+        return self._read_through(
+            GAMEPLAY_DELTA,
+            self.repo.get_existing_gameplay_delta_info_list,
+            steam_id_list=steam_id_list,
+            created_year=created_year,
+            created_month=created_month,
+        )
+
+    def save_gameplay_delta_info_list(self, gameplay_delta_info_list: List[GameplayMonthDeltaList]):
+        self.repo.save_gameplay_delta_info_list(gameplay_delta_info_list)
+        self.invalidate(GAMEPLAY_DELTA, [gameplay_delta.steamid for gameplay_delta in gameplay_delta_info_list])
+
+    # Player Rollups
+
+    def get_player_rollup_list(
+        self, player_id_list: List[str], created_year: Optional[int] = None, created_month: Optional[int] = None
+    ) -> List[PlayerMonthRollup]:
+        return self._read_through(
+            PLAYER_ROLLUP,
+            self.repo.get_player_rollup_list,
+            player_id_list=player_id_list,
+            created_year=created_year,
+            created_month=created_month,
+        )
+
+    def save_player_rollup_list(self, player_rollup_list: List[PlayerMonthRollup]):
+        self.repo.save_player_rollup_list(player_rollup_list)
+        self.invalidate(PLAYER_ROLLUP, [player_rollup.steamid for player_rollup in player_rollup_list])
+
+    # Game Info
+
+    def get_game_info_by_game_id_list(self, game_id_list: List[str]) -> List[SteamGameinfo]:
+        return self._read_through_by_id(
+            GAME_INFO, game_id_list, self.repo.get_game_info_by_game_id_list, lambda game_info: game_info.appid
+        )
+
+    def save_game_info_list(self, game_info_list: List[SteamGameinfo]):
+        self.repo.save_game_info_list(game_info_list)
+        self._write_through_by_id(GAME_INFO, game_info_list, lambda game_info: game_info.appid)
@@ -1,12 +1,18 @@
-from typing import Optional, List, Dict, Union
+from typing import Optional, List, Dict, Union, Iterator, Tuple
 import os
+import re
 from dataclasses import asdict, fields
 import logging
 import json
+import datetime as dt
+import hashlib
+from collections import defaultdict
+import time
+import uuid
 
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
-from pymongo import ASCENDING, DESCENDING, ReplaceOne
+from pymongo import ASCENDING, DESCENDING, ReplaceOne, UpdateOne, ReturnDocument
 import certifi
 
 from repos.repo import Repo
@@ -19,23 +25,316 @@ from models import (
     GameplayItem,
     GameplayMonthDeltaItem,
     GameplayMonthDeltaList,
+    PlayerMonthRollup,
+    RollupItem,
+    WorkItem,
+    CompactGameplayList,
+    CompactSteamFriendList,
+    CompactGameplayMonthDeltaList,
+    NO_TIMESTAMP,
+    int64_array,
 )
 from errors import DatabaseDeletionError, DatabaseUpdateError
+from utils import get_last_month_and_year, to_epoch
+
+GAMEPLAY_BUCKET_PREFIX = "gameplay"
+GAMEPLAY_ARCHIVE_PREFIX = "archive_gameplay"
+GAMEPLAY_BUCKET_PATTERN = re.compile(rf"^{GAMEPLAY_BUCKET_PREFIX}_(\d{{4}})_(\d{{2}})$")
+RETENTION_ACTIONS = ["drop", "archive"]
+# document types indexed in app_players, with the field holding their games
+APP_PLAYERS_LIST_FIELDS = {"gameplay_info": "gameplay_list", "gameplay_delta": "gameplay_delta_list"}
+APP_PLAYERS_PERIOD_KEYS = [("source", ASCENDING), ("created_year", ASCENDING), ("created_month", ASCENDING)]
+# unique index of the postings with a steamids array, replaced by the one row per player index
+APP_PLAYERS_LEGACY_INDEX = "appid_1_source_1_created_year_1_created_month_1"
+APP_PLAYERS_WRITE_BATCH_SIZE = 1000
+# the server side deltas join with a $lookup using both localField and a pipeline
+SERVER_DELTA_MIN_VERSION = (5, 0)
+# status of the work queue items, dead items used all their attempts and wait for a manual requeue
+WORK_PENDING = "pending"
+WORK_LEASED = "leased"
+WORK_DONE = "done"
+WORK_DEAD = "dead"
+WORK_STATUSES = [WORK_PENDING, WORK_LEASED, WORK_DONE, WORK_DEAD]
+
+FRIEND_LIST_FULL = "full"
+FRIEND_LIST_DIFF = "diff"
+# a full snapshot is stored at least every FRIEND_LIST_KEYFRAME_INTERVAL periods, bounding the diffs read per rebuild
+FRIEND_LIST_KEYFRAME_INTERVAL = 12
+
+STEAM_PROFILE_FIELDS = set(f.name for f in fields(SteamProfile))
+FRIEND_LIST_FIELDS = set(f.name for f in fields(SteamFriendList))
+FRIEND_ITEM_FIELDS = set(f.name for f in fields(SteamFriendItem))
+GAMEPLAY_LIST_FIELDS = set(f.name for f in fields(GameplayList))
+GAMEPLAY_ITEM_FIELDS = set(f.name for f in fields(GameplayItem))
+GAMEPLAY_DELTA_LIST_FIELDS = set(f.name for f in fields(GameplayMonthDeltaList))
+GAMEPLAY_DELTA_ITEM_FIELDS = set(f.name for f in fields(GameplayMonthDeltaItem))
+GAME_INFO_FIELDS = set(f.name for f in fields(SteamGameinfo))
+PLAYER_ROLLUP_FIELDS = set(f.name for f in fields(PlayerMonthRollup))
+ROLLUP_ITEM_FIELDS = set(f.name for f in fields(RollupItem))
+ROLLUP_LIST_FIELDS = ["genres", "developers", "publishers", "top_games"]
+WORK_ITEM_FIELDS = set(f.name for f in fields(WorkItem))
+
+
+# Decoders and encoders of the Mongo documents, shared with the in memory repo of the benchmarks
+
+def decode_steam_profile(document: Dict) -> SteamProfile:
+    return SteamProfile(**{k: v for k, v in document.items() if k in STEAM_PROFILE_FIELDS})
+
+
+def decode_friend_list(document: Dict) -> SteamFriendList:
+    friend_list = SteamFriendList(**{k: v for k, v in document.items() if k in FRIEND_LIST_FIELDS})
+    friend_list.friend_list = [
+        SteamFriendItem(**{k: v for k, v in friend_item.items() if k in FRIEND_ITEM_FIELDS})
+        for friend_item in friend_list.friend_list
+    ]
+    return friend_list
+
+
+def decode_gameplay_list(document: Dict) -> GameplayList:
+    gameplay_info = GameplayList(**{k: v for k, v in document.items() if k in GAMEPLAY_LIST_FIELDS})
+    gameplay_info.gameplay_list = [
+        GameplayItem(**{k: v for k, v in gameplay_item.items() if k in GAMEPLAY_ITEM_FIELDS})
+        for gameplay_item in gameplay_info.gameplay_list
+    ]
+    return gameplay_info
+
+
+def decode_gameplay_delta_list(document: Dict) -> GameplayMonthDeltaList:
+    gameplay_delta = GameplayMonthDeltaList(**{k: v for k, v in document.items() if k in GAMEPLAY_DELTA_LIST_FIELDS})
+    gameplay_delta.gameplay_delta_list = [
+        GameplayMonthDeltaItem(**{k: v for k, v in gameplay_item.items() if k in GAMEPLAY_DELTA_ITEM_FIELDS})
+        for gameplay_item in gameplay_delta.gameplay_delta_list
+    ]
+    return gameplay_delta
+
+
+def decode_game_info(document: Dict) -> SteamGameinfo:
+    return SteamGameinfo(**{k: v for k, v in document.items() if k in GAME_INFO_FIELDS})
+
+
+def decode_player_rollup(document: Dict) -> PlayerMonthRollup:
+    player_rollup = PlayerMonthRollup(**{k: v for k, v in document.items() if k in PLAYER_ROLLUP_FIELDS})
+    for field_name in ROLLUP_LIST_FIELDS:
+        setattr(
+            player_rollup,
+            field_name,
+            [
+                RollupItem(**{k: v for k, v in rollup_item.items() if k in ROLLUP_ITEM_FIELDS})
+                for rollup_item in getattr(player_rollup, field_name)
+            ],
+        )
+    return player_rollup
+
+
+def decode_work_item(document: Dict) -> WorkItem:
+    return WorkItem(item_id=document["_id"], **{k: v for k, v in document.items() if k in WORK_ITEM_FIELDS})
+
+
+def encode_gameplay_list(gameplay_info: GameplayList) -> Dict:
+    gameplay_dict = asdict(gameplay_info)
+    for gameplay_item in gameplay_dict["gameplay_list"]:
+        gameplay_item["appid"] = str(gameplay_item["appid"])
+    return gameplay_dict
+
+
+def encode_gameplay_delta_list(gameplay_delta: GameplayMonthDeltaList) -> Dict:
+    gameplay_delta_dict = asdict(gameplay_delta)
+    for gameplay_delta_item in gameplay_delta_dict["gameplay_delta_list"]:
+        gameplay_delta_item["appid"] = str(gameplay_delta_item["appid"])
+    return gameplay_delta_dict
+
+
+def encode_game_info(game_info: SteamGameinfo) -> Dict:
+    game_info_dict = asdict(game_info)
+    game_info_dict["appid"] = str(game_info_dict["appid"])
+    return game_info_dict
+
+
+def decode_compact_timestamps(document: Dict) -> Dict:
+    return dict(
+        created_at=to_epoch(document["created_at"]),
+        updated_at=to_epoch(document["updated_at"]),
+        last_failed_update_attempt=to_epoch(document.get("last_failed_update_attempt")),
+    )
+
+
+def decode_compact_gameplay_list(document: Dict) -> CompactGameplayList:
+    """
+    Decodes a gameplay document straight into the columns of a CompactGameplayList, without building
+    the GameplayItem objects of decode_gameplay_list.
+    """
+    gameplay_list = document.get("gameplay_list") or []
+    return CompactGameplayList(
+        steamid=int(document["steamid"]),
+        created_year=document["created_year"],
+        created_month=document["created_month"],
+        appids=int64_array(int(gameplay_item["appid"]) for gameplay_item in gameplay_list),
+        playtimes=int64_array(gameplay_item["playtime"] for gameplay_item in gameplay_list),
+        last_times_played=int64_array(
+            to_epoch(gameplay_item.get("last_time_played")) or NO_TIMESTAMP for gameplay_item in gameplay_list
+        ),
+        **decode_compact_timestamps(document),
+    )
+
+
+def decode_compact_friend_list(document: Dict) -> CompactSteamFriendList:
+    friend_list = document.get("friend_list") or []
+    return CompactSteamFriendList(
+        steamid=int(document["steamid"]),
+        created_year=document["created_year"],
+        created_month=document["created_month"],
+        steamids=int64_array(int(friend_item["steamid"]) for friend_item in friend_list),
+        friend_since=int64_array(to_epoch(friend_item["friend_since"]) for friend_item in friend_list),
+        **decode_compact_timestamps(document),
+    )
+
+
+def decode_compact_gameplay_delta_list(document: Dict) -> CompactGameplayMonthDeltaList:
+    gameplay_delta_list = document.get("gameplay_delta_list") or []
+    return CompactGameplayMonthDeltaList(
+        steamid=int(document["steamid"]),
+        total_playtime=document["total_playtime"],
+        created_year=document["created_year"],
+        created_month=document["created_month"],
+        appids=int64_array(int(gameplay_delta_item["appid"]) for gameplay_delta_item in gameplay_delta_list),
+        playtimes=int64_array(gameplay_delta_item["playtime"] for gameplay_delta_item in gameplay_delta_list),
+        **decode_compact_timestamps(document),
+    )
+
+
+def encode_compact_gameplay_list(gameplay_info: CompactGameplayList) -> Dict:
+    return encode_gameplay_list(gameplay_info.to_model())
+
+
+def encode_compact_friend_list(friend_list: CompactSteamFriendList) -> Dict:
+    return asdict(friend_list.to_model())
+
+
+def encode_compact_gameplay_delta_list(gameplay_delta: CompactGameplayMonthDeltaList) -> Dict:
+    return encode_gameplay_delta_list(gameplay_delta.to_model())
+
+
+def app_players_rows(source: str, documents: List[Dict]) -> List[Dict]:
+    """
+    Builds the app_players rows of the encoded gameplay documents, one per appid, source, period and player,
+    for the games with playtime.
+    """
+    rows = {}
+    for document in documents:
+        for gameplay_item in document[APP_PLAYERS_LIST_FIELDS[source]]:
+            if gameplay_item["playtime"] and gameplay_item["playtime"] > 0:
+                row = {
+                    "source": source,
+                    "created_year": document["created_year"],
+                    "created_month": document["created_month"],
+                    "appid": str(gameplay_item["appid"]),
+                    "steamid": document["steamid"],
+                }
+                rows[tuple(row.values())] = row
+    return list(rows.values())
+
+
+def app_players_updates(source: str, documents: List[Dict]) -> List[ReplaceOne]:
+    """
+    Builds the upserts of the app_players rows, which are their own filter, so saving a document twice is a no-op.
+    """
+    return [ReplaceOne(row, row, upsert=True) for row in app_players_rows(source, documents)]
+
+
+def work_item_id(kind: str, key: str) -> str:
+    return f"{kind}:{key}"
+
+
+def friend_list_period(created_year: int, created_month: int) -> int:
+    return created_year * 100 + created_month
+
+
+def encode_friend_list_history(
+    friend_list: SteamFriendList, previous_friends: Optional[Dict[str, Dict]] = None
+) -> Dict:
+    """
+    Encodes a friend list snapshot for the history collection: in full without a previous snapshot, otherwise
+    only the friends added since it and the steamids removed. A friend whose friend_since changed, removed and
+    added again in between, is stored as added.
+
+    :param friend_list: snapshot to encode
+    :type friend_list: SteamFriendList
+    :param previous_friends: encoded friends of the previous snapshot by steamid, None to store it in full
+    :type previous_friends: Dict[str, Dict]
+    """
+    document = asdict(friend_list)
+    document["period"] = friend_list_period(friend_list.created_year, friend_list.created_month)
+    if previous_friends is None:
+        document["kind"] = FRIEND_LIST_FULL
+        return document
+    friends = document.pop("friend_list")
+    current_steamids = set(friend_item["steamid"] for friend_item in friends)
+    document["kind"] = FRIEND_LIST_DIFF
+    document["added"] = [
+        friend_item for friend_item in friends if previous_friends.get(friend_item["steamid"]) != friend_item
+    ]
+    document["removed"] = [steamid for steamid in previous_friends if steamid not in current_steamids]
+    return document
+
+
+def apply_friend_list_history(friends: Dict[str, Dict], document: Dict) -> Dict[str, Dict]:
+    """
+    Applies a history document to the encoded friends by steamid of the previous snapshot, in place for the diffs.
+    """
+    if document["kind"] == FRIEND_LIST_FULL:
+        return {friend_item["steamid"]: friend_item for friend_item in document["friend_list"]}
+    for steamid in document["removed"]:
+        friends.pop(steamid, None)
+    for friend_item in document["added"]:
+        friends[friend_item["steamid"]] = friend_item
+    return friends
+
+
+def decode_friend_list_history(document: Dict, friends: Dict[str, Dict]) -> SteamFriendList:
+    return decode_friend_list(
+        {**{k: v for k, v in document.items() if k in FRIEND_LIST_FIELDS}, "friend_list": list(friends.values())}
+    )
+
+
+def gameplay_bucket_name(created_year: int, created_month: int) -> str:
+    return f"{GAMEPLAY_BUCKET_PREFIX}_{created_year:04d}_{created_month:02d}"
+
 
 class SteamMongo(Repo):
-    def __init__(self, mongo_url:str):
-        self.client = MongoClient(mongo_url, server_api=ServerApi("1"), tlsCAFile=certifi.where())
-        try:
-            self.client.admin.command('ping')
-            print("Pinged your deployment. You successfully connected to MongoDB!")
-        except Exception as e:
-            print(e)
+    def __init__(
+        self,
+        mongo_url: str,
+        gameplay_partitioned: bool = False,
+        friend_list_history: bool = False,
+        app_players_index: bool = False,
+    ):
+        # connect=False defers the connection to the first operation, so building the repo never blocks
+        self.client = MongoClient(mongo_url, server_api=ServerApi("1"), tlsCAFile=certifi.where(), connect=False)
         self.steam_db = self.client.SteamOperaDB
         self.steam_profiles = self.steam_db.steam_profiles
         self.friend_lists = self.steam_db.friend_lists
         self.gameplay = self.steam_db.gameplay
         self.game_info = self.steam_db.game_info
         self.gameplay_delta = self.steam_db.gameplay_delta
+        self.job_markers = self.steam_db.job_markers
+        self.player_rollups = self.steam_db.player_rollups
+        self._player_rollups_indexed = False
+        # when enabled, saving gameplay snapshots and deltas maintains the app_players rows
+        self.app_players_index = app_players_index
+        self.app_players = self.steam_db.app_players
+        self._app_players_indexed = False
+        self.work_queue = self.steam_db.work_queue
+        self._work_queue_indexed = False
+        # when partitioned, gameplay snapshots live in one gameplay_YYYY_MM collection per period
+        self.gameplay_partitioned = gameplay_partitioned
+        self._indexed_gameplay_buckets = set()
+        # with the history, every period of the friend lists is kept as a diff to the previous one
+        self.friend_list_history = friend_list_history
+        self.friend_list_snapshots = self.steam_db.friend_list_history
+        self._friend_list_snapshots_indexed = False
+
+    def ping(self) -> None:
+        self.client.admin.command("ping")
 
     # Friend List
 
@@ -49,7 +348,11 @@ class SteamMongo(Repo):
             query_dict.update({"created_year":created_year})
         if created_month is not None:
             query_dict.update({"created_month":created_month})
-        result = self.friend_lists.aggregate([
+        # the periods of the lists are only all kept in the history, friend_lists holds the latest one
+        collection = self.friend_lists
+        if self.friend_list_history and (created_year is not None or created_month is not None):
+            collection = self.friend_list_snapshots
+        result = collection.aggregate([
             # Match the documents possible
             { "$match": query_dict },
             # Group the documents and "count" via $sum on the values
@@ -68,28 +371,22 @@ class SteamMongo(Repo):
             player_id: str, 
             created_year: Optional[int]=None, 
             created_month: Optional[int]=None)->List[SteamFriendList]:
+        if self.friend_list_history and (created_year is not None or created_month is not None):
+            return self.get_friend_list_history(player_id, created_year=created_year, created_month=created_month)
         query_dict = {"steamid": player_id}
         if created_year is not None:
             query_dict.update({"created_year":created_year})
         if created_month is not None:
             query_dict.update({"created_month":created_month})
         result_query = self.friend_lists.find(query_dict).sort("updated_at",DESCENDING)
-        field_names = set(f.name for f in fields(SteamFriendList))
-        final_result = [SteamFriendList(
-            **{k:v for k,v in friend_list_item.items() if k in field_names}) for friend_list_item in result_query]
-        friend_list_item_field_names = set(f.name for f in fields(SteamFriendItem))
-        for friend_list in final_result:
-            friend_list.friend_list = [
-                SteamFriendItem(
-                    **{k:v for k,v in friend_list_item.items() if k in friend_list_item_field_names}) 
-                    for friend_list_item in friend_list.friend_list
-            ]
-        return final_result
+        return [decode_friend_list(friend_list_item) for friend_list_item in result_query]
 
     def save_friend_list(self, player_friend_list: SteamFriendList):
         friend_list_dict = asdict(player_friend_list)
         result = self.friend_lists.replace_one({"steamid":player_friend_list.steamid},friend_list_dict,upsert=True)
         logging.debug(result)
+        if self.friend_list_history:
+            self.save_friend_list_history(player_friend_list)
 
     def delete_friend_list(self, created_month: Optional[int] = None, created_year: Optional[int] = None):
         if not any([created_month, created_year]):
@@ -102,16 +399,174 @@ class SteamMongo(Repo):
         if created_year is not None:
             delete_filter["created_year"] = created_year
         self.friend_lists.delete_many(delete_filter)
+        if self.friend_list_history:
+            self.delete_friend_list_history(delete_filter)
+
+    # Friend List History
+
+    def _index_friend_list_snapshots(self) -> None:
+        if not self._friend_list_snapshots_indexed:
+            self.friend_list_snapshots.create_index([("steamid", ASCENDING), ("period", ASCENDING)], unique=True)
+            self._friend_list_snapshots_indexed = True
+
+    def _friend_list_history_chain(self, player_id: str, period: int, inclusive: bool = True) -> List[Dict]:
+        """
+        Returns the history documents needed to rebuild the last snapshot of the player up to period: the latest
+        full snapshot and the diffs following it, oldest first. Empty when the player has no snapshot yet.
+        """
+        self._index_friend_list_snapshots()
+        period_filter = {"$lte": period} if inclusive else {"$lt": period}
+        keyframe = self.friend_list_snapshots.find_one(
+            {"steamid": player_id, "kind": FRIEND_LIST_FULL, "period": period_filter}, {"period": 1},
+            sort=[("period", DESCENDING)],
+        )
+        if keyframe is None:
+            return []
+        return list(
+            self.friend_list_snapshots.find(
+                {"steamid": player_id, "period": {**period_filter, "$gte": keyframe["period"]}}, {"_id": 0}
+            ).sort("period", ASCENDING)
+        )
+
+    def rebuild_friend_list(self, player_id: str, created_year: int, created_month: int) -> Optional[SteamFriendList]:
+        """
+        Rebuilds the friend list of the player for a period from the history, None when it was not scrapped then.
+
+        :param player_id: steamid of the player
+        :type player_id: str
+        :param created_year: year of the period
+        :type created_year: int
+        :param created_month: month of the period
+        :type created_month: int
+        """
+        period = friend_list_period(created_year, created_month)
+        chain = self._friend_list_history_chain(player_id, period)
+        if not chain or chain[-1]["period"] != period:
+            return None
+        friends = {}
+        for document in chain:
+            friends = apply_friend_list_history(friends, document)
+        return decode_friend_list_history(chain[-1], friends)
+
+    def get_friend_list_history(
+        self, player_id: str, created_year: Optional[int] = None, created_month: Optional[int] = None
+    ) -> List[SteamFriendList]:
+        """
+        Rebuilds the friend lists of the player for the matching periods from the history, latest updated first.
+
+        :param player_id: steamid of the player
+        :type player_id: str
+        :param created_year: year of the periods, all years when None
+        :type created_year: int
+        :param created_month: month of the periods, all months when None
+        :type created_month: int
+        """
+        if created_year is not None and created_month is not None:
+            friend_list = self.rebuild_friend_list(player_id, created_year, created_month)
+            return [friend_list] if friend_list is not None else []
+        query_dict = {"steamid": player_id}
+        if created_year is not None:
+            query_dict["period"] = {
+                "$gte": friend_list_period(created_year, 1), "$lte": friend_list_period(created_year, 12)
+            }
+        matching_periods = set(
+            document["period"] for document in self.friend_list_snapshots.find(query_dict, {"period": 1})
+            if created_month is None or document["period"] % 100 == created_month
+        )
+        if not matching_periods:
+            return []
+        # one pass from the keyframe preceding the first match rebuilds every matching period
+        chain = self._friend_list_history_chain(player_id, min(matching_periods))
+        chain_start = chain[0]["period"] if chain else min(matching_periods)
+        documents = self.friend_list_snapshots.find(
+            {"steamid": player_id, "period": {"$gte": chain_start, "$lte": max(matching_periods)}}, {"_id": 0}
+        ).sort("period", ASCENDING)
+        friend_lists = []
+        friends = {}
+        for document in documents:
+            friends = apply_friend_list_history(friends, document)
+            if document["period"] in matching_periods:
+                friend_lists.append(decode_friend_list_history(document, friends))
+        return sorted(friend_lists, key=lambda friend_list: friend_list.updated_at, reverse=True)
+
+    def save_friend_list_history(self, player_friend_list: SteamFriendList) -> None:
+        """
+        Stores the friend list in the history as a diff to the previous period of the player, or in full for its
+        first period and every FRIEND_LIST_KEYFRAME_INTERVAL periods. When a later period is already stored, it is
+        rewritten in full so its diff does not depend on the snapshot being replaced.
+        """
+        steamid = player_friend_list.steamid
+        period = friend_list_period(player_friend_list.created_year, player_friend_list.created_month)
+        chain = self._friend_list_history_chain(steamid, period, inclusive=False)
+        previous_friends = None
+        if 0 < len(chain) < FRIEND_LIST_KEYFRAME_INTERVAL:
+            previous_friends = {}
+            for document in chain:
+                previous_friends = apply_friend_list_history(previous_friends, document)
+        next_document = self.friend_list_snapshots.find_one(
+            {"steamid": steamid, "period": {"$gt": period}}, {"period": 1, "kind": 1}, sort=[("period", ASCENDING)]
+        )
+        next_friend_list = None
+        if next_document is not None and next_document["kind"] == FRIEND_LIST_DIFF:
+            next_friend_list = self.rebuild_friend_list(
+                steamid, created_year=next_document["period"] // 100, created_month=next_document["period"] % 100
+            )
+        self.friend_list_snapshots.replace_one(
+            {"steamid": steamid, "period": period},
+            encode_friend_list_history(player_friend_list, previous_friends),
+            upsert=True,
+        )
+        if next_friend_list is not None:
+            self.friend_list_snapshots.replace_one(
+                {"steamid": steamid, "period": next_document["period"]}, encode_friend_list_history(next_friend_list)
+            )
+
+    def delete_friend_list_history(self, delete_filter: Dict) -> None:
+        """
+        Deletes the matching periods from the history. The diffs following a deleted period are rewritten in full
+        first, as their base is going away.
+        """
+        deleted_keys = set(
+            (document["steamid"], document["period"])
+            for document in self.friend_list_snapshots.find(delete_filter, {"steamid": 1, "period": 1})
+        )
+        rebased_documents = []
+        for steamid in set(steamid for steamid, _ in deleted_keys):
+            friends = {}
+            previous_deleted = False
+            for document in self.friend_list_snapshots.find({"steamid": steamid}, {"_id": 0}).sort("period", ASCENDING):
+                friends = apply_friend_list_history(friends, document)
+                deleted = (steamid, document["period"]) in deleted_keys
+                if previous_deleted and not deleted and document["kind"] == FRIEND_LIST_DIFF:
+                    rebased_documents.append(encode_friend_list_history(decode_friend_list_history(document, friends)))
+                previous_deleted = deleted
+        if rebased_documents:
+            self.friend_list_snapshots.bulk_write(
+                [
+                    ReplaceOne({"steamid": document["steamid"], "period": document["period"]}, document)
+                    for document in rebased_documents
+                ]
+            )
+        self.friend_list_snapshots.delete_many(delete_filter)
+
+    def migrate_friend_lists_to_history(self) -> int:
+        """
+        Seeds the history with the friend lists currently stored, one period per player. Idempotent, a period
+        already in the history is replaced by the same snapshot.
+        """
+        if not self.friend_list_history:
+            raise DatabaseUpdateError("The friend list history is only available with FRIEND_LIST_HISTORY enabled.")
+        migrated = 0
+        for document in self.friend_lists.find({}, {"_id": 0}):
+            self.save_friend_list_history(decode_friend_list(document))
+            migrated += 1
+        return migrated
 
     # Player Info
 
     def get_player_info_by_id_list(self, player_id_list: List[str])->List[SteamProfile]:
         result_query = self.steam_profiles.find({"steamid": {"$in":player_id_list}})
-        field_names = set(f.name for f in fields(SteamProfile))
-        final_result = [SteamProfile(
-            **{k:v for k,v in profile.items() if k in field_names}) 
-            for profile in list(result_query)]
-        return final_result
+        return [decode_steam_profile(profile) for profile in result_query]
 
     def save_player_info_list(self, player_info_list: List[SteamProfile]):
         if len(player_info_list)>0:
@@ -124,6 +579,39 @@ class SteamMongo(Repo):
         result = self.steam_profiles.delete_many({"steamid": {"$in":player_id_list}})
 
     # Gameplay Info
+    def gameplay_bucket(self, created_year: int, created_month: int):
+        """
+        Returns the collection holding the gameplay snapshots of a single period.
+        """
+        if not self.gameplay_partitioned:
+            return self.gameplay
+        return self.steam_db[gameplay_bucket_name(created_year, created_month)]
+
+    def get_gameplay_bucket_periods(self) -> List[Tuple[int, int]]:
+        """
+        Lists the (created_year, created_month) periods that have a gameplay bucket, oldest first.
+        """
+        periods = []
+        for collection_name in self.steam_db.list_collection_names():
+            if match := GAMEPLAY_BUCKET_PATTERN.match(collection_name):
+                periods.append((int(match.group(1)), int(match.group(2))))
+        return sorted(periods)
+
+    def gameplay_buckets(self, created_year: Optional[int] = None, created_month: Optional[int] = None) -> List:
+        """
+        Returns the gameplay collections that may hold documents for the informed period filter.
+        Queries for a given year and month only touch that period bucket.
+        """
+        if not self.gameplay_partitioned:
+            return [self.gameplay]
+        if created_year is not None and created_month is not None:
+            return [self.gameplay_bucket(created_year, created_month)]
+        return [
+            self.gameplay_bucket(year, month)
+            for year, month in self.get_gameplay_bucket_periods()
+            if (created_year is None or year == created_year) and (created_month is None or month == created_month)
+        ]
+
     def get_existing_gameplay_info_ids(
         self, 
         player_id_list: List[str], 
@@ -134,19 +622,21 @@ class SteamMongo(Repo):
             query_dict.update({"created_year":created_year})
         if created_month is not None:
             query_dict.update({"created_month":created_month})
-        result = self.gameplay.aggregate([
-            # Match the documents possible
-            { "$match": query_dict },
-            # Group the documents and "count" via $sum on the values
-            { "$group": {
-                "_id": {
-                    "steamid": "$steamid"
-                },
-                "count": { "$sum": 1 }
-            }}
-        ])
-        result_list = [item["_id"]["steamid"] for item in list(result)]
-        return result_list
+        result_set = set()
+        for bucket in self.gameplay_buckets(created_year=created_year, created_month=created_month):
+            result = bucket.aggregate([
+                # Match the documents possible
+                { "$match": query_dict },
+                # Group the documents and "count" via $sum on the values
+                { "$group": {
+                    "_id": {
+                        "steamid": "$steamid"
+                    },
+                    "count": { "$sum": 1 }
+                }}
+            ])
+            result_set.update(item["_id"]["steamid"] for item in result)
+        return list(result_set)
 
     def get_gameplay_info_by_id(
         self,
@@ -172,7 +662,8 @@ class SteamMongo(Repo):
         created_year: Optional[int] = None,
         created_month: Optional[int] = None,
         sort_query: Optional[bool] = False,
-    ) -> List[GameplayList]:
+        compact: bool = False,
+    ) -> Union[List[GameplayList], List[CompactGameplayList]]:
 
         query_dict = {}
 
@@ -182,30 +673,31 @@ class SteamMongo(Repo):
             query_dict.update({"created_year": created_year})
         if created_month is not None:
             query_dict.update({"created_month": created_month})
-        return self.get_gameplay_from_query(query_dict=query_dict, sort_query=sort_query)
+        return self.get_gameplay_from_query(query_dict=query_dict, sort_query=sort_query, compact=compact)
 
-    def get_gameplay_from_query(self, query_dict: Dict, sort_query: Optional[bool] = False):
-        result_query = self.gameplay.find(query_dict)
-        if sort_query:
-            result_query = result_query.sort("updated_at", DESCENDING)
-        field_names = set(f.name for f in fields(GameplayList))
-        final_result = [
-            GameplayList(**{k: v for k, v in friend_list_item.items() if k in field_names})
-            for friend_list_item in result_query
-        ]
-        gameplay_item_field_names = set(f.name for f in fields(GameplayItem))
-        for gameplay_info in final_result:
-            gameplay_info.gameplay_list = [
-                GameplayItem(**{k: v for k, v in gameplay_item.items() if k in gameplay_item_field_names})
-                for gameplay_item in gameplay_info.gameplay_list
-            ]
+    def get_gameplay_from_query(self, query_dict: Dict, sort_query: Optional[bool] = False, compact: bool = False):
+        decode = decode_compact_gameplay_list if compact else decode_gameplay_list
+        buckets = self.gameplay_buckets(
+            created_year=query_dict.get("created_year"), created_month=query_dict.get("created_month")
+        )
+        final_result = []
+        for bucket in buckets:
+            result_query = bucket.find(query_dict)
+            if sort_query:
+                result_query = result_query.sort("updated_at", DESCENDING)
+            final_result += [decode(gameplay_item) for gameplay_item in result_query]
+        if sort_query and len(buckets) > 1:
+            final_result.sort(key=lambda gameplay_info: gameplay_info.updated_at, reverse=True)
         return final_result
 
     def save_gameplay_info(self, gameplay_info: GameplayList):
-        gameplay_dict = asdict(gameplay_info)
-        for gameplay_item in gameplay_dict["gameplay_list"]:
-            gameplay_item["appid"] = str(gameplay_item["appid"])
-        self.gameplay.insert_one(gameplay_dict)
+        gameplay_dict = encode_gameplay_list(gameplay_info)
+        bucket = self.gameplay_bucket(gameplay_info.created_year, gameplay_info.created_month)
+        if self.gameplay_partitioned and bucket.name not in self._indexed_gameplay_buckets:
+            bucket.create_index([("steamid", ASCENDING)])
+            self._indexed_gameplay_buckets.add(bucket.name)
+        bucket.insert_one(gameplay_dict)
+        self.update_app_players("gameplay_info", [gameplay_dict])
 
     def delete_gameplay_info(
         self, player_id: Optional[str] = None, created_year: Optional[int] = None, created_month: Optional[int] = None
@@ -214,6 +706,18 @@ class SteamMongo(Repo):
             raise DatabaseDeletionError(
                 "At least one of the filter player_id or (created_month and created_year) must be specified to avoid deleting the whole Database."
             )
+        if player_id:
+            self.delete_app_players(
+                "gameplay_info", created_year=created_year, created_month=created_month, player_id_list=[player_id]
+            )
+        else:
+            self.delete_app_players("gameplay_info", created_year=created_year, created_month=created_month)
+        if self.gameplay_partitioned and not player_id:
+            # the whole period is being removed, so the bucket is dropped instead of deleting document by document
+            bucket = self.gameplay_bucket(created_year, created_month)
+            bucket.drop()
+            self._indexed_gameplay_buckets.discard(bucket.name)
+            return
         delete_filter = {}
         if player_id:
             delete_filter["steamid"] = player_id
@@ -221,7 +725,8 @@ class SteamMongo(Repo):
             delete_filter["created_month"] = created_month
         if created_year is not None:
             delete_filter["created_year"] = created_year
-        self.gameplay.delete_many(delete_filter)
+        for bucket in self.gameplay_buckets(created_year=created_year, created_month=created_month):
+            bucket.delete_many(delete_filter)
 
     def delete_gameplay_info_by_id_list(
         self, player_id_list: List[str], created_year: Optional[int] = None, created_month: Optional[int] = None
@@ -235,20 +740,339 @@ class SteamMongo(Repo):
             delete_filter["created_month"] = created_month
         if created_year is not None:
             delete_filter["created_year"] = created_year
-        self.gameplay.delete_many(delete_filter)
+        for bucket in self.gameplay_buckets(created_year=created_year, created_month=created_month):
+            bucket.delete_many(delete_filter)
+        self.delete_app_players(
+            "gameplay_info", created_year=created_year, created_month=created_month, player_id_list=player_id_list
+        )
+
+    def count_gameplay_info(self, created_year: int, created_month: int) -> int:
+        return sum(
+            bucket.count_documents({"created_year": created_year, "created_month": created_month})
+            for bucket in self.gameplay_buckets(created_year=created_year, created_month=created_month)
+        )
+
+    def count_gameplay_delta_info(
+        self, created_year: int, created_month: int, updated_at: Optional[dt.datetime] = None
+    ) -> int:
+        query_dict = {"created_year": created_year, "created_month": created_month}
+        if updated_at is not None:
+            query_dict["updated_at"] = updated_at
+        return self.gameplay_delta.count_documents(query_dict)
+
+    def iter_gameplay_info_batches(
+        self,
+        created_year: int,
+        created_month: int,
+        batch_size: int = 200,
+        min_steamid: Optional[str] = None,
+        max_steamid: Optional[str] = None,
+        compact: bool = False,
+    ) -> Iterator[Union[List[GameplayList], List[CompactGameplayList]]]:
+        """
+        Streams the gameplay snapshots of a period sorted by steamid, in batches of batch_size.
+        The documents are read through a server side cursor, so only one batch is held in memory.
+
+        :param batch_size: number of snapshots fetched per round trip and yielded per batch
+        :type batch_size: int
+        :param min_steamid: optional inclusive lower bound of the steamids read
+        :type min_steamid: str
+        :param max_steamid: optional exclusive upper bound of the steamids read
+        :type max_steamid: str
+        :param compact: yields CompactGameplayList snapshots, several times smaller than the GameplayList ones
+        :type compact: bool
+        """
+        decode = decode_compact_gameplay_list if compact else decode_gameplay_list
+        query_dict = {"created_year": created_year, "created_month": created_month}
+        steamid_range = {}
+        if min_steamid is not None:
+            steamid_range["$gte"] = min_steamid
+        if max_steamid is not None:
+            steamid_range["$lt"] = max_steamid
+        if steamid_range:
+            query_dict["steamid"] = steamid_range
+        for bucket in self.gameplay_buckets(created_year=created_year, created_month=created_month):
+            if not self.gameplay_partitioned:
+                bucket.create_index([("created_year", ASCENDING), ("created_month", ASCENDING), ("steamid", ASCENDING)])
+            cursor = bucket.find(query_dict, batch_size=batch_size).sort("steamid", ASCENDING)
+            batch = []
+            for document in cursor:
+                batch.append(decode(document))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    def get_gameplay_steamid_boundaries(
+        self, created_year: int, created_month: int, shard_count: int
+    ) -> List[Optional[str]]:
+        """
+        Splits the steamids of a period into shard_count contiguous ranges of about the same size.
+        Returns the shard_count + 1 range boundaries, the first and last being None for the open ends.
+        The boundaries are sampled by skipping over the steamid index, so no steamid list is loaded.
+        """
+        query_dict = {"created_year": created_year, "created_month": created_month}
+        bucket_counts = [
+            (bucket.count_documents(query_dict), bucket)
+            for bucket in self.gameplay_buckets(created_year=created_year, created_month=created_month)
+        ]
+        boundaries = [None]
+        if bucket_counts:
+            # the ranges only need to be disjoint, so the largest bucket is enough to sample them
+            document_count, bucket = max(bucket_counts, key=lambda item: item[0])
+            for shard_idx in range(1, shard_count):
+                document = next(
+                    bucket.find(query_dict, {"steamid": 1})
+                    .sort("steamid", ASCENDING)
+                    .skip(shard_idx * document_count // shard_count)
+                    .limit(1),
+                    None,
+                )
+                if document is not None and document["steamid"] != boundaries[-1]:
+                    boundaries.append(document["steamid"])
+        boundaries.append(None)
+        return boundaries
+
+    def gameplay_delta_pipeline(self, created_year: int, created_month: int, current_time: dt.datetime) -> List[Dict]:
+        """
+        Builds the aggregation pipeline that computes the GameplayMonthDeltaList documents of a period.
+        Each snapshot of the informed month is joined with the previous month snapshot of the same steamid,
+        the playtimes are diffed per appid and only the positive deltas are kept, like calculate_gameplay_delta.
+        The diff runs inside the join of each player: the current items and the negated previous ones are
+        unwound and summed per appid with a $group, so it stays linear in the library sizes.
+        """
+        previous_month, previous_year = get_last_month_and_year(current_year=created_year, current_month=created_month)
+        return [
+            {"$match": {"created_year": created_year, "created_month": created_month}},
+            {
+                "$lookup": {
+                    "from": self.gameplay_bucket(previous_year, previous_month).name,
+                    "localField": "steamid",
+                    "foreignField": "steamid",
+                    "let": {"current_list": "$gameplay_list"},
+                    "pipeline": [
+                        {"$match": {"created_year": previous_year, "created_month": previous_month}},
+                        {"$sort": {"updated_at": DESCENDING}},
+                        {"$limit": 1},
+                        {
+                            "$project": {
+                                "_id": 0,
+                                "items": {
+                                    "$concatArrays": [
+                                        {
+                                            "$map": {
+                                                "input": "$$current_list",
+                                                "as": "item",
+                                                "in": {"appid": "$$item.appid", "playtime": "$$item.playtime"},
+                                            }
+                                        },
+                                        {
+                                            "$map": {
+                                                "input": "$gameplay_list",
+                                                "as": "item",
+                                                "in": {
+                                                    "appid": "$$item.appid",
+                                                    "playtime": {"$multiply": ["$$item.playtime", -1]},
+                                                },
+                                            }
+                                        },
+                                    ]
+                                },
+                            }
+                        },
+                        # kept when both lists are empty, so the player still gets an empty delta
+                        {"$unwind": {"path": "$items", "preserveNullAndEmptyArrays": True}},
+                        # apps only in the previous snapshot sum up negative and are dropped with the others
+                        {"$group": {"_id": "$items.appid", "playtime": {"$sum": "$items.playtime"}}},
+                        {"$sort": {"_id": ASCENDING}},
+                    ],
+                    "as": "previous",
+                }
+            },
+            # players without a snapshot in the previous month get no delta
+            {"$match": {"previous": {"$ne": []}}},
+            {
+                "$project": {
+                    "_id": 0,
+                    "steamid": 1,
+                    "gameplay_delta_list": {
+                        "$map": {
+                            "input": {
+                                "$filter": {"input": "$previous", "as": "delta", "cond": {"$gt": ["$$delta.playtime", 0]}}
+                            },
+                            "as": "delta",
+                            "in": {"appid": "$$delta._id", "playtime": "$$delta.playtime"},
+                        }
+                    },
+                }
+            },
+            {
+                "$addFields": {
+                    "total_playtime": {"$sum": "$gameplay_delta_list.playtime"},
+                    "created_year": previous_year,
+                    "created_month": previous_month,
+                    "created_at": current_time,
+                    "updated_at": current_time,
+                    "last_failed_update_attempt": None,
+                }
+            },
+        ]
+
+    def create_gameplay_delta_server_side(
+        self, created_year: int, created_month: int, current_time: Optional[dt.datetime] = None
+    ) -> int:
+        """
+        Computes the gameplay deltas of a period inside the database and merges them into gameplay_delta,
+        without transferring any snapshot. Returns the number of deltas the pipeline had to write, the snapshots
+        of the month with a previous month snapshot, counted apart from the merge so the writes can be verified
+        against it.
+        """
+        server_version = tuple(self.client.server_info()["versionArray"][:2])
+        if server_version < SERVER_DELTA_MIN_VERSION:
+            raise DatabaseUpdateError(
+                f"The server engine needs MongoDB {'.'.join(map(str, SERVER_DELTA_MIN_VERSION))} or later, "
+                f"the server runs {'.'.join(map(str, server_version))}."
+            )
+        current_time = current_time or dt.datetime.now()
+        # $merge needs a unique index on the fields used to match the existing deltas
+        self.gameplay_delta.create_index(
+            [("steamid", ASCENDING), ("created_year", ASCENDING), ("created_month", ASCENDING)], unique=True
+        )
+        pipeline = self.gameplay_delta_pipeline(
+            created_year=created_year, created_month=created_month, current_time=current_time
+        ) + [
+            {
+                "$merge": {
+                    "into": self.gameplay_delta.name,
+                    "on": ["steamid", "created_year", "created_month"],
+                    "whenMatched": "replace",
+                    "whenNotMatched": "insert",
+                }
+            }
+        ]
+        self.gameplay_bucket(created_year, created_month).aggregate(pipeline, allowDiskUse=True)
+        previous_month, previous_year = get_last_month_and_year(current_year=created_year, current_month=created_month)
+        if self.app_players_index:
+            self.rebuild_app_players("gameplay_delta", created_year=previous_year, created_month=previous_month)
+        expected_deltas = self.gameplay_bucket(created_year, created_month).aggregate(
+            [
+                {"$match": {"created_year": created_year, "created_month": created_month}},
+                {
+                    "$lookup": {
+                        "from": self.gameplay_bucket(previous_year, previous_month).name,
+                        "localField": "steamid",
+                        "foreignField": "steamid",
+                        "pipeline": [
+                            {"$match": {"created_year": previous_year, "created_month": previous_month}},
+                            {"$limit": 1},
+                            {"$project": {"_id": 1}},
+                        ],
+                        "as": "previous",
+                    }
+                },
+                {"$match": {"previous": {"$ne": []}}},
+                {"$count": "deltas"},
+            ],
+            allowDiskUse=True,
+        )
+        return next(expected_deltas, {"deltas": 0})["deltas"]
+
+    def apply_gameplay_retention(
+        self, current_year: int, current_month: int, retention_months: int, action: str = "drop"
+    ) -> List[Tuple[int, int]]:
+        """
+        Removes the gameplay snapshots older than the retention window and returns the expired periods.
+        With partitioned storage each expired bucket is dropped or renamed to archive_gameplay_YYYY_MM,
+        which are constant time operations regardless of the number of snapshots in the period.
+
+        :param retention_months: number of periods kept, counting the current one
+        :type retention_months: int
+        :param action: either drop or archive the expired periods
+        :type action: str
+        """
+        if retention_months < 1:
+            raise DatabaseDeletionError("The gameplay retention must keep at least the current month.")
+        if action not in RETENTION_ACTIONS:
+            raise DatabaseDeletionError(f"Invalid retention action {action}.")
+        oldest_kept = current_year * 12 + (current_month - 1) - (retention_months - 1)
+        if self.gameplay_partitioned:
+            expired_periods = [
+                (year, month)
+                for year, month in self.get_gameplay_bucket_periods()
+                if year * 12 + (month - 1) < oldest_kept
+            ]
+        else:
+            expired_periods = [
+                (year, month)
+                for year, month in self.get_created_periods("gameplay_info")
+                if year * 12 + (month - 1) < oldest_kept
+            ]
+        for year, month in expired_periods:
+            logging.info(f"Applying gameplay retention ({action}) to {year}/{month:02d}.")
+            if not self.gameplay_partitioned:
+                if action == "archive":
+                    self.gameplay.aggregate(
+                        [
+                            {"$match": {"created_year": year, "created_month": month}},
+                            {"$merge": {"into": f"{GAMEPLAY_ARCHIVE_PREFIX}_{year:04d}_{month:02d}"}},
+                        ]
+                    )
+                self.gameplay.delete_many({"created_year": year, "created_month": month})
+                self.delete_app_players("gameplay_info", created_year=year, created_month=month)
+            elif action == "archive":
+                bucket = self.gameplay_bucket(year, month)
+                bucket.rename(f"{GAMEPLAY_ARCHIVE_PREFIX}_{year:04d}_{month:02d}")
+                self._indexed_gameplay_buckets.discard(bucket.name)
+                self.delete_app_players("gameplay_info", created_year=year, created_month=month)
+            else:
+                self.delete_gameplay_info(created_year=year, created_month=month)
+        return expired_periods
+
+    def migrate_gameplay_to_buckets(self) -> List[Tuple[int, int]]:
+        """
+        Copies the snapshots of the single gameplay collection into the per period buckets.
+        The copy runs inside the database and is idempotent, the source collection is left untouched.
+        """
+        if not self.gameplay_partitioned:
+            raise DatabaseUpdateError("Gameplay buckets are only available with partitioned gameplay storage.")
+        periods = [
+            (item["_id"]["created_year"], item["_id"]["created_month"])
+            for item in self.gameplay.aggregate(
+                [{"$group": {"_id": {"created_year": "$created_year", "created_month": "$created_month"}}}]
+            )
+        ]
+        for year, month in sorted(periods):
+            bucket = self.gameplay_bucket(year, month)
+            bucket.create_index([("steamid", ASCENDING)])
+            self.gameplay.aggregate(
+                [
+                    {"$match": {"created_year": year, "created_month": month}},
+                    {"$merge": {"into": bucket.name, "whenMatched": "keepExisting"}},
+                ]
+            )
+            logging.info(f"Gameplay snapshots of {year}/{month:02d} copied to {bucket.name}.")
+        return sorted(periods)
 
     # Gameplay Delta
     def get_existing_gameplay_delta_info_id_list(
         self, 
         steam_id_list:List[str],
         created_year: Optional[int] = None, 
-        created_month: Optional[int] = None
+        created_month: Optional[int] = None,
+        updated_at: Optional[dt.datetime] = None
         )-> Union[None, List[str]]:
+        """
+        :param updated_at: only returns the deltas written at this time, like the ones saved by a given run
+        :type updated_at: datetime
+        """
         query_dict = {"steamid": {"$in":steam_id_list}}
         if created_year is not None:
             query_dict.update({"created_year":created_year})
         if created_month is not None:
             query_dict.update({"created_month":created_month})
+        if updated_at is not None:
+            query_dict.update({"updated_at":updated_at})
         result = self.gameplay_delta.aggregate([
             # Match the documents possible
             { "$match": query_dict },
@@ -275,26 +1099,12 @@ class SteamMongo(Repo):
         if created_month is not None:
             query_dict.update({"created_month":created_month})
         result = self.gameplay_delta.find(query_dict)
-        field_names = set(f.name for f in fields(GameplayMonthDeltaList))
-        final_result = [
-            GameplayMonthDeltaList(**{k: v for k, v in gameplay_delta_item.items() if k in field_names})
-            for gameplay_delta_item in result
-        ]
-        gameplay_delta_item_field_names = set(f.name for f in fields(GameplayMonthDeltaItem))
-        for gameplay_delta in final_result:
-            gameplay_delta.gameplay_list = [
-                GameplayMonthDeltaItem(**{k: v for k, v in gameplay_item.items() if k in gameplay_delta_item_field_names})
-                for gameplay_item in gameplay_delta.gameplay_list
-            ]
-        return final_result
+        return [decode_gameplay_delta_list(gameplay_delta_item) for gameplay_delta_item in result]
 
     def save_gameplay_delta_info_list(self, gameplay_delta_info_list: List[GameplayMonthDeltaList])->None:
         if not gameplay_delta_info_list:
             return None
-        gameplay_delta_dict = [asdict(item) for item in gameplay_delta_info_list]
-        for gameplay_delta_list_item in gameplay_delta_dict:
-            for gameplay_delta_item in gameplay_delta_list_item["gameplay_delta_list"]:
-                gameplay_delta_item["appid"] = str(gameplay_delta_item["appid"])
+        gameplay_delta_dict = [encode_gameplay_delta_list(item) for item in gameplay_delta_info_list]
         bulk_write_list = [
             ReplaceOne(
                 {
@@ -310,40 +1120,689 @@ class SteamMongo(Repo):
         if bulk_write_list:
             result = self.gameplay_delta.bulk_write(bulk_write_list)
             logging.debug(result)
+        # the deltas are replaced, so their players are removed from the postings of the period before being added
+        steamids_by_period = defaultdict(list)
+        for gameplay_delta_list_item in gameplay_delta_dict:
+            period = (gameplay_delta_list_item["created_year"], gameplay_delta_list_item["created_month"])
+            steamids_by_period[period].append(gameplay_delta_list_item["steamid"])
+        for (created_year, created_month), steamids in steamids_by_period.items():
+            self.delete_app_players(
+                "gameplay_delta", created_year=created_year, created_month=created_month, player_id_list=steamids
+            )
+        self.update_app_players("gameplay_delta", gameplay_delta_dict)
+
+    def iter_gameplay_delta_batches(
+        self, created_year: int, created_month: int, batch_size: int = 200
+    ) -> Iterator[List[GameplayMonthDeltaList]]:
+        """
+        Streams the gameplay deltas of a period sorted by steamid, in batches of batch_size.
+        """
+        cursor = self.gameplay_delta.find(
+            {"created_year": created_year, "created_month": created_month}, batch_size=batch_size
+        ).sort("steamid", ASCENDING)
+        batch = []
+        for document in cursor:
+            batch.append(decode_gameplay_delta_list(document))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    # App Players
+
+    def _index_app_players(self) -> None:
+        if self._app_players_indexed:
+            return
+        if APP_PLAYERS_LEGACY_INDEX in self.app_players.index_information():
+            self.app_players.drop_index(APP_PLAYERS_LEGACY_INDEX)
+        self.app_players.create_index(
+            APP_PLAYERS_PERIOD_KEYS + [("appid", ASCENDING), ("steamid", ASCENDING)], unique=True
+        )
+        self.app_players.create_index(APP_PLAYERS_PERIOD_KEYS + [("steamid", ASCENDING)])
+        self._app_players_indexed = True
+
+    def update_app_players(self, source: str, documents: List[Dict]) -> None:
+        """
+        Adds the players of the encoded gameplay or delta documents to the app_players rows, when the index is
+        enabled.
+        """
+        if not self.app_players_index:
+            return None
+        operations = app_players_updates(source, documents)
+        if not operations:
+            return None
+        self._index_app_players()
+        result = self.app_players.bulk_write(operations, ordered=False)
+        logging.debug(result)
+
+    def delete_app_players(
+        self,
+        source: str,
+        created_year: Optional[int] = None,
+        created_month: Optional[int] = None,
+        player_id_list: Optional[List[str]] = None,
+    ) -> None:
+        """
+        Removes the rows of players from a source, or every row of the period when no player is informed, when the
+        index is enabled.
+        """
+        if not self.app_players_index:
+            return None
+        query_dict = {"source": source}
+        if created_year is not None:
+            query_dict["created_year"] = created_year
+        if created_month is not None:
+            query_dict["created_month"] = created_month
+        if player_id_list is not None:
+            query_dict["steamid"] = {"$in": player_id_list}
+        self.app_players.delete_many(query_dict)
+
+    def rebuild_app_players(self, source: str, created_year: int, created_month: int) -> int:
+        """
+        Recreates the rows of a period from the stored documents, for data written outside of the save methods
+        such as server side deltas, or before the index was enabled. The rows are streamed from the aggregation
+        and upserted in batches, so no posting of a popular app is ever held in a single document.
+        Returns the number of appids indexed.
+        """
+        list_field = APP_PLAYERS_LIST_FIELDS[source]
+        pipeline = [
+            {"$match": {"created_year": created_year, "created_month": created_month}},
+            {"$unwind": f"${list_field}"},
+            {"$match": {f"{list_field}.playtime": {"$gt": 0}}},
+            {"$project": {"_id": 0, "appid": {"$toString": f"${list_field}.appid"}, "steamid": 1}},
+        ]
+        self._index_app_players()
+        self.app_players.delete_many({"source": source, "created_year": created_year, "created_month": created_month})
+        appids = set()
+        operations = []
+        for collection in self.get_collections(source, created_year=created_year, created_month=created_month):
+            for document in collection.aggregate(pipeline, allowDiskUse=True):
+                row = {
+                    "source": source,
+                    "created_year": created_year,
+                    "created_month": created_month,
+                    "appid": document["appid"],
+                    "steamid": document["steamid"],
+                }
+                operations.append(ReplaceOne(row, row, upsert=True))
+                appids.add(document["appid"])
+                if len(operations) >= APP_PLAYERS_WRITE_BATCH_SIZE:
+                    self.app_players.bulk_write(operations, ordered=False)
+                    operations = []
+        if operations:
+            self.app_players.bulk_write(operations, ordered=False)
+        return len(appids)
+
+    def get_app_players(
+        self, appid_list: List[str], created_year: int, created_month: int, source: str = "gameplay_info"
+    ) -> Dict[str, List[str]]:
+        """
+        Returns the players with playtime in each of the informed apps for a period.
+        """
+        result = self.app_players.find(
+            {
+                "source": source,
+                "created_year": created_year,
+                "created_month": created_month,
+                "appid": {"$in": [str(appid) for appid in appid_list]},
+            },
+            {"_id": 0, "appid": 1, "steamid": 1},
+        )
+        app_players = {}
+        for row in result:
+            app_players.setdefault(row["appid"], []).append(row["steamid"])
+        return {appid: sorted(steamids) for appid, steamids in app_players.items()}
+
+    # Player Rollups
+
+    def get_player_rollup_list(
+        self, player_id_list: List[str], created_year: Optional[int] = None, created_month: Optional[int] = None
+    ) -> List[PlayerMonthRollup]:
+        query_dict = {"steamid": {"$in": player_id_list}}
+        if created_year is not None:
+            query_dict["created_year"] = created_year
+        if created_month is not None:
+            query_dict["created_month"] = created_month
+        result = self.player_rollups.find(query_dict).sort(
+            [("created_year", ASCENDING), ("created_month", ASCENDING)]
+        )
+        return [decode_player_rollup(document) for document in result]
+
+    def save_player_rollup_list(self, player_rollup_list: List[PlayerMonthRollup]) -> None:
+        if not player_rollup_list:
+            return None
+        if not self._player_rollups_indexed:
+            self.player_rollups.create_index(
+                [("steamid", ASCENDING), ("created_year", ASCENDING), ("created_month", ASCENDING)], unique=True
+            )
+            self._player_rollups_indexed = True
+        bulk_write_list = [
+            ReplaceOne(
+                {
+                    "steamid": player_rollup.steamid,
+                    "created_year": player_rollup.created_year,
+                    "created_month": player_rollup.created_month,
+                },
+                asdict(player_rollup),
+                upsert=True,
+            )
+            for player_rollup in player_rollup_list
+        ]
+        result = self.player_rollups.bulk_write(bulk_write_list)
+        logging.debug(result)
 
     # Game Info
 
     def get_game_info_by_game_id_list(self, game_id_list: List[str])->List[SteamGameinfo]:
         result_query = self.game_info.find({"appid": {"$in":game_id_list}})
-        field_names = set(f.name for f in fields(SteamGameinfo))
-        final_result = [SteamGameinfo(
-            **{k:v for k,v in gameinfo.items() if k in field_names}) 
-            for gameinfo in list(result_query)]
-
-        return final_result
+        return [decode_game_info(gameinfo) for gameinfo in result_query]
 
     def save_game_info_list(self, game_info_list: List[SteamGameinfo]):
         if len(game_info_list)>0:
-            transformed_list = [asdict(gameinfo) for gameinfo in game_info_list]
-            for item in transformed_list:
-                item["appid"] = str(item["appid"])
+            transformed_list = [encode_game_info(gameinfo) for gameinfo in game_info_list]
             bulk_write_list = [ReplaceOne({"appid":gameinfo["appid"]},gameinfo, upsert=True) for gameinfo in transformed_list]
             result = self.game_info.bulk_write(bulk_write_list)
             logging.debug(result)
 
+    # Job Markers
+
+    def get_job_marker(self, job_id: str) -> Optional[Dict]:
+        return self.job_markers.find_one({"job_id": job_id}, {"_id": 0})
+
+    def start_job_marker(self, job_id: str, plan: Dict) -> Dict:
+        """
+        Creates the marker of a resumable job, or returns the existing one so a rerun keeps the original plan.
+
+        :param plan: job specific values fixed on the first run, like the shard boundaries
+        :type plan: Dict
+        """
+        current_time = dt.datetime.now()
+        self.job_markers.update_one(
+            {"job_id": job_id},
+            {
+                "$setOnInsert": {"job_id": job_id, "plan": plan, "completed": [], "created_at": current_time},
+                "$set": {"updated_at": current_time},
+            },
+            upsert=True,
+        )
+        return self.get_job_marker(job_id)
+
+    def complete_job_step(self, job_id: str, step: str) -> None:
+        self.job_markers.update_one(
+            {"job_id": job_id}, {"$addToSet": {"completed": step}, "$set": {"updated_at": dt.datetime.now()}}
+        )
+
+    def save_job_progress(self, job_id: str, key: str, value) -> None:
+        self.job_markers.update_one(
+            {"job_id": job_id}, {"$set": {f"progress.{key}": value, "updated_at": dt.datetime.now()}}
+        )
+
+    def reset_job_steps(self, job_id: str, steps: List[str]) -> None:
+        self.job_markers.update_one(
+            {"job_id": job_id}, {"$pull": {"completed": {"$in": steps}}, "$set": {"updated_at": dt.datetime.now()}}
+        )
+
+    def delete_job_marker(self, job_id: str) -> None:
+        self.job_markers.delete_one({"job_id": job_id})
+
+    # Work Queue
+
+    def _index_work_queue(self) -> None:
+        if not self._work_queue_indexed:
+            self.work_queue.create_index([("status", ASCENDING), ("kind", ASCENDING), ("available_at", ASCENDING)])
+            self.work_queue.create_index([("lease_id", ASCENDING)])
+            self._work_queue_indexed = True
+
+    def enqueue_work_items(
+        self,
+        kind: str,
+        keys: List[str],
+        payload: Optional[Dict] = None,
+        available_at: Optional[dt.datetime] = None,
+        requeue_completed_before: Optional[dt.datetime] = None,
+    ) -> int:
+        """
+        Adds the items of a kind to the work queue, returning the number of items added or requeued.
+        Enqueueing is idempotent, items already queued or leased are left untouched, so several nodes can
+        enqueue the same players.
+
+        :param requeue_completed_before: moves the items done before this time back to pending, to refresh
+            them in a new period, keeping their payload unless a new one is informed
+        :type requeue_completed_before: dt.datetime
+        """
+        if not keys:
+            return 0
+        self._index_work_queue()
+        current_time = dt.datetime.now()
+        available_at = available_at or current_time
+        unique_keys = list(dict.fromkeys(keys))
+        result = self.work_queue.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": work_item_id(kind, key)},
+                    {
+                        "$setOnInsert": {
+                            "kind": kind,
+                            "key": key,
+                            "status": WORK_PENDING,
+                            "available_at": available_at,
+                            "attempts": 0,
+                            "payload": payload or {},
+                            "created_at": current_time,
+                            "updated_at": current_time,
+                        }
+                    },
+                    upsert=True,
+                )
+                for key in unique_keys
+            ],
+            ordered=False,
+        )
+        added = result.upserted_count
+        if requeue_completed_before is not None:
+            requeue_values = {
+                "status": WORK_PENDING,
+                "available_at": available_at,
+                "attempts": 0,
+                "updated_at": current_time,
+            }
+            if payload is not None:
+                requeue_values["payload"] = payload
+            added += self.work_queue.update_many(
+                {
+                    "_id": {"$in": [work_item_id(kind, key) for key in unique_keys]},
+                    "status": WORK_DONE,
+                    "completed_at": {"$lt": requeue_completed_before},
+                },
+                {"$set": requeue_values},
+            ).modified_count
+        return added
+
+    def expire_work_leases(self, max_attempts: int) -> int:
+        """
+        Dead letters the leased items whose lease expired after their last attempt, returning their number.
+        The other expired leases are claimed again like pending items.
+        """
+        current_time = dt.datetime.now()
+        return self.work_queue.update_many(
+            {"status": WORK_LEASED, "lease_expires_at": {"$lt": current_time}, "attempts": {"$gte": max_attempts}},
+            {
+                "$set": {
+                    "status": WORK_DEAD,
+                    "last_error": "Lease expired on the last attempt.",
+                    "lease_id": None,
+                    "lease_owner": None,
+                    "lease_expires_at": None,
+                    "updated_at": current_time,
+                }
+            },
+        ).modified_count
+
+    def claim_work_items(
+        self,
+        worker_id: str,
+        kinds: Optional[List[str]] = None,
+        limit: int = 1,
+        lease_seconds: float = 300,
+        max_attempts: int = 5,
+        claim_id: Optional[str] = None,
+    ) -> List[WorkItem]:
+        """
+        Leases up to limit available items of a single kind to the worker, the longest waiting first.
+        Items are available when pending and due, or when their lease expired without being completed.
+
+        Claims are idempotent: retrying a claim with the same claim_id returns the items it already leased,
+        with their lease extended, instead of leasing new ones.
+
+        :param kinds: kinds the worker can process, all of them by default
+        :type kinds: List[str]
+        :param claim_id: id of the claim, used as the lease id of its items, a new one by default
+        :type claim_id: str
+        """
+        self._index_work_queue()
+        claim_id = claim_id or uuid.uuid4().hex
+        current_time = dt.datetime.now()
+        lease_expires_at = current_time + dt.timedelta(seconds=lease_seconds)
+        claimed_query = {"lease_id": claim_id, "lease_owner": worker_id, "status": WORK_LEASED}
+        if self.work_queue.count_documents(claimed_query, limit=1):
+            self.work_queue.update_many(
+                claimed_query, {"$set": {"lease_expires_at": lease_expires_at, "updated_at": current_time}}
+            )
+            return [decode_work_item(document) for document in self.work_queue.find(claimed_query)]
+
+        self.expire_work_leases(max_attempts=max_attempts)
+        query_dict = {
+            "$or": [
+                {"status": WORK_PENDING, "available_at": {"$lte": current_time}},
+                {"status": WORK_LEASED, "lease_expires_at": {"$lt": current_time}},
+            ],
+            "attempts": {"$lt": max_attempts},
+        }
+        if kinds:
+            query_dict["kind"] = {"$in": kinds}
+        claimed_items = []
+        while len(claimed_items) < limit:
+            document = self.work_queue.find_one_and_update(
+                query_dict,
+                {
+                    "$set": {
+                        "status": WORK_LEASED,
+                        "lease_id": claim_id,
+                        "lease_owner": worker_id,
+                        "lease_expires_at": lease_expires_at,
+                        "updated_at": current_time,
+                    },
+                    "$inc": {"attempts": 1},
+                },
+                sort=[("available_at", ASCENDING)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if document is None:
+                break
+            claimed_items.append(decode_work_item(document))
+            # the rest of the claim is processed in the same batch, so it takes the same kind
+            query_dict["kind"] = document["kind"]
+        return claimed_items
+
+    def heartbeat_work_items(self, work_items: List[WorkItem], lease_seconds: float = 300) -> List[str]:
+        """
+        Extends the leases of the items still held by their claim, returning the ids of the items whose
+        lease was lost to another worker after expiring.
+        """
+        current_time = dt.datetime.now()
+        lost_item_ids = []
+        for work_item in work_items:
+            result = self.work_queue.update_one(
+                {"_id": work_item.item_id, "lease_id": work_item.lease_id, "status": WORK_LEASED},
+                {
+                    "$set": {
+                        "lease_expires_at": current_time + dt.timedelta(seconds=lease_seconds),
+                        "updated_at": current_time,
+                    }
+                },
+            )
+            if not result.matched_count:
+                lost_item_ids.append(work_item.item_id)
+        return lost_item_ids
+
+    def complete_work_item(self, work_item: WorkItem) -> bool:
+        """
+        Marks an item as done. Completion is idempotent: completing it again with the same lease succeeds,
+        while a worker whose lease was taken over gets False and its result should be discarded.
+        """
+        current_time = dt.datetime.now()
+        result = self.work_queue.update_one(
+            {"_id": work_item.item_id, "lease_id": work_item.lease_id, "status": WORK_LEASED},
+            {
+                "$set": {
+                    "status": WORK_DONE,
+                    "completed_at": current_time,
+                    "lease_expires_at": None,
+                    "last_error": None,
+                    "updated_at": current_time,
+                }
+            },
+        )
+        if result.matched_count:
+            return True
+        return bool(
+            self.work_queue.count_documents(
+                {"_id": work_item.item_id, "lease_id": work_item.lease_id, "status": WORK_DONE}, limit=1
+            )
+        )
+
+    def fail_work_item(
+        self, work_item: WorkItem, error: str, retry_delay_seconds: float = 60, max_attempts: int = 5
+    ) -> Optional[str]:
+        """
+        Releases a failed item, back to pending after retry_delay_seconds, doubled on every attempt, or to
+        the dead letters once it used max_attempts. Returns the new status, None when the lease was lost.
+        """
+        current_time = dt.datetime.now()
+        status = WORK_DEAD if work_item.attempts >= max_attempts else WORK_PENDING
+        result = self.work_queue.update_one(
+            {"_id": work_item.item_id, "lease_id": work_item.lease_id, "status": WORK_LEASED},
+            {
+                "$set": {
+                    "status": status,
+                    "available_at": current_time
+                    + dt.timedelta(seconds=retry_delay_seconds * 2 ** max(work_item.attempts - 1, 0)),
+                    "last_error": error,
+                    "lease_id": None,
+                    "lease_owner": None,
+                    "lease_expires_at": None,
+                    "updated_at": current_time,
+                }
+            },
+        )
+        return status if result.matched_count else None
+
+    def count_work_items(self) -> Dict[str, Dict[str, int]]:
+        """
+        Counts the work queue items by kind and status.
+        """
+        counts = defaultdict(lambda: {status: 0 for status in WORK_STATUSES})
+        for document in self.work_queue.aggregate(
+            [{"$group": {"_id": {"kind": "$kind", "status": "$status"}, "count": {"$sum": 1}}}]
+        ):
+            counts[document["_id"]["kind"]][document["_id"]["status"]] = document["count"]
+        return dict(counts)
+
+    def get_dead_work_items(self, kind: Optional[str] = None, limit: int = 100) -> List[WorkItem]:
+        query_dict = {"status": WORK_DEAD}
+        if kind is not None:
+            query_dict["kind"] = kind
+        return [
+            decode_work_item(document)
+            for document in self.work_queue.find(query_dict).sort("updated_at", DESCENDING).limit(limit)
+        ]
+
+    def requeue_dead_work_items(self, kind: Optional[str] = None) -> int:
+        """
+        Moves the dead letters back to pending with their attempts reset, returning their number.
+        """
+        query_dict = {"status": WORK_DEAD}
+        if kind is not None:
+            query_dict["kind"] = kind
+        current_time = dt.datetime.now()
+        return self.work_queue.update_many(
+            query_dict,
+            {"$set": {"status": WORK_PENDING, "attempts": 0, "available_at": current_time, "updated_at": current_time}},
+        ).modified_count
+
     # Shared
-    def batch_update_type(self, doc_type: str, query: Dict, new_value: Dict):
+    def get_collection(self, doc_type: str):
         type_dict = {
             "gameplay_delta": self.gameplay_delta,
             "gameplay_info": self.gameplay,
             "steam_profile": self.steam_profiles,
             "friend_list": self.friend_lists,
+            "friend_list_history": self.friend_list_snapshots,
             "game_info": self.game_info,
+            "player_rollup": self.player_rollups,
+            "app_players": self.app_players,
         }
         db_collection = type_dict.get(doc_type)
         if db_collection is None:
             raise DatabaseUpdateError("Invalid Document type.")
-        query = json.loads(query)
-        new_value = json.loads(new_value)
-        update_query = {"$set": new_value}
-        db_collection.update_many(query, update_query)
+        return db_collection
+
+    def get_collections(
+        self, doc_type: str, created_year: Optional[int] = None, created_month: Optional[int] = None
+    ) -> List:
+        """
+        Returns every collection that may hold documents of a type for the informed period filter.
+        """
+        if doc_type == "gameplay_info":
+            return self.gameplay_buckets(created_year=created_year, created_month=created_month)
+        return [self.get_collection(doc_type)]
+
+    def get_created_periods(self, doc_type: str) -> List[Tuple[int, int]]:
+        """
+        Lists the distinct (created_year, created_month) pairs stored for a document type.
+
+        :param doc_type: one of the document types accepted by get_collection
+        :type doc_type: str
+        """
+        if doc_type == "gameplay_info" and self.gameplay_partitioned:
+            return self.get_gameplay_bucket_periods()
+        result = self.get_collection(doc_type).aggregate(
+            [
+                {"$group": {"_id": {"created_year": "$created_year", "created_month": "$created_month"}}},
+                {"$sort": {"_id.created_year": ASCENDING, "_id.created_month": ASCENDING}},
+            ]
+        )
+        return [
+            (item["_id"]["created_year"], item["_id"]["created_month"])
+            for item in result
+            if item["_id"].get("created_year") is not None
+        ]
+
+    def iter_documents(
+        self, doc_type: str, query: Optional[Dict] = None, batch_size: int = 1000
+    ) -> Iterator[List[Dict]]:
+        """
+        Streams the raw documents of a type in batches, without building the dataclass models.
+
+        :param doc_type: one of the document types accepted by get_collection
+        :type doc_type: str
+        :param query: optional filter applied to the collection
+        :type query: Dict
+        :param batch_size: number of documents fetched per round trip and yielded per batch
+        :type batch_size: int
+        """
+        query = query or {}
+        batch = []
+        for collection in self.get_collections(
+            doc_type, created_year=query.get("created_year"), created_month=query.get("created_month")
+        ):
+            for document in collection.find(query, {"_id": 0}, batch_size=batch_size):
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def get_documents_watermark(self, doc_type: str, query: Optional[Dict] = None) -> Dict:
+        """
+        Returns the number of documents of a type matching query and their latest updated_at, which change
+        whenever a document is added or overwritten, so exports can tell if a partition is stale.
+
+        :param doc_type: one of the document types accepted by get_collection
+        :type doc_type: str
+        :param query: optional filter applied to the collection
+        :type query: Dict
+        """
+        query = query or {}
+        documents = 0
+        updated_at = None
+        for collection in self.get_collections(
+            doc_type, created_year=query.get("created_year"), created_month=query.get("created_month")
+        ):
+            documents += collection.count_documents(query)
+            latest = collection.find(query, {"_id": 0, "updated_at": 1}).sort("updated_at", DESCENDING).limit(1)
+            for document in latest:
+                if document.get("updated_at") is not None and (updated_at is None or document["updated_at"] > updated_at):
+                    updated_at = document["updated_at"]
+        return {"documents": documents, "updated_at": to_epoch(updated_at)}
+
+    def batch_update_type(
+        self,
+        doc_type: str,
+        query: Dict,
+        new_value: Dict,
+        batch_size: Optional[int] = None,
+        max_docs_per_second: Optional[float] = None,
+        dry_run: bool = False,
+    ) -> Dict:
+        """
+        Sets new_value on the documents of a type matching query, both informed as JSON strings.
+
+        Without batch_size a single update_many runs per collection. With it, the matching documents are
+        walked in _id order and updated batch_size at a time, optionally throttled to max_docs_per_second,
+        so the update never holds the collection for long. The last updated _id of each collection is kept
+        in a job marker, so an interrupted chunked update resumes where it stopped.
+
+        :param dry_run: only counts the matching documents and estimates the cost of the update
+        :type dry_run: bool
+        :return: the matched and modified counts, plus the estimates on a dry run
+        :rtype: Dict
+        """
+        db_collections = self.get_collections(doc_type)
+        query_dict = json.loads(query)
+        update_query = {"$set": json.loads(new_value)}
+        if dry_run:
+            return self.estimate_batch_update(db_collections, query_dict, batch_size, max_docs_per_second)
+        if batch_size is None:
+            summary = {"matched": 0, "modified": 0}
+            for db_collection in db_collections:
+                result = db_collection.update_many(query_dict, update_query)
+                summary["matched"] += result.matched_count
+                summary["modified"] += result.modified_count
+            return summary
+
+        # the job id depends on the update itself, so only the same update resumes from the marker
+        job_id = f"batch_update_{doc_type}_{hashlib.sha1((query + new_value).encode()).hexdigest()[:12]}"
+        marker = self.start_job_marker(job_id, plan={"doc_type": doc_type, "query": query, "new_value": new_value})
+        summary = {"matched": 0, "modified": 0, "batches": 0}
+        for db_collection in db_collections:
+            if db_collection.name in marker["completed"]:
+                continue
+            last_id = marker.get("progress", {}).get(db_collection.name)
+            start_time = time.monotonic()
+            collection_documents = 0
+            while True:
+                batch_query = dict(query_dict)
+                if last_id is not None:
+                    batch_query = {"$and": [query_dict, {"_id": {"$gt": last_id}}]}
+                id_list = [
+                    document["_id"]
+                    for document in db_collection.find(batch_query, {"_id": 1}).sort("_id", ASCENDING).limit(batch_size)
+                ]
+                if not id_list:
+                    break
+                result = db_collection.update_many({"$and": [query_dict, {"_id": {"$in": id_list}}]}, update_query)
+                summary["matched"] += result.matched_count
+                summary["modified"] += result.modified_count
+                summary["batches"] += 1
+                last_id = id_list[-1]
+                self.save_job_progress(job_id, db_collection.name, last_id)
+                collection_documents += len(id_list)
+                if max_docs_per_second:
+                    # sleeps until the documents updated so far fit in the rate cap
+                    expected_time = collection_documents / max_docs_per_second
+                    time.sleep(max(0.0, expected_time - (time.monotonic() - start_time)))
+            self.complete_job_step(job_id, db_collection.name)
+        self.delete_job_marker(job_id)
+        return summary
+
+    def estimate_batch_update(
+        self,
+        db_collections: List,
+        query_dict: Dict,
+        batch_size: Optional[int] = None,
+        max_docs_per_second: Optional[float] = None,
+    ) -> Dict:
+        """
+        Counts the documents an update would touch, with the number of batches, the bytes rewritten
+        estimated from the collections average document size and the duration under the rate cap.
+        """
+        matched = 0
+        estimated_bytes = 0
+        for db_collection in db_collections:
+            collection_matched = db_collection.count_documents(query_dict)
+            matched += collection_matched
+            try:
+                average_size = self.steam_db.command("collStats", db_collection.name).get("avgObjSize", 0)
+            except Exception as e:
+                logging.debug(f"Could not read the stats of {db_collection.name}: {e}")
+                average_size = 0
+            estimated_bytes += int(collection_matched * average_size)
+        return {
+            "matched": matched,
+            "batches": -(-matched // batch_size) if batch_size else (1 if matched else 0),
+            "estimated_bytes": estimated_bytes,
+            "estimated_seconds": matched / max_docs_per_second if max_docs_per_second else None,
+        }
@@ -1,8 +1,17 @@
+import datetime as dt
 from typing import List, Optional, Dict, Union
 
 from abc import ABC, abstractmethod
 
-from models import SteamProfile, SteamFriendList, SteamGameinfo, GameplayList, GameplayMonthDeltaList
+from models import (
+    SteamProfile,
+    SteamFriendList,
+    SteamGameinfo,
+    GameplayList,
+    GameplayMonthDeltaList,
+    PlayerMonthRollup,
+    CompactGameplayList,
+)
 
 
 class Repo(ABC):
@@ -64,7 +73,8 @@ class Repo(ABC):
         created_year: Optional[int] = None,
         created_month: Optional[int] = None,
         sort_query: Optional[bool] = False,
-    ) -> List[GameplayList]:
+        compact: bool = False,
+    ) -> Union[List[GameplayList], List[CompactGameplayList]]:
         pass
 
     @abstractmethod
@@ -89,7 +99,8 @@ class Repo(ABC):
         self, 
         steam_id_list:List[str],
         created_year: Optional[int] = None, 
-        created_month: Optional[int] = None
+        created_month: Optional[int] = None,
+        updated_at: Optional[dt.datetime] = None
         )-> Union[None, List[str]]:
         pass
 
@@ -107,6 +118,20 @@ class Repo(ABC):
         pass
 
 
+    # Player Rollups
+    @abstractmethod
+    def get_player_rollup_list(
+        self,
+        player_id_list: List[str],
+        created_year: Optional[int] = None,
+        created_month: Optional[int] = None
+        ) -> List[PlayerMonthRollup]:
+        pass
+
+    @abstractmethod
+    def save_player_rollup_list(self, player_rollup_list: List[PlayerMonthRollup]):
+        pass
+
     # Game Info
     @abstractmethod
     def get_game_info_by_game_id_list(self, game_id_list: List[str]):
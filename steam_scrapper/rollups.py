@@ -0,0 +1,133 @@
+import datetime as dt
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from repos.repo import Repo
+from models import GameplayMonthDeltaList, PlayerMonthRollup, RollupItem, SteamGameinfo
+
+TOP_GAMES_COUNT = 10
+ROLLUP_BATCH_SIZE = 200
+
+
+def build_rollup_items(
+    playtime_by_key: Dict[str, int], games_by_key: Dict[str, int], names: Optional[Dict[str, str]] = None
+) -> List[RollupItem]:
+    """
+    Turns the aggregated playtime and game counts into RollupItems sorted by playtime, largest first.
+    """
+    names = names or {}
+    return [
+        RollupItem(key=key, playtime=playtime, games_count=games_by_key[key], name=names.get(key))
+        for key, playtime in sorted(playtime_by_key.items(), key=lambda item: (-item[1], item[0]))
+    ]
+
+
+def build_player_rollup(
+    gameplay_delta: GameplayMonthDeltaList,
+    game_info_dict: Dict[str, SteamGameinfo],
+    top_games_count: int = TOP_GAMES_COUNT,
+    current_time: Optional[dt.datetime] = None,
+) -> PlayerMonthRollup:
+    """
+    Aggregates the monthly playtime of a player by genre, developer and publisher, with the top games played.
+    A game counts its whole playtime in each of its genres, developers and publishers.
+
+    :param gameplay_delta: the player delta of the month being rolled up
+    :type gameplay_delta: GameplayMonthDeltaList
+    :param game_info_dict: the game info of the played games by appid, missing games are only counted
+    :type game_info_dict: Dict[str, SteamGameinfo]
+    """
+    current_time = current_time or dt.datetime.now()
+    playtime_by_game = defaultdict(int)
+    for gameplay_item in gameplay_delta.gameplay_delta_list:
+        playtime_by_game[str(gameplay_item.appid)] += gameplay_item.playtime
+
+    playtime_by_attribute = {"genres": defaultdict(int), "developers": defaultdict(int), "publishers": defaultdict(int)}
+    games_by_attribute = {"genres": defaultdict(int), "developers": defaultdict(int), "publishers": defaultdict(int)}
+    missing_game_info_count = 0
+    for appid, playtime in playtime_by_game.items():
+        game_info = game_info_dict.get(appid)
+        if game_info is None:
+            missing_game_info_count += 1
+            continue
+        for attribute in playtime_by_attribute:
+            for key in set(getattr(game_info, attribute) or []):
+                playtime_by_attribute[attribute][key] += playtime
+                games_by_attribute[attribute][key] += 1
+
+    top_games = build_rollup_items(
+        playtime_by_game,
+        {appid: 1 for appid in playtime_by_game},
+        names={appid: game_info.name for appid, game_info in game_info_dict.items() if appid in playtime_by_game},
+    )[:top_games_count]
+    return PlayerMonthRollup(
+        steamid=gameplay_delta.steamid,
+        created_year=gameplay_delta.created_year,
+        created_month=gameplay_delta.created_month,
+        total_playtime=sum(playtime_by_game.values()),
+        games_count=len(playtime_by_game),
+        genres=build_rollup_items(playtime_by_attribute["genres"], games_by_attribute["genres"]),
+        developers=build_rollup_items(playtime_by_attribute["developers"], games_by_attribute["developers"]),
+        publishers=build_rollup_items(playtime_by_attribute["publishers"], games_by_attribute["publishers"]),
+        top_games=top_games,
+        missing_game_info_count=missing_game_info_count,
+        created_at=current_time,
+        updated_at=current_time,
+    )
+
+
+def create_player_rollups(
+    repo: Repo,
+    gameplay_delta_list: List[GameplayMonthDeltaList],
+    game_info_dict: Optional[Dict[str, SteamGameinfo]] = None,
+    top_games_count: int = TOP_GAMES_COUNT,
+    current_time: Optional[dt.datetime] = None,
+) -> List[PlayerMonthRollup]:
+    """
+    Builds and saves the rollups of the informed deltas, replacing the previous rollup of each player month.
+    Only the game info missing from game_info_dict is loaded, and it is added to the dict, so callers
+    rolling up several batches load each game once.
+
+    :param game_info_dict: game info already loaded by appid, updated in place
+    :type game_info_dict: Dict[str, SteamGameinfo]
+    """
+    if not gameplay_delta_list:
+        return []
+    game_info_dict = game_info_dict if game_info_dict is not None else {}
+    missing_appids = {
+        str(gameplay_item.appid)
+        for gameplay_delta in gameplay_delta_list
+        for gameplay_item in gameplay_delta.gameplay_delta_list
+        if str(gameplay_item.appid) not in game_info_dict
+    }
+    if missing_appids:
+        for game_info in repo.get_game_info_by_game_id_list(game_id_list=list(missing_appids)):
+            game_info_dict[str(game_info.appid)] = game_info
+    player_rollup_list = [
+        build_player_rollup(
+            gameplay_delta, game_info_dict, top_games_count=top_games_count, current_time=current_time
+        )
+        for gameplay_delta in gameplay_delta_list
+    ]
+    repo.save_player_rollup_list(player_rollup_list)
+    return player_rollup_list
+
+
+def create_month_rollups(
+    repo, created_year: int, created_month: int, batch_size: int = ROLLUP_BATCH_SIZE
+) -> int:
+    """
+    Rebuilds the rollups of every player with a gameplay delta in the informed period, returning how many were saved.
+    """
+    current_time = dt.datetime.now()
+    game_info_dict = {}
+    saved_rollups = 0
+    for gameplay_delta_list in repo.iter_gameplay_delta_batches(
+        created_year=created_year, created_month=created_month, batch_size=batch_size
+    ):
+        saved_rollups += len(
+            create_player_rollups(repo, gameplay_delta_list, game_info_dict=game_info_dict, current_time=current_time)
+        )
+    logging.info(f"Player rollups for {created_year}/{created_month:02d}: {saved_rollups} saved.")
+    return saved_rollups
@@ -0,0 +1,394 @@
+import click
+import datetime as dt
+import heapq
+import itertools
+import logging
+import signal
+import sys
+import threading
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import config
+from metrics import metrics, InstrumentedRepo
+from refresh_policy import REFRESH_POLICIES
+from utils import get_next_month_and_year
+
+FREQUENCIES = ["month", "year"]
+PLAYER = "player"
+FRIEND_LIST = "friend_list"
+GAMEPLAY = "gameplay"
+GAME_INFO = "game_info"
+GAME_INFO_BATCH_SIZE = 500
+# GetPlayerSummaries takes up to 100 steamids per call
+PLAYER_BATCH_SIZE = 100
+# kinds refreshed together when due at the same time, with their largest batch
+BATCH_SIZES = {PLAYER: PLAYER_BATCH_SIZE, GAME_INFO: GAME_INFO_BATCH_SIZE}
+RETRY_DELAY_SECONDS = 15 * 60
+# longest wait of the loop, so a clock change or a stop signal is noticed even with an idle queue
+MAX_WAIT_SECONDS = 60
+METRICS_INTERVAL_SECONDS = 60
+
+metrics.describe("scheduler_refresh_duration_seconds", "Duration of the scheduler refreshes by item kind.")
+metrics.describe("scheduler_refresh_duration_errors_total", "Scheduler refreshes that raised, retried later.")
+metrics.describe("scheduler_queue_items", "Items scheduled by the scheduler.")
+metrics.describe("scheduler_overdue_seconds", "Delay of the oldest due item of the scheduler queue.")
+
+ItemKey = Tuple[str, str]
+
+
+def period_start(current_time: dt.datetime, frequency: str) -> dt.datetime:
+    if frequency == "year":
+        return dt.datetime(current_time.year, 1, 1)
+    return dt.datetime(current_time.year, current_time.month, 1)
+
+
+def next_period_start(current_time: dt.datetime, frequency: str) -> dt.datetime:
+    if frequency == "year":
+        return dt.datetime(current_time.year + 1, 1, 1)
+    next_month, next_year = get_next_month_and_year(current_year=current_time.year, current_month=current_time.month)
+    return dt.datetime(next_year, next_month, 1)
+
+
+def period_offset(kind: str, key: str) -> float:
+    """
+    Stable position of an item in a period, between 0 and 1. The items are spread evenly over the period
+    and keep their position from one period, and one daemon restart, to the next.
+    """
+    return zlib.crc32(f"{kind}:{key}".encode()) / 2**32
+
+
+class DueQueue:
+    """
+    Priority queue of items by due time, holding each (kind, key) item once.
+
+    Rescheduling an item pushes a new heap entry and leaves the old one in the heap, where it is skipped
+    when it reaches the top, so scheduling stays O(log n) without searching the heap.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, str, str]] = []
+        self._due: Dict[ItemKey, float] = {}
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, item: ItemKey) -> bool:
+        return item in self._due
+
+    def schedule(self, kind: str, key: str, due_at: float) -> None:
+        self._due[(kind, key)] = due_at
+        heapq.heappush(self._heap, (due_at, next(self._counter), kind, key))
+
+    def _drop_stale(self) -> None:
+        while self._heap and self._due.get((self._heap[0][2], self._heap[0][3])) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_due(self) -> Optional[float]:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[ItemKey]:
+        """
+        Removes and returns the items due at now, the most overdue first.
+        """
+        due_items = []
+        while (due_at := self.next_due()) is not None and due_at <= now:
+            _, _, kind, key = heapq.heappop(self._heap)
+            del self._due[(kind, key)]
+            due_items.append((kind, key))
+        return due_items
+
+
+class RefreshScheduler:
+    """
+    Keeps the players, friend lists, gameplay snapshots and game info of the tracked players up to date,
+    refreshing each item when it becomes due instead of scrapping everything in a single run.
+
+    Every item is due once per frequency period, at a stable offset of the period given by period_offset,
+    so the Steam API calls are spread evenly over the month, or the year, instead of spiking when cron
+    starts the runs. The friends of the tracked players get their profile and friend list refreshed, and
+    their gameplay too with fetch_friends, like in scrap_all_user_data. The scrapper, its repo cache and
+    the HTTP connections are kept for the whole life of the daemon.
+
+    :param scrapper: scrapper whose repo is kept open, its current_time is moved forward on every refresh
+    :type scrapper: SteamScrapper
+    :param max_refreshes_per_minute: optional cap on the refreshes, to stay under the Steam API rate limit
+    :type max_refreshes_per_minute: float
+    """
+
+    def __init__(
+        self,
+        scrapper,
+        frequency: str,
+        fetch_friends: bool = False,
+        max_refreshes_per_minute: Optional[float] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.scrapper = scrapper
+        self.frequency = frequency
+        self.fetch_friends = fetch_friends
+        self.min_refresh_interval = 60 / max_refreshes_per_minute if max_refreshes_per_minute else 0.0
+        self.clock = clock
+        self.queue = DueQueue()
+        self.tracked_players = set()
+        self.failures: Dict[ItemKey, int] = {}
+        self.stopped = threading.Event()
+        self.current_period: Optional[dt.datetime] = None
+        self.last_refresh_at = 0.0
+        self.refreshers = {
+            PLAYER: self.refresh_players,
+            FRIEND_LIST: self.refresh_friend_list,
+            GAMEPLAY: self.refresh_gameplay,
+            GAME_INFO: self.refresh_game_info,
+        }
+
+    # Scheduling
+
+    def due_time(self, kind: str, key: str, now: float, refreshed: bool) -> float:
+        """
+        Returns the due time of an item in the current period, or in the next one once it was refreshed.
+        Items whose offset already passed in the current period are due at once, in offset order.
+        """
+        current_time = dt.datetime.fromtimestamp(now)
+        if refreshed:
+            start = next_period_start(current_time, self.frequency)
+        else:
+            start = period_start(current_time, self.frequency)
+        length = (next_period_start(start, self.frequency) - start).total_seconds()
+        return start.timestamp() + period_offset(kind, key) * length
+
+    def schedule(self, kind: str, key: str, now: float, refreshed: bool = False) -> None:
+        self.queue.schedule(kind, key, self.due_time(kind, key, now, refreshed))
+
+    def add_player(self, steam_id: str, now: Optional[float] = None, tracked: bool = True) -> None:
+        """
+        Schedules the items of a player not scheduled yet. Tracked players get all their items scheduled,
+        the friends of the tracked players only their profile and friend list unless fetch_friends is set.
+        """
+        now = self.clock() if now is None else now
+        if tracked:
+            self.tracked_players.add(steam_id)
+        kinds = [PLAYER, FRIEND_LIST]
+        if tracked or self.fetch_friends:
+            kinds.append(GAMEPLAY)
+        for kind in kinds:
+            if (kind, steam_id) not in self.queue:
+                self.schedule(kind, steam_id, now)
+
+    def add_games(self, app_ids: List[str], now: float) -> None:
+        for app_id in app_ids:
+            if (GAME_INFO, app_id) not in self.queue:
+                self.schedule(GAME_INFO, app_id, now)
+
+    # Refreshes
+
+    def refresh_players(self, steam_ids: List[str], now: float) -> None:
+        self.scrapper.scrap_users(steam_ids=",".join(steam_ids))
+
+    def refresh_friend_list(self, steam_id: str, now: float) -> None:
+        friend_list = self.scrapper.scrap_friend_list(steam_id=steam_id)
+        if friend_list is not None and steam_id in self.tracked_players:
+            for friend in friend_list.friend_list:
+                self.add_player(friend.steamid, now=now, tracked=friend.steamid in self.tracked_players)
+
+    def refresh_gameplay(self, steam_id: str, now: float) -> None:
+        gameplay_info = self.scrapper.scrap_gameplay_info(steam_id=steam_id)
+        if gameplay_info is not None:
+            self.add_games(list({str(gameplay_item.appid) for gameplay_item in gameplay_info.gameplay_list}), now)
+            self.scrapper.scrap_monthly_gameplay_delta(steam_id)
+
+    def refresh_game_info(self, app_ids: List[str], now: float) -> None:
+        self.scrapper.scrap_game_info(",".join(app_ids), update_existing=True)
+
+    def refresh(self, kind: str, keys: List[str], now: float) -> None:
+        """
+        Refreshes items of the same kind, rescheduling them in the next period, or after RETRY_DELAY_SECONDS
+        (doubling on each consecutive failure, up to the next period) when the refresh raised.
+        """
+        self.scrapper.current_time = dt.datetime.fromtimestamp(now)
+        try:
+            with metrics.timer("scheduler_refresh_duration", kind=kind):
+                if kind in BATCH_SIZES:
+                    self.refreshers[kind](keys, now)
+                else:
+                    self.refreshers[kind](keys[0], now)
+        except Exception:
+            logging.exception(f"Refresh of {kind} {','.join(keys[:5])} failed, retrying later.")
+            for key in keys:
+                failures = self.failures.get((kind, key), 0) + 1
+                self.failures[(kind, key)] = failures
+                retry_at = now + RETRY_DELAY_SECONDS * 2 ** (failures - 1)
+                self.queue.schedule(kind, key, min(retry_at, self.due_time(kind, key, now, refreshed=True)))
+            return
+        for key in keys:
+            self.failures.pop((kind, key), None)
+            self.schedule(kind, key, now, refreshed=True)
+
+    def start_period(self, now: float) -> None:
+        """
+        Runs the work of a new frequency period: applies the gameplay retention like the end of a scrap run
+        and clears the repo cache, whose entries all belong to the previous period.
+        """
+        repo = self.scrapper.repo
+        if config.gameplay_retention_months is not None and hasattr(repo, "apply_gameplay_retention"):
+            current_time = dt.datetime.fromtimestamp(now)
+            repo.apply_gameplay_retention(
+                current_year=current_time.year,
+                current_month=current_time.month,
+                retention_months=config.gameplay_retention_months,
+                action=config.gameplay_retention_action,
+            )
+        if hasattr(repo, "clear"):
+            repo.clear()
+
+    def run_pending(self, now: Optional[float] = None) -> int:
+        """
+        Refreshes the items due at now, grouping the due profiles and game info in batches of BATCH_SIZES,
+        and returns the number of refreshes made. Stops early when the scheduler is stopped.
+        """
+        now = self.clock() if now is None else now
+        period = period_start(dt.datetime.fromtimestamp(now), self.frequency)
+        if self.current_period is not None and period != self.current_period:
+            self.start_period(now)
+        self.current_period = period
+
+        due_items = self.queue.pop_due(now)
+        batches = [(kind, [key]) for kind, key in due_items if kind not in BATCH_SIZES]
+        for batch_kind, batch_size in BATCH_SIZES.items():
+            due_keys = [key for kind, key in due_items if kind == batch_kind]
+            batches += [
+                (batch_kind, due_keys[start : start + batch_size]) for start in range(0, len(due_keys), batch_size)
+            ]
+        refreshes = 0
+        for idx, (kind, keys) in enumerate(batches):
+            throttle_seconds = self.last_refresh_at + self.min_refresh_interval - self.clock()
+            if self.stopped.is_set() or (throttle_seconds > 0 and self.stopped.wait(throttle_seconds)):
+                # the items not refreshed stay due
+                for pending_kind, pending_keys in batches[idx:]:
+                    for key in pending_keys:
+                        self.queue.schedule(pending_kind, key, now)
+                break
+            self.last_refresh_at = self.clock()
+            self.refresh(kind, keys, self.last_refresh_at)
+            refreshes += 1
+        return refreshes
+
+    # Daemon loop
+
+    def stop(self, *args) -> None:
+        logging.info("Stopping the scheduler after the current refresh...")
+        self.stopped.set()
+
+    def run(self, metrics_textfile: Optional[str] = None, metrics_json: Optional[str] = None) -> None:
+        """
+        Refreshes the items as they become due until stop is called, writing the metrics outputs every
+        METRICS_INTERVAL_SECONDS and once more on the way out.
+        """
+        metrics_written_at = self.clock()
+        try:
+            while not self.stopped.is_set():
+                self.run_pending()
+                now = self.clock()
+                next_due = self.queue.next_due()
+                metrics.set_gauge("scheduler_queue_items", len(self.queue))
+                metrics.set_gauge("scheduler_overdue_seconds", max(now - next_due, 0) if next_due is not None else 0)
+                if now - metrics_written_at >= METRICS_INTERVAL_SECONDS:
+                    metrics.write_outputs(textfile_path=metrics_textfile, json_path=metrics_json)
+                    metrics_written_at = now
+                wait_seconds = MAX_WAIT_SECONDS if next_due is None else min(max(next_due - now, 0), MAX_WAIT_SECONDS)
+                self.stopped.wait(wait_seconds)
+        finally:
+            metrics.write_outputs(textfile_path=metrics_textfile, json_path=metrics_json)
+
+
+@click.command()
+@click.argument("player_ids", type=str)
+@click.argument("steam_key", envvar="STEAM_KEY", type=str)
+@click.option("--frequency", type=click.Choice(FREQUENCIES), default="month")
+@click.option("--fetch_friends/--dont_fetch_friends", default=False)
+@click.option("--cache_size", default=1024, type=int, help="Repo cache entries kept by the daemon, 0 disables it.")
+@click.option("--max_refreshes_per_minute", type=float, help="Caps the refreshes made per minute.")
+@click.option(
+    "--refresh_policy", type=click.Choice(list(REFRESH_POLICIES)), default="fixed",
+    help="How often the friend lists and libraries are refreshed, activity lengthens it for inactive players.")
+@click.option(
+    "--probe_libraries", is_flag=True, default=False,
+    help="Checks cheap signals before fetching a library, renewing the unchanged ones instead.")
+@click.option("--app_catalogue_path", type=str, help="App catalogue used to prefill and triage the game info.")
+@click.option("--metrics_textfile", type=str, help="Prometheus textfile rewritten with the daemon metrics.")
+@click.option("--metrics_json", type=str, help="JSON summary rewritten with the daemon metrics.")
+def scheduler(
+    player_ids,
+    steam_key,
+    frequency,
+    fetch_friends,
+    cache_size,
+    max_refreshes_per_minute,
+    refresh_policy,
+    probe_libraries,
+    app_catalogue_path,
+    metrics_textfile,
+    metrics_json,
+):
+    """
+    Runs the scrapper as a daemon, refreshing every item of the informed players when it becomes due.
+    Stops gracefully on SIGTERM and SIGINT, after the refresh in progress.
+    """
+    from repos.mongo_repo import SteamMongo
+    from repos.cached_repo import CachedRepo
+    from scrapper import SteamScrapper
+    from app_catalogue import load_app_catalogue
+
+    if config.mongodb_url is None:
+        raise ValueError("Missing MongoDB URL Env Variable.")
+    repo = InstrumentedRepo(
+        SteamMongo(
+            mongo_url=config.mongodb_url,
+            gameplay_partitioned=config.gameplay_partitioned,
+            friend_list_history=config.friend_list_history,
+            app_players_index=config.app_players_index,
+        )
+    )
+    if cache_size > 0:
+        repo = CachedRepo(repo=repo, max_size=cache_size)
+    steam_scrapper = SteamScrapper(
+        repo=repo,
+        frequency=frequency,
+        delete_previous_gameplay=config.gameplay_retention_months is None,
+        refresh_policy=REFRESH_POLICIES[refresh_policy](),
+        probe_libraries=probe_libraries,
+        app_catalogue=load_app_catalogue(app_catalogue_path),
+    )
+    refresh_scheduler = RefreshScheduler(
+        steam_scrapper,
+        frequency=frequency,
+        fetch_friends=fetch_friends,
+        max_refreshes_per_minute=max_refreshes_per_minute,
+    )
+    for player_id in player_ids.split(","):
+        refresh_scheduler.add_player(player_id)
+    signal.signal(signal.SIGTERM, refresh_scheduler.stop)
+    signal.signal(signal.SIGINT, refresh_scheduler.stop)
+    logging.info(f"Scheduler started for {len(refresh_scheduler.tracked_players)} player(s).")
+    refresh_scheduler.run(metrics_textfile=metrics_textfile, metrics_json=metrics_json)
+    logging.info("Scheduler stopped.")
+
+
+def configure_logging():
+    logging.getLogger("pymongo").setLevel(logging.CRITICAL)
+    logging.getLogger("backoff").setLevel(logging.CRITICAL)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setLevel(logging.INFO)
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s - %(message)s")
+    handler.setFormatter(formatter)
+    root.addHandler(handler)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    scheduler()
@@ -1,12 +1,12 @@
 import datetime as dt
-from typing import List, Optional, Union
+from dataclasses import replace
+from typing import Dict, List, Optional, Union, TYPE_CHECKING
 import logging
 import time
 
 from tqdm import tqdm
 
 from repos.repo import Repo
-from repos.mongo_repo import SteamMongo
 from models import (
     SteamProfile, 
     SteamFriendList, 
@@ -18,17 +18,50 @@ from models import (
     GameplayMonthDeltaList
     )
 import steam_api
-from utils import get_last_month_and_year_from_datetime
+from rollups import create_player_rollups
+from metrics import metrics, stage
+from refresh_policy import RefreshPolicy, ActivitySignals, FRIEND_LIST, LIBRARY, logoff_datetime
+from utils import get_last_month_and_year, get_last_month_and_year_from_datetime
+
+if TYPE_CHECKING:
+    from friend_graph import FriendGraph
+    from app_catalogue import AppCatalogue
+
+metrics.describe("refresh_calls_avoided_total", "Friend list and library fetches skipped by the refresh policy.")
+metrics.describe("library_probes_total", "Library probes by result, only the changed libraries are fetched.")
+metrics.describe("app_details_avoided_total", "Apps saved from the app catalogue without calling appdetails.")
+
+# the recently played games cover this window, a snapshot older than it cannot be probed with them
+RECENTLY_PLAYED_WINDOW = dt.timedelta(days=14)
 
 class SteamScrapper:
-    def __init__(self, repo:Repo, frequency:str):
+    def __init__(
+        self,
+        repo:Repo,
+        frequency:str,
+        delete_previous_gameplay:bool=True,
+        friend_graph:Optional["FriendGraph"]=None,
+        refresh_policy:Optional[RefreshPolicy]=None,
+        probe_libraries:bool=False,
+        app_catalogue:Optional["AppCatalogue"]=None
+        ):
         self.repo = repo
         self.steam_api = steam_api
         self.frequency = frequency
+        self.delete_previous_gameplay = delete_previous_gameplay
+        # when informed, every saved friend list is also applied to the friend graph index
+        self.friend_graph = friend_graph
+        # players not due for a refresh get their previous friend list and library carried forward to the period
+        self.refresh_policy = refresh_policy or RefreshPolicy()
+        # checks cheap signals before fetching a library, renewing the unchanged previous snapshots instead
+        self.probe_libraries = probe_libraries
+        # when informed, prefills the app names and spares the appdetails calls of the apps that are not games
+        self.app_catalogue = app_catalogue
         self.current_time = dt.datetime.now()
 
         self.GAME_INFO_BATCH_SIZE = 500
 
+    @stage()
     def scrap_all_user_data(self, player_id: str, fetch_friends: bool) -> None:
         """
         Extracts all information for a single steam id and stores all information
@@ -98,6 +131,7 @@ class SteamScrapper:
                     f"- Friends {len(friend_list.friend_list) if friend_list is not None else 0} "+
                     f"- Game Info {len(game_info_set) + len(scrapped_game_info_ids_set)}")
 
+    @stage()
     def scrap_users(self, steam_ids: str)->List[SteamProfile]:
         """
         Populates a list with the required steam_ids.
@@ -114,7 +148,9 @@ class SteamScrapper:
         steam_ids_not_in_db_list = [id for id in steam_id_list 
                                     if (id not in db_profile_ids) or
                                     not self.is_model_updated(db_user_profile_dict[id])]
-        steam_user_profiles = steam_api.fetch_player_info(",".join(steam_ids_not_in_db_list)) if len(steam_ids_not_in_db_list)>0 else []
+        steam_user_profiles = steam_api.fetch_player_info(
+            ",".join(steam_ids_not_in_db_list), current_time=self.current_time
+        ) if len(steam_ids_not_in_db_list)>0 else []
         steam_user_profile_ids = [steam_profile.steamid for steam_profile in steam_user_profiles]
         steam_user_profile_dict = { user.steamid:user for user in steam_user_profiles}
 
@@ -142,6 +178,7 @@ class SteamScrapper:
         self.repo.save_player_info_list(user_to_save_in_db)
         return user_to_save_in_db
 
+    @stage()
     def scrap_friend_list_batch(self, steam_id_list:List[str])->None:
         """
         Scrapes a list of friend_lists for the informed ids.
@@ -155,6 +192,10 @@ class SteamScrapper:
             created_month=query_month,
             created_year=query_year)
         steam_id_list_to_fetch = [steam_id for steam_id in steam_id_list if steam_id not in db_friend_list_ids]
+        carried_steam_ids = set(
+            friend_list.steamid for friend_list in self.carry_forward_friend_lists(steam_id_list_to_fetch)
+        )
+        steam_id_list_to_fetch = [steam_id for steam_id in steam_id_list_to_fetch if steam_id not in carried_steam_ids]
         for steam_id in tqdm(steam_id_list_to_fetch,
                              desc="Fetching FriendList"):
             steam_friend_list = steam_api.fetch_player_friend_list(player_id=steam_id)
@@ -167,7 +208,10 @@ class SteamScrapper:
                 created_year=self.current_time.year
             )
             self.repo.save_friend_list(steam_friend_list_obj)
+            if self.friend_graph is not None:
+                self.friend_graph.update_friend_lists([steam_friend_list_obj])
 
+    @stage()
     def scrap_friend_list(self, steam_id:str)->Union[SteamFriendList,None]:
         """
         Creates a new entry for friend list.
@@ -175,6 +219,9 @@ class SteamScrapper:
         :type steam_id: str
         """
         if not self.is_friend_list_updated(steam_id):
+            carried_friend_lists = self.carry_forward_friend_lists([steam_id])
+            if carried_friend_lists:
+                return carried_friend_lists[0]
             steam_friend_list = steam_api.fetch_player_friend_list(player_id=steam_id)
             steam_friend_list_obj = SteamFriendList(
                 steamid=steam_id,
@@ -185,6 +232,8 @@ class SteamScrapper:
                 created_year=self.current_time.year
             )
             self.repo.save_friend_list(steam_friend_list_obj)
+            if self.friend_graph is not None:
+                self.friend_graph.update_friend_lists([steam_friend_list_obj])
             return steam_friend_list_obj
         return self.repo.get_friend_list_by_id(player_id=steam_id)[0]
 
@@ -203,21 +252,33 @@ class SteamScrapper:
                 created_year=self.current_time.year)
             if len(existing_friend_list) > 0:
                 existing_friend_list_item = existing_friend_list[0]
-                return self.is_model_updated(existing_friend_list_item)
+                return (
+                    self.is_model_updated(existing_friend_list_item)
+                    or self.is_carried_forward(existing_friend_list_item)
+                )
         elif self.frequency == "year":
             existing_friend_list = self.repo.get_friend_list_by_id(
                 steam_id,
                 created_year=self.current_time.year)
             if len(existing_friend_list) > 0:
                 existing_friend_list_item = existing_friend_list[0]
-                return self.is_model_updated(existing_friend_list_item)
+                return (
+                    self.is_model_updated(existing_friend_list_item)
+                    or self.is_carried_forward(existing_friend_list_item)
+                )
         return False
 
+    @stage()
     def scrap_game_info(self, app_ids: str, update_existing: bool = False) -> List[SteamGameinfo]:
         """
         Fetch information about the specified game, saves it, and return the GameInfo model list.
         """
         full_app_id_list = app_ids.split(",")
+        non_game_app_id_list = []
+        if self.app_catalogue is not None:
+            # the games are fetched first, the apps the store does not list after them, and the other apps not at all
+            game_app_id_list, unlisted_app_id_list, non_game_app_id_list = self.app_catalogue.triage(full_app_id_list)
+            full_app_id_list = game_app_id_list + unlisted_app_id_list
         final_gameinfo_list = []
         for app_id_list in tqdm(self.list_chunk(full_app_id_list, self.GAME_INFO_BATCH_SIZE), 
                                 desc="GameInfo chunks", 
@@ -232,7 +293,7 @@ class SteamScrapper:
                                 total=len(app_id_list)):
                 if app_id in db_gameinfo_ids:
                     if update_existing and not self.is_model_updated(db_gameinfo_dict[app_id]):
-                        steam_gameinfo = steam_api.fetch_game_details(app_id)  
+                        steam_gameinfo = steam_api.fetch_game_details(app_id, current_time=self.current_time)  
                         # profile not found in steam but existing in db
                         if app_id in db_gameinfo_ids and steam_gameinfo is None:
                             current_gameinfo = db_gameinfo_dict[app_id]
@@ -244,12 +305,12 @@ class SteamScrapper:
                             steam_gameinfo.created_at =  current_gameinfo.created_at
                             gameinfo_to_save_in_db.append(steam_gameinfo)
                 else:
-                    steam_gameinfo = steam_api.fetch_game_details(app_id)
+                    steam_gameinfo = steam_api.fetch_game_details(app_id, current_time=self.current_time)
                     # app does not exist both in steam and in db
                     if steam_gameinfo is None or app_id != steam_gameinfo.appid:
                         steam_gameinfo = SteamGameinfo(
                             appid=app_id,
-                            name="",
+                            name=self.catalogue_name(app_id),
                             type="Error",
                             min_age=0,
                             description="",
@@ -273,8 +334,65 @@ class SteamScrapper:
             final_gameinfo_list += gameinfo_to_save_in_db
             if len(gameinfo_to_save_in_db) > 0:
                 self.repo.save_game_info_list(gameinfo_to_save_in_db)
+        final_gameinfo_list += self.save_catalogue_game_info(non_game_app_id_list, update_existing=update_existing)
         return final_gameinfo_list
 
+    def catalogue_name(self, app_id: str) -> str:
+        app = self.app_catalogue.get(app_id) if self.app_catalogue is not None else None
+        return app.name if app is not None else ""
+
+    def save_catalogue_game_info(self, app_id_list: List[str], update_existing: bool = False) -> List[SteamGameinfo]:
+        """
+        Saves the apps listed in the app catalogue, without calling appdetails, with their catalogue name and type.
+        Existing records keep their details, only their name and type are refreshed when update_existing.
+
+        :param app_id_list: appids listed in the app catalogue
+        :type app_id_list: List[str]
+        """
+        gameinfo_to_save_in_db = []
+        for app_id_chunk in self.list_chunk(app_id_list, self.GAME_INFO_BATCH_SIZE):
+            db_gameinfo_dict = {
+                gameinfo.appid: gameinfo for gameinfo in self.repo.get_game_info_by_game_id_list(app_id_chunk)
+            }
+            for app_id in app_id_chunk:
+                db_gameinfo = db_gameinfo_dict.get(app_id)
+                if db_gameinfo is not None and (not update_existing or self.is_model_updated(db_gameinfo)):
+                    continue
+                app = self.app_catalogue.get(app_id)
+                if db_gameinfo is not None:
+                    gameinfo_to_save_in_db.append(
+                        replace(
+                            db_gameinfo,
+                            name=app.name or db_gameinfo.name,
+                            type=app.app_type,
+                            updated_at=self.current_time,
+                        )
+                    )
+                    continue
+                gameinfo_to_save_in_db.append(
+                    SteamGameinfo(
+                        appid=app_id,
+                        name=app.name,
+                        type=app.app_type,
+                        min_age=0,
+                        description="",
+                        developers=[],
+                        publishers=[],
+                        genres=[],
+                        categories=[],
+                        about="",
+                        is_free=False,
+                        created_at=self.current_time,
+                        updated_at=self.current_time,
+                    )
+                )
+        if gameinfo_to_save_in_db:
+            self.repo.save_game_info_list(gameinfo_to_save_in_db)
+            metrics.inc("app_details_avoided_total", len(gameinfo_to_save_in_db))
+            logging.info(f"App catalogue: {len(gameinfo_to_save_in_db)} apps saved without calling appdetails.")
+        return gameinfo_to_save_in_db
+
+    @stage()
     def scrap_gameplay_batch(self, steam_id_list:List[str])->List[GameplayList]:
         """
         Scrapes a list of gameplays for the informed ids.
@@ -288,7 +406,9 @@ class SteamScrapper:
             created_month=query_month,
             created_year=query_year)
         steam_id_list_to_fetch = [steam_id for steam_id in steam_id_list if steam_id not in db_gameinfo_ids]
-        final_result = []
+        final_result = self.reuse_previous_gameplay(steam_id_list_to_fetch)
+        carried_steam_ids = set(gameplay_info.steamid for gameplay_info in final_result)
+        steam_id_list_to_fetch = [steam_id for steam_id in steam_id_list_to_fetch if steam_id not in carried_steam_ids]
         for steam_id in tqdm(steam_id_list_to_fetch,
                              desc="Fetching Gameplay"):
             gameplay_list = steam_api.fetch_player_gameplay_list(player_id=steam_id)
@@ -304,11 +424,15 @@ class SteamScrapper:
             self.repo.save_gameplay_info(steam_gameplay_list_obj)
         return final_result
 
+    @stage()
     def scrap_gameplay_info(self, steam_id:str)->Union[GameplayList,None]:
         """
         Fetch gameplay information, saves it, and returns the GameplayList information.
         """
         if not self.is_gameplay_info_updated(steam_id):
+            reused_gameplay = self.reuse_previous_gameplay([steam_id])
+            if reused_gameplay:
+                return reused_gameplay[0]
             gameplay_list = steam_api.fetch_player_gameplay_list(player_id=steam_id)
             steam_gameplay_list_obj = GameplayList(
                 steamid=steam_id,
@@ -336,16 +460,203 @@ class SteamScrapper:
                 created_year=self.current_time.year)
             if len(existing_gameplay_list) > 0:
                 existing_gameplay_item = existing_gameplay_list[0]
-                return self.is_model_updated(existing_gameplay_item)
+                return (
+                    self.is_model_updated(existing_gameplay_item)
+                    or self.is_carried_forward(existing_gameplay_item)
+                )
         elif self.frequency == "year":
             existing_gameplay_list = self.repo.get_gameplay_info_by_id(
                 steam_id,
                 created_year=self.current_time.year)
             if len(existing_gameplay_list) > 0:
                 existing_gameplay_item = existing_gameplay_list[0]
-                return self.is_model_updated(existing_gameplay_item)
+                return (
+                    self.is_model_updated(existing_gameplay_item)
+                    or self.is_carried_forward(existing_gameplay_item)
+                )
         return False
 
+    def is_carried_forward(self, timestamped_class: Union[SteamFriendList, GameplayList]) -> bool:
+        """
+        Checks if a snapshot was carried forward by the refresh policy: such snapshots keep the updated_at of the
+        fetch they come from, older than the period they are stored in.
+        """
+        updated_at = timestamped_class.updated_at
+        if self.frequency == "year":
+            return updated_at.year < timestamped_class.created_year
+        return (updated_at.year, updated_at.month) < (timestamped_class.created_year, timestamped_class.created_month)
+
+    def activity_signals(self, steam_id_list: List[str]) -> Dict[str, ActivitySignals]:
+        """
+        Reads the stored activity of the players for the refresh policy: the last logoff and missing_in_action
+        of their profiles and the total playtime of their last monthly delta.
+
+        :param steam_id_list: the steam ids of the players
+        :type steam_id_list: List[str]
+        """
+        profile_dict = {profile.steamid: profile for profile in self.repo.get_player_info_by_id_list(steam_id_list)}
+        # the delta of the previous month is only created with the snapshot of the current one
+        last_month, last_year = get_last_month_and_year_from_datetime(self.current_time)
+        delta_month, delta_year = get_last_month_and_year(current_year=last_year, current_month=last_month)
+        delta_dict = {
+            gameplay_delta.steamid: gameplay_delta
+            for gameplay_delta in self.repo.get_existing_gameplay_delta_info_list(
+                steam_id_list, created_year=delta_year, created_month=delta_month
+            ) or []
+        }
+        signals = {}
+        for steam_id in steam_id_list:
+            profile = profile_dict.get(steam_id)
+            gameplay_delta = delta_dict.get(steam_id)
+            signals[steam_id] = ActivitySignals(
+                last_logoff=logoff_datetime(profile.last_logoff) if profile is not None else None,
+                missing_in_action=bool(profile.missing_in_action) if profile is not None else False,
+                online=profile is not None and profile.persona_state not in (None, 0),
+                last_month_playtime=gameplay_delta.total_playtime if gameplay_delta is not None else None,
+            )
+        return signals
+
+    def carry_forward(
+        self, kind: str, previous_list: List[Union[SteamFriendList, GameplayList]]
+    ) -> List[Union[SteamFriendList, GameplayList]]:
+        """
+        Returns copies in the current period of the previous snapshots whose players are not due for a refresh.
+        The copies keep the updated_at of the fetch they come from, so the policy still sees how old they are.
+        """
+        if not self.refresh_policy.adaptive or not previous_list:
+            return []
+        signals = self.activity_signals([previous.steamid for previous in previous_list])
+        carried_list = [
+            replace(
+                previous,
+                created_at=self.current_time,
+                created_year=self.current_time.year,
+                created_month=self.current_time.month,
+            )
+            for previous in previous_list
+            if not self.refresh_policy.is_due(
+                kind, previous.updated_at, signals[previous.steamid], self.current_time, self.frequency
+            )
+        ]
+        if carried_list:
+            metrics.inc("refresh_calls_avoided_total", len(carried_list), kind=kind)
+            logging.info(f"Refresh policy: {len(carried_list)} {kind} fetches avoided, previous snapshots carried.")
+        return carried_list
+
+    def carry_forward_friend_lists(self, steam_id_list: List[str]) -> List[SteamFriendList]:
+        """
+        Saves the latest friend list of the players not due for a refresh in the current period, returning them.
+        """
+        if not self.refresh_policy.adaptive:
+            return []
+        previous_list = []
+        for steam_id in steam_id_list:
+            existing_friend_list = self.repo.get_friend_list_by_id(player_id=steam_id)
+            if len(existing_friend_list) > 0:
+                previous_list.append(existing_friend_list[0])
+        carried_list = self.carry_forward(FRIEND_LIST, previous_list)
+        for friend_list in carried_list:
+            self.repo.save_friend_list(friend_list)
+        return carried_list
+
+    def previous_gameplay(self, steam_id_list: List[str]) -> Dict[str, GameplayList]:
+        """
+        Returns the library of the players in the previous period by steam id, the latest updated one when the
+        yearly frequency finds several.
+        """
+        if self.frequency == "month":
+            previous_month, previous_year = get_last_month_and_year_from_datetime(self.current_time)
+        else:
+            previous_month, previous_year = None, self.current_time.year - 1
+        previous_dict = {}
+        for gameplay_info in sorted(
+            self.repo.get_gameplay_info_by_id_list(
+                steam_id_list, created_year=previous_year, created_month=previous_month
+            ),
+            key=lambda gameplay_info: gameplay_info.updated_at,
+        ):
+            previous_dict[gameplay_info.steamid] = gameplay_info
+        return previous_dict
+
+    def reuse_previous_gameplay(self, steam_id_list: List[str]) -> List[GameplayList]:
+        """
+        Saves the previous period library in the current period for the players whose library does not need to be
+        fetched, returning them: the ones not due for a refresh, then the ones the probe finds unchanged.
+        """
+        if not steam_id_list or not (self.refresh_policy.adaptive or self.probe_libraries):
+            return []
+        previous_dict = self.previous_gameplay(steam_id_list)
+        reused_list = self.carry_forward(LIBRARY, list(previous_dict.values()))
+        if self.probe_libraries:
+            carried_steam_ids = set(gameplay_info.steamid for gameplay_info in reused_list)
+            reused_list += self.probe_gameplay(
+                [
+                    gameplay_info
+                    for gameplay_info in previous_dict.values()
+                    if gameplay_info.steamid not in carried_steam_ids
+                ]
+            )
+        for gameplay_info in reused_list:
+            self.repo.save_gameplay_info(gameplay_info)
+        return reused_list
+
+    @stage()
+    def probe_gameplay(self, previous_list: List[GameplayList]) -> List[GameplayList]:
+        """
+        Checks with cheap signals which libraries did not change since their previous snapshot, returning those
+        snapshots renewed in the current period. A library is unchanged when the player is offline and logged
+        off before the snapshot, both read from a profile fetched after it in the current period, or, when the
+        snapshot is recent enough for the recently played games to cover the time since, when none of them gained
+        playtime. The renewed snapshots are stamped with the time the library was last known unchanged: the
+        profile fetch for the offline players, so a logoff after it triggers a fetch in the next period, and the
+        current time for the recently played games, which are read now.
+
+        :param previous_list: the previous period libraries of the players
+        :type previous_list: List[GameplayList]
+        """
+        if not previous_list:
+            return []
+        profile_dict = {
+            profile.steamid: profile
+            for profile in self.repo.get_player_info_by_id_list([previous.steamid for previous in previous_list])
+        }
+        renewed_list = []
+        for previous in previous_list:
+            profile = profile_dict.get(previous.steamid)
+            last_logoff = logoff_datetime(profile.last_logoff) if profile is not None else None
+            if (
+                profile is not None
+                and profile.persona_state == 0
+                and self.is_model_updated(profile)
+                and profile.updated_at > previous.updated_at
+                and last_logoff is not None
+                and last_logoff <= previous.updated_at
+            ):
+                probe_result = "offline"
+            elif self.current_time - previous.updated_at <= RECENTLY_PLAYED_WINDOW:
+                recent_gameplay_list = steam_api.fetch_recently_played_games(player_id=previous.steamid)
+                previous_playtime_dict = {item.appid: item.playtime for item in previous.gameplay_list}
+                unchanged = recent_gameplay_list is not None and all(
+                    previous_playtime_dict.get(item.appid) == item.playtime for item in recent_gameplay_list
+                )
+                probe_result = "recently_played" if unchanged else "changed"
+            else:
+                probe_result = "changed"
+            metrics.inc("library_probes_total", result=probe_result)
+            if probe_result != "changed":
+                renewed_list.append(
+                    replace(
+                        previous,
+                        created_at=self.current_time,
+                        updated_at=profile.updated_at if probe_result == "offline" else self.current_time,
+                        created_year=self.current_time.year,
+                        created_month=self.current_time.month,
+                    )
+                )
+        if renewed_list:
+            logging.info(f"Library probe: {len(renewed_list)} of {len(previous_list)} libraries unchanged.")
+        return renewed_list
+
     def is_model_updated(
             self, 
             timestamped_class: TimestampedBaseClass)->bool:
@@ -379,6 +690,7 @@ class SteamScrapper:
         for i in range(0, len(my_list), list_size):  
             yield my_list[i:i + list_size] 
 
+    @stage()
     def scrap_monthly_gameplay_delta(self, user_ids:str) -> None:
         user_list = user_ids.split(",")
         last_month, last_year = get_last_month_and_year_from_datetime(self.current_time)
@@ -398,8 +710,18 @@ class SteamScrapper:
                 gameplay_monthly_delta_to_add.append(new_monthly_gameplay_delta)
         if gameplay_monthly_delta_to_add:
             self.repo.save_gameplay_delta_info_list(gameplay_delta_info_list=gameplay_monthly_delta_to_add)
-        if user_list_to_create:
-            self.delete_previous_gameplay_info(user_ids=user_list_to_create)
+            create_player_rollups(self.repo, gameplay_monthly_delta_to_add, current_time=self.current_time)
+        if gameplay_monthly_delta_to_add and self.delete_previous_gameplay:
+            # previous snapshots are only deleted for the users whose delta is read back from the repo with the
+            # stamp of this run, so a failed or partial save never loses history, even over an older delta
+            verified_user_ids = self.repo.get_existing_gameplay_delta_info_id_list(
+                steam_id_list=[gameplay_delta.steamid for gameplay_delta in gameplay_monthly_delta_to_add],
+                created_month=last_month,
+                created_year=last_year,
+                updated_at=self.current_time
+            )
+            if verified_user_ids:
+                self.delete_previous_gameplay_info(user_ids=verified_user_ids)
 
 
     def calculate_gameplay_delta(
@@ -1,17 +1,41 @@
-from typing import List, Union
+from typing import List, Optional, Tuple, Union
 import datetime as dt
+import time
 from urllib.parse import urlencode
 
 import requests
 import backoff
 
 from config import config
-from models import SteamProfile, SteamFriendItem, GameplayItem, SteamGameinfo
-from errors import SteamResourceNotAvailable
+from models import SteamProfile, SteamFriendItem, GameplayItem, SteamGameinfo, SteamAppListItem
+from errors import SteamResourceNotAvailable, AppCatalogueSyncError
+from metrics import api_call, record_api_backoff, record_api_request
 
 MAX_RETRIES = 15
+APP_LIST_PAGE_SIZE = 50000
+# GetAppList flag listing each type of app, the others are disabled so every app is listed with its type
+APP_LIST_TYPE_FLAGS = {
+    "game": "include_games",
+    "dlc": "include_dlc",
+    "software": "include_software",
+    "video": "include_videos",
+    "hardware": "include_hardware",
+}
+# kept open between calls, so long running processes reuse their connections to the Steam API
+session = requests.Session()
 
 
+def get(url: str, endpoint: str) -> requests.Response:
+    """
+    Sends a GET request to the Steam API, recording its status, latency and response size for the endpoint.
+    """
+    start = time.perf_counter()
+    r = session.get(url)
+    record_api_request(endpoint, r.status_code, time.perf_counter() - start, len(r.content))
+    return r
+
+
+@api_call
 @backoff.on_exception(
     backoff.expo,
     (
@@ -21,6 +45,7 @@ MAX_RETRIES = 15
         SteamResourceNotAvailable,
     ),
     max_tries=MAX_RETRIES,
+    on_backoff=record_api_backoff,
 )
 def fetch_player_info(
     player_ids: str, steam_key: str = None, current_time: dt.datetime = dt.datetime.now()
@@ -33,10 +58,10 @@ def fetch_player_info(
     "type player_ids: str
     """
     steam_key = steam_key or config.steam_key
-    player_url_base = f"http://api.steampowered.com/ISteamUser/GetPlayerSummaries/v0002/"
+    player_url_base = f"{config.steam_api_url}/ISteamUser/GetPlayerSummaries/v0002/"
     player_url_params = {"key": steam_key, "steamids": player_ids}
     player_url = f"{player_url_base}?{urlencode(player_url_params)}"
-    r = requests.get(player_url)
+    r = get(player_url, endpoint="fetch_player_info")
     if r.status_code in [429]:
         raise SteamResourceNotAvailable("Status code not acceptable.")
     if r.status_code >= 400:
@@ -57,6 +82,7 @@ def fetch_player_info(
                 real_name=player.get("realname"),
                 loc_country=player.get("loccountrycode"),
                 loc_state=player.get("locstatecode"),
+                persona_state=player.get("personastate"),
                 created_at=current_time,
                 updated_at=current_time,
             )
@@ -64,6 +90,7 @@ def fetch_player_info(
     return result
 
 
+@api_call
 @backoff.on_exception(
     backoff.expo,
     (
@@ -73,6 +100,7 @@ def fetch_player_info(
         SteamResourceNotAvailable,
     ),
     max_tries=MAX_RETRIES,
+    on_backoff=record_api_backoff,
 )
 def fetch_player_friend_list(player_id: str, steam_key: str = None) -> List[SteamFriendItem]:
     """
@@ -83,10 +111,10 @@ def fetch_player_friend_list(player_id: str, steam_key: str = None) -> List[Stea
     "type player_ids: str
     """
     steam_key = steam_key or config.steam_key
-    friends_url_base = f"http://api.steampowered.com/ISteamUser/GetFriendList/v0001/"
+    friends_url_base = f"{config.steam_api_url}/ISteamUser/GetFriendList/v0001/"
     friends_url_params = {"key": steam_key, "steamid": player_id}
     friends_url = f"{friends_url_base}?{urlencode(friends_url_params)}"
-    r = requests.get(friends_url)
+    r = get(friends_url, endpoint="fetch_player_friend_list")
     if r.status_code in [429]:
         raise SteamResourceNotAvailable("Status code not acceptable.")
     if r.status_code >= 400:
@@ -102,6 +130,7 @@ def fetch_player_friend_list(player_id: str, steam_key: str = None) -> List[Stea
     return result
 
 
+@api_call
 @backoff.on_exception(
     backoff.expo,
     (
@@ -111,6 +140,7 @@ def fetch_player_friend_list(player_id: str, steam_key: str = None) -> List[Stea
         SteamResourceNotAvailable,
     ),
     max_tries=MAX_RETRIES,
+    on_backoff=record_api_backoff,
 )
 def fetch_player_gameplay_list(player_id: str, steam_key: str = None) -> List[GameplayItem]:
     """
@@ -121,10 +151,10 @@ def fetch_player_gameplay_list(player_id: str, steam_key: str = None) -> List[Ga
     "type player_ids: str
     """
     steam_key = steam_key or config.steam_key
-    gameplay_url_base = f"http://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/?"
+    gameplay_url_base = f"{config.steam_api_url}/IPlayerService/GetOwnedGames/v0001/"
     gameplay_url_params = {"key": steam_key, "steamid": player_id}
     gameplay_url = f"{gameplay_url_base}?{urlencode(gameplay_url_params)}"
-    r = requests.get(gameplay_url)
+    r = get(gameplay_url, endpoint="fetch_player_gameplay_list")
     if r.status_code in [429]:
         raise SteamResourceNotAvailable("Status code not acceptable.")
     if r.status_code >= 400:
@@ -145,6 +175,103 @@ def fetch_player_gameplay_list(player_id: str, steam_key: str = None) -> List[Ga
     return result
 
 
+@api_call
+@backoff.on_exception(
+    backoff.expo,
+    (
+        requests.exceptions.ConnectTimeout,
+        requests.exceptions.Timeout,
+        requests.exceptions.ConnectionError,
+        SteamResourceNotAvailable,
+    ),
+    max_tries=MAX_RETRIES,
+    on_backoff=record_api_backoff,
+)
+def fetch_recently_played_games(player_id: str, steam_key: str = None) -> Optional[List[GameplayItem]]:
+    """
+    Fetches the games played in the last two weeks by a given player id, with their total playtime.
+    Returns None when the API does not tell, as for private libraries.
+    :param steam_key: the key to access the Steam API
+    :type steam_key: str
+    :param player_id: player id in steam
+    "type player_ids: str
+    """
+    steam_key = steam_key or config.steam_key
+    recent_url_base = f"{config.steam_api_url}/IPlayerService/GetRecentlyPlayedGames/v0001/"
+    recent_url_params = {"key": steam_key, "steamid": player_id}
+    recent_url = f"{recent_url_base}?{urlencode(recent_url_params)}"
+    r = get(recent_url, endpoint="fetch_recently_played_games")
+    if r.status_code in [429]:
+        raise SteamResourceNotAvailable("Status code not acceptable.")
+    if r.status_code >= 400:
+        return None
+    response = r.json()["response"]
+    if "total_count" not in response:
+        return None
+    return [
+        GameplayItem(appid=str(gameplay.get("appid")), playtime=gameplay.get("playtime_forever"))
+        for gameplay in response.get("games", [])
+    ]
+
+
+@api_call
+@backoff.on_exception(
+    backoff.expo,
+    (
+        requests.exceptions.ConnectTimeout,
+        requests.exceptions.Timeout,
+        requests.exceptions.ConnectionError,
+        SteamResourceNotAvailable,
+    ),
+    max_tries=MAX_RETRIES,
+    on_backoff=record_api_backoff,
+)
+def fetch_app_list(
+    app_type: str,
+    if_modified_since: Optional[int] = None,
+    last_appid: Optional[int] = None,
+    max_results: int = APP_LIST_PAGE_SIZE,
+    steam_key: str = None,
+) -> Tuple[List[SteamAppListItem], Optional[int]]:
+    """
+    Fetches a page of the store app catalogue for one type of app, returning the apps and the last_appid to
+    continue from, None on the last page.
+    :param app_type: one of the APP_LIST_TYPE_FLAGS types
+    :type app_type: str
+    :param if_modified_since: only lists the apps modified after this epoch, all of them when None
+    :type if_modified_since: int
+    :param last_appid: last_appid returned by the previous page
+    :type last_appid: int
+    """
+    steam_key = steam_key or config.steam_key
+    app_list_url_base = f"{config.steam_api_url}/IStoreService/GetAppList/v1/"
+    app_list_url_params = {"key": steam_key, "max_results": max_results}
+    for flag_type, flag in APP_LIST_TYPE_FLAGS.items():
+        app_list_url_params[flag] = "true" if flag_type == app_type else "false"
+    if if_modified_since is not None:
+        app_list_url_params["if_modified_since"] = if_modified_since
+    if last_appid is not None:
+        app_list_url_params["last_appid"] = last_appid
+    app_list_url = f"{app_list_url_base}?{urlencode(app_list_url_params)}"
+    r = get(app_list_url, endpoint="fetch_app_list")
+    if r.status_code in [429]:
+        raise SteamResourceNotAvailable("Status code not acceptable.")
+    if r.status_code >= 400:
+        raise AppCatalogueSyncError(f"App list not available, status code {r.status_code}.")
+    response = r.json()["response"]
+    result = [
+        SteamAppListItem(
+            appid=str(app.get("appid")),
+            name=app.get("name") or "",
+            app_type=app_type,
+            last_modified=app.get("last_modified") or 0,
+        )
+        for app in response.get("apps", [])
+    ]
+    return result, response.get("last_appid") if response.get("have_more_results") else None
+
+
+@api_call
 @backoff.on_exception(
     backoff.expo,
     (
@@ -154,6 +281,7 @@ def fetch_player_gameplay_list(player_id: str, steam_key: str = None) -> List[Ga
         SteamResourceNotAvailable,
     ),
     max_tries=MAX_RETRIES,
+    on_backoff=record_api_backoff,
 )
 def fetch_game_details(
     app_id: str, steam_key: str = None, current_time: dt.datetime = dt.datetime.now()
@@ -166,10 +294,10 @@ def fetch_game_details(
     "type player_ids: str
     """
     steam_key = steam_key or config.steam_key
-    gameinfo_url_base = f"http://store.steampowered.com/api/appdetails"
+    gameinfo_url_base = f"{config.steam_store_url}/api/appdetails"
     gameinfo_url_params = {"appids": app_id}
     gameinfo_url = f"{gameinfo_url_base}?{urlencode(gameinfo_url_params)}"
-    r = requests.get(gameinfo_url)
+    r = get(gameinfo_url, endpoint="fetch_game_details")
     if r.status_code in [429]:
         raise SteamResourceNotAvailable("Status code not acceptable.")
     if r.status_code >= 400:
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# the modules import each other flat, like when the scripts run from steam_scrapper
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def mongo_repo(monkeypatch):
+    """
+    SteamMongo backed by an in memory mongomock client.
+    """
+    mongomock = pytest.importorskip("mongomock")
+    import repos.mongo_repo
+
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(repos.mongo_repo, "MongoClient", lambda *args, **kwargs: client)
+    return repos.mongo_repo.SteamMongo(mongo_url="mongodb://localhost")
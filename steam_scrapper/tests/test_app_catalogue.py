@@ -0,0 +1,81 @@
+import datetime as dt
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import steam_api
+from app_catalogue import AppCatalogue, sync_app_catalogue
+from errors import SteamResourceNotAvailable
+from models import SteamAppListItem
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """
+    Store apps served by the patched GetAppList, by appid, with the if_modified_since of each call.
+    """
+    store = {"apps": {}, "calls": []}
+
+    def fetch_app_list(app_type, if_modified_since=None, last_appid=None):
+        store["calls"].append(if_modified_since)
+        apps = [
+            app
+            for app in store["apps"].values()
+            if app.app_type == app_type and (if_modified_since is None or app.last_modified >= if_modified_since)
+        ]
+        return apps, None
+
+    monkeypatch.setattr(steam_api, "fetch_app_list", fetch_app_list)
+    return store
+
+
+def list_app(store, appid: str, name: str, last_modified: int, app_type: str = "game") -> None:
+    store["apps"][appid] = SteamAppListItem(appid=appid, name=name, app_type=app_type, last_modified=last_modified)
+
+
+def test_incremental_sync_updates_the_modified_apps(store):
+    catalogue = AppCatalogue()
+    list_app(store, "10", "Game", 100)
+    list_app(store, "20", "Dlc", 100, app_type="dlc")
+    sync_app_catalogue(catalogue, current_time=dt.datetime.fromtimestamp(200))
+
+    list_app(store, "10", "Renamed Game", 300)
+    del store["apps"]["20"]
+    assert sync_app_catalogue(catalogue, current_time=dt.datetime.fromtimestamp(400)) == 1
+
+    assert store["calls"][-1] == 200
+    assert catalogue.get("10").name == "Renamed Game"
+    # the incremental listing does not tell the delisted apps
+    assert catalogue.get("20") is not None
+
+
+def test_full_sync_replaces_the_catalogue(store):
+    catalogue = AppCatalogue()
+    list_app(store, "10", "Game", 100)
+    list_app(store, "20", "Dlc", 100, app_type="dlc")
+    sync_app_catalogue(catalogue, current_time=dt.datetime.fromtimestamp(200))
+
+    del store["apps"]["20"]
+    list_app(store, "30", "New Game", 300)
+    assert sync_app_catalogue(catalogue, full=True, current_time=dt.datetime.fromtimestamp(400)) == 2
+
+    assert store["calls"][-1] is None
+    assert catalogue.appids.tolist() == [10, 30]
+    assert catalogue.get("20") is None and catalogue.get("30").name == "New Game"
+    assert catalogue.synced_at == 400
+
+
+def test_failed_full_sync_keeps_the_catalogue(store, monkeypatch):
+    catalogue = AppCatalogue()
+    list_app(store, "10", "Game", 100)
+    sync_app_catalogue(catalogue, current_time=dt.datetime.fromtimestamp(200))
+
+    def failing_fetch_app_list(app_type, if_modified_since=None, last_appid=None):
+        raise SteamResourceNotAvailable("Status code not acceptable.")
+
+    monkeypatch.setattr(steam_api, "fetch_app_list", failing_fetch_app_list)
+    with pytest.raises(SteamResourceNotAvailable):
+        sync_app_catalogue(catalogue, full=True, current_time=dt.datetime.fromtimestamp(400))
+
+    assert len(catalogue) == 1 and catalogue.synced_at == 200
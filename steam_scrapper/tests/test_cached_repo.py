@@ -0,0 +1,148 @@
+import datetime as dt
+
+import pytest
+
+from benchmarks.memory_repo import MemoryRepo
+from models import GameplayItem, GameplayList, SteamProfile
+from repos.cached_repo import GAMEPLAY, PLAYER_INFO, CachedRepo
+
+NOW = dt.datetime(2024, 2, 1)
+
+
+def profile(steamid: str, persona_name: str = "player") -> SteamProfile:
+    return SteamProfile(
+        steamid=steamid,
+        persona_name=persona_name,
+        profile_url="",
+        avatar="",
+        avatar_medium="",
+        avatar_full="",
+        last_logoff=0,
+        time_created=0,
+        persona_state=0,
+        created_at=NOW,
+        updated_at=NOW,
+    )
+
+
+def gameplay(steamid: str, playtime: int) -> GameplayList:
+    return GameplayList(
+        steamid=steamid,
+        gameplay_list=[GameplayItem(appid="10", playtime=playtime)],
+        created_year=2024,
+        created_month=2,
+        created_at=NOW,
+        updated_at=NOW,
+    )
+
+
+class ExtendedMemoryRepo(MemoryRepo):
+    """
+    MemoryRepo with operations outside of the Repo interface, like the batch updates of SteamMongo.
+    """
+
+    def count_gameplay_info(self, created_year: int, created_month: int) -> int:
+        return len(self.find(self.gameplay_info, created_year=created_year, created_month=created_month))
+
+    def rename_apps(self, appid: str, new_appid: str) -> None:
+        for document in self.gameplay_info:
+            for gameplay_item in document["gameplay_list"]:
+                if gameplay_item["appid"] == appid:
+                    gameplay_item["appid"] = new_appid
+
+
+@pytest.fixture
+def cached_repo():
+    return CachedRepo(repo=ExtendedMemoryRepo())
+
+
+def read_gameplay(cached_repo, steamid: str) -> list:
+    return cached_repo.get_gameplay_info_by_id(player_id=steamid, created_year=2024, created_month=2)
+
+
+def test_saved_profiles_are_written_through(cached_repo):
+    cached_repo.save_player_info_list([profile("1"), profile("2")])
+
+    assert [item.steamid for item in cached_repo.get_player_info_by_id_list(["1", "2"])] == ["1", "2"]
+    assert cached_repo.misses[PLAYER_INFO] == 0 and cached_repo.hits[PLAYER_INFO] == 2
+
+    cached_repo.save_player_info_list([profile("1", persona_name="renamed")])
+    assert cached_repo.get_player_info_by_id_list(["1"])[0].persona_name == "renamed"
+    assert cached_repo.misses[PLAYER_INFO] == 0
+
+
+def test_cached_values_are_copies(cached_repo):
+    cached_repo.save_player_info_list([profile("1")])
+
+    cached_repo.get_player_info_by_id_list(["1"])[0].persona_name = "mutated"
+
+    assert cached_repo.get_player_info_by_id_list(["1"])[0].persona_name == "player"
+
+
+def test_unknown_ids_are_cached_as_missing(cached_repo):
+    assert cached_repo.get_player_info_by_id_list(["1"]) == []
+    assert cached_repo.get_player_info_by_id_list(["1"]) == []
+    assert cached_repo.misses[PLAYER_INFO] == 1 and cached_repo.hits[PLAYER_INFO] == 1
+
+
+def test_saves_invalidate_the_queries_of_the_saved_players_only(cached_repo):
+    cached_repo.save_gameplay_info(gameplay("1", 10))
+    cached_repo.save_gameplay_info(gameplay("2", 20))
+    read_gameplay(cached_repo, "1")
+    read_gameplay(cached_repo, "2")
+    cached_repo.get_existing_gameplay_info_ids(player_id_list=["1", "2"], created_year=2024, created_month=2)
+    assert cached_repo.misses[GAMEPLAY] == 3
+
+    cached_repo.save_gameplay_info(gameplay("1", 15))
+
+    assert read_gameplay(cached_repo, "1")[0].gameplay_list[0].playtime == 15
+    assert read_gameplay(cached_repo, "2")[0].gameplay_list[0].playtime == 20
+    cached_repo.get_existing_gameplay_info_ids(player_id_list=["1", "2"], created_year=2024, created_month=2)
+    # the query of player 1 and the one listing both players were dropped, the one of player 2 was kept
+    assert cached_repo.misses[GAMEPLAY] == 5 and cached_repo.hits[GAMEPLAY] == 1
+
+
+def test_saves_only_invalidate_their_own_family(cached_repo):
+    cached_repo.save_player_info_list([profile("1")])
+    cached_repo.save_gameplay_info(gameplay("1", 10))
+    read_gameplay(cached_repo, "1")
+
+    cached_repo.save_player_info_list([profile("1", persona_name="renamed")])
+    read_gameplay(cached_repo, "1")
+
+    assert cached_repo.hits[GAMEPLAY] == 1
+
+
+def test_deletes_without_a_player_invalidate_the_whole_family(cached_repo):
+    cached_repo.save_gameplay_info(gameplay("1", 10))
+    cached_repo.save_gameplay_info(gameplay("2", 20))
+    read_gameplay(cached_repo, "1")
+    read_gameplay(cached_repo, "2")
+
+    cached_repo.delete_gameplay_info(created_year=2024, created_month=2)
+
+    assert read_gameplay(cached_repo, "1") == [] and read_gameplay(cached_repo, "2") == []
+
+
+def test_delegated_reads_keep_the_cache(cached_repo):
+    cached_repo.save_gameplay_info(gameplay("1", 10))
+    read_gameplay(cached_repo, "1")
+
+    assert cached_repo.count_gameplay_info(created_year=2024, created_month=2) == 1
+    read_gameplay(cached_repo, "1")
+
+    assert cached_repo.hits[GAMEPLAY] == 1
+
+
+def test_delegated_writes_clear_the_cache(cached_repo):
+    cached_repo.save_player_info_list([profile("1")])
+    cached_repo.save_gameplay_info(gameplay("1", 10))
+    read_gameplay(cached_repo, "1")
+
+    cached_repo.rename_apps("10", "20")
+
+    assert read_gameplay(cached_repo, "1")[0].gameplay_list[0].appid == "20"
+    assert cached_repo.hits[GAMEPLAY] == 0
+    # the cached profiles are dropped too, the effect of the delegated call being unknown
+    cached_repo.get_player_info_by_id_list(["1"])
+    assert cached_repo.misses[PLAYER_INFO] == 1
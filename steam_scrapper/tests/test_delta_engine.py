@@ -0,0 +1,114 @@
+import datetime as dt
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from benchmarks.memory_repo import MemoryRepo
+from delta_engine import calculate_gameplay_delta_batch
+from models import CompactGameplayList, GameplayItem, GameplayList
+from scrapper import SteamScrapper
+
+CURRENT_TIME = dt.datetime(2024, 2, 1, 12)
+
+
+def gameplay(steamid: str, year: int, month: int, playtimes: dict) -> GameplayList:
+    return GameplayList(
+        steamid=steamid,
+        gameplay_list=[GameplayItem(appid=appid, playtime=playtime) for appid, playtime in playtimes.items()],
+        created_year=year,
+        created_month=month,
+        created_at=dt.datetime(year, month, 1),
+        updated_at=dt.datetime(year, month, 1),
+    )
+
+
+def seeded_snapshots(seed: int, appid_format: str = "{}"):
+    """
+    Current and previous month snapshots of random libraries, with played, idle, reset, removed and new apps,
+    empty libraries and players without a previous month snapshot.
+    """
+    rng = random.Random(seed)
+    current_list = []
+    previous_dict = {}
+    for player_idx in range(200):
+        steamid = str(76561197960265728 + player_idx)
+        # every tenth player starts from an empty library
+        previous_playtimes = {
+            appid_format.format(rng.randrange(1, 2000)): rng.randrange(0, 5000)
+            for _ in range(rng.randrange(0, 30) if player_idx % 10 != 1 else 0)
+        }
+        current_playtimes = {}
+        for appid, playtime in previous_playtimes.items():
+            # most apps are played more or not at all, some lose playtime or leave the library
+            change = rng.choices(["played", "idle", "reset", "removed"], weights=[5, 3, 1, 1])[0]
+            if change == "played":
+                current_playtimes[appid] = playtime + rng.randrange(1, 600)
+            elif change == "idle":
+                current_playtimes[appid] = playtime
+            elif change == "reset":
+                current_playtimes[appid] = rng.randrange(0, playtime + 1)
+        for _ in range(rng.randrange(0, 5)):
+            current_playtimes.setdefault(appid_format.format(rng.randrange(2000, 3000)), rng.randrange(0, 600))
+        current_list.append(gameplay(steamid, 2024, 2, current_playtimes))
+        if player_idx % 10 != 0:
+            previous_dict[steamid] = gameplay(steamid, 2024, 1, previous_playtimes)
+    return current_list, previous_dict
+
+
+def python_deltas(current_list, previous_dict):
+    scrapper = SteamScrapper(repo=MemoryRepo(), frequency="month", delete_previous_gameplay=False)
+    scrapper.current_time = CURRENT_TIME
+    return [
+        scrapper.calculate_gameplay_delta(current, previous_dict[current.steamid])
+        for current in current_list
+        if current.steamid in previous_dict
+    ]
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_numpy_engine_matches_the_python_deltas(seed):
+    current_list, previous_dict = seeded_snapshots(seed)
+
+    expected = python_deltas(current_list, previous_dict)
+    assert calculate_gameplay_delta_batch(current_list, previous_dict, current_time=CURRENT_TIME) == expected
+
+
+def test_numpy_engine_matches_the_python_deltas_with_non_numeric_appids():
+    current_list, previous_dict = seeded_snapshots(4, appid_format="app_{}")
+
+    expected = python_deltas(current_list, previous_dict)
+    assert calculate_gameplay_delta_batch(current_list, previous_dict, current_time=CURRENT_TIME) == expected
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_numpy_engine_matches_the_python_deltas_on_compact_snapshots(seed):
+    current_list, previous_dict = seeded_snapshots(seed)
+    compact_current_list = [CompactGameplayList.from_model(item) for item in current_list]
+    compact_previous_dict = {
+        int(steamid): CompactGameplayList.from_model(item) for steamid, item in previous_dict.items()
+    }
+
+    expected = python_deltas(current_list, previous_dict)
+    assert calculate_gameplay_delta_batch(
+        compact_current_list, compact_previous_dict, current_time=CURRENT_TIME
+    ) == expected
+
+
+def test_numpy_engine_drops_negative_deltas_and_keeps_new_apps():
+    current_list = [
+        gameplay("1", 2024, 2, {"10": 50, "20": 30, "30": 15}),
+        gameplay("2", 2024, 2, {"10": 5}),
+        gameplay("3", 2024, 2, {"10": 5}),
+    ]
+    previous_dict = {
+        "1": gameplay("1", 2024, 1, {"10": 20, "20": 40, "40": 100}),
+        "2": gameplay("2", 2024, 1, {}),
+    }
+
+    deltas = calculate_gameplay_delta_batch(current_list, previous_dict, current_time=CURRENT_TIME)
+
+    assert deltas == python_deltas(current_list, previous_dict)
+    assert [(delta.steamid, delta.total_playtime) for delta in deltas] == [("1", 45), ("2", 5)]
+    assert [(item.appid, item.playtime) for item in deltas[0].gameplay_delta_list] == [("10", 30), ("30", 15)]
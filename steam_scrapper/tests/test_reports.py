@@ -0,0 +1,45 @@
+import datetime as dt
+
+from benchmarks.memory_repo import MemoryRepo
+from models import SteamFriendItem, SteamFriendList, SteamProfile
+from reports import load_report_inputs
+
+
+def profile(steamid: str) -> SteamProfile:
+    return SteamProfile(
+        steamid=steamid,
+        persona_name=f"player {steamid}",
+        profile_url="",
+        avatar="",
+        avatar_medium="",
+        avatar_full="",
+        last_logoff=0,
+        time_created=0,
+        persona_state=0,
+        created_at=dt.datetime(2024, 1, 1),
+        updated_at=dt.datetime(2024, 1, 1),
+    )
+
+
+def friend_list(steamid: str, friend_ids: list, updated_at: dt.datetime) -> SteamFriendList:
+    return SteamFriendList(
+        steamid=steamid,
+        friend_list=[
+            SteamFriendItem(steamid=friend_id, friend_since=dt.datetime(2023, 1, 1)) for friend_id in friend_ids
+        ],
+        created_year=updated_at.year,
+        created_month=updated_at.month,
+        created_at=updated_at,
+        updated_at=updated_at,
+    )
+
+
+def test_reports_use_the_latest_friend_list():
+    repo = MemoryRepo()
+    repo.save_player_info_list([profile("1"), profile("2"), profile("3")])
+    repo.save_friend_list(friend_list("1", ["3"], dt.datetime(2024, 2, 1)))
+    repo.save_friend_list(friend_list("1", ["2"], dt.datetime(2024, 1, 1)))
+
+    report_inputs = load_report_inputs(repo, ["1"], created_year=2024, created_month=2)
+
+    assert [friend["steamid"] for friend in report_inputs["1"]["friends"]] == ["3"]
@@ -0,0 +1,198 @@
+import datetime as dt
+
+import pytest
+
+import scheduler
+from scheduler import FRIEND_LIST, PLAYER, DueQueue, RefreshScheduler
+
+
+def timestamp(*args) -> float:
+    return dt.datetime(*args).timestamp()
+
+
+class FakeClock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeStopEvent:
+    """
+    Stop event whose waits move the fake clock forward instead of sleeping.
+    """
+
+    def __init__(self, clock, stop_after_waits=None):
+        self.clock = clock
+        self.stop_after_waits = stop_after_waits
+        self.waits = []
+        self.stopped = False
+
+    def is_set(self) -> bool:
+        return self.stopped
+
+    def set(self) -> None:
+        self.stopped = True
+
+    def wait(self, seconds: float) -> bool:
+        self.waits.append(seconds)
+        self.clock.now += seconds
+        if self.stop_after_waits is not None and len(self.waits) >= self.stop_after_waits:
+            self.stopped = True
+        return self.stopped
+
+
+class RecordingRepo:
+    def __init__(self):
+        self.calls = []
+
+    def clear(self):
+        self.calls.append("clear")
+
+
+class FakeScrapper:
+    def __init__(self, failing=False):
+        self.repo = RecordingRepo()
+        self.current_time = None
+        self.failing = failing
+        self.scrapped_users = []
+        self.scrapped_friend_lists = []
+
+    def scrap_users(self, steam_ids):
+        if self.failing:
+            raise RuntimeError("api down")
+        self.scrapped_users.append(steam_ids.split(","))
+
+    def scrap_friend_list(self, steam_id):
+        self.scrapped_friend_lists.append(steam_id)
+
+
+@pytest.fixture
+def fixed_offset(monkeypatch):
+    """
+    Places every item at the given position of the period, instead of the hash of the item.
+    """
+
+    def set_offset(offset: float):
+        monkeypatch.setattr(scheduler, "period_offset", lambda kind, key: offset)
+
+    set_offset(0.0)
+    return set_offset
+
+
+def make_scheduler(now: float, failing=False, max_refreshes_per_minute=None) -> RefreshScheduler:
+    clock = FakeClock(now)
+    refresh_scheduler = RefreshScheduler(
+        FakeScrapper(failing=failing),
+        frequency="month",
+        max_refreshes_per_minute=max_refreshes_per_minute,
+        clock=clock,
+    )
+    refresh_scheduler.stopped = FakeStopEvent(clock)
+    return refresh_scheduler
+
+
+def test_due_queue_skips_the_stale_entries_of_rescheduled_items():
+    queue = DueQueue()
+    queue.schedule(PLAYER, "1", 10)
+    queue.schedule(PLAYER, "2", 20)
+    # the entry due at 10 stays in the heap but no longer matches the item
+    queue.schedule(PLAYER, "1", 30)
+
+    assert len(queue) == 2
+    assert queue.next_due() == 20
+    assert queue.pop_due(25) == [(PLAYER, "2")]
+    assert queue.pop_due(29) == []
+    assert queue.pop_due(30) == [(PLAYER, "1")]
+    assert queue.next_due() is None and len(queue) == 0
+
+
+def test_due_queue_pops_the_most_overdue_first():
+    queue = DueQueue()
+    queue.schedule(FRIEND_LIST, "1", 20)
+    queue.schedule(PLAYER, "2", 10)
+    queue.schedule(PLAYER, "3", 15)
+
+    assert queue.pop_due(20) == [(PLAYER, "2"), (PLAYER, "3"), (FRIEND_LIST, "1")]
+
+
+def test_due_time_is_in_the_current_period_then_in_the_next_once_refreshed(fixed_offset):
+    fixed_offset(0.5)
+    refresh_scheduler = make_scheduler(timestamp(2024, 1, 10))
+    january_length = timestamp(2024, 2, 1) - timestamp(2024, 1, 1)
+    february_length = timestamp(2024, 3, 1) - timestamp(2024, 2, 1)
+
+    now = timestamp(2024, 1, 10)
+    assert refresh_scheduler.due_time(PLAYER, "1", now, refreshed=False) == timestamp(2024, 1, 1) + january_length / 2
+    assert refresh_scheduler.due_time(PLAYER, "1", now, refreshed=True) == timestamp(2024, 2, 1) + february_length / 2
+
+
+def test_refreshed_items_roll_over_to_the_next_period(monkeypatch, fixed_offset):
+    monkeypatch.setattr(scheduler.config, "gameplay_retention_months", None)
+    fixed_offset(0.5)
+    refresh_scheduler = make_scheduler(timestamp(2024, 1, 10))
+    refresh_scheduler.schedule(PLAYER, "1", timestamp(2024, 1, 10))
+
+    assert refresh_scheduler.run_pending(timestamp(2024, 1, 10)) == 0
+    assert refresh_scheduler.run_pending(timestamp(2024, 1, 20)) == 1
+    # refreshed once per period, the item waits for the middle of February
+    assert refresh_scheduler.run_pending(timestamp(2024, 1, 31)) == 0
+    assert refresh_scheduler.scrapper.repo.calls == []
+
+    assert refresh_scheduler.run_pending(timestamp(2024, 2, 20)) == 1
+    assert refresh_scheduler.scrapper.scrapped_users == [["1"], ["1"]]
+    assert refresh_scheduler.scrapper.repo.calls == ["clear"]
+
+
+def test_failed_refresh_backs_off_up_to_the_next_period(fixed_offset):
+    refresh_scheduler = make_scheduler(timestamp(2024, 1, 31, 23), failing=True)
+    refresh_scheduler.schedule(PLAYER, "1", timestamp(2024, 1, 31, 23))
+
+    retry_times = []
+    for _ in range(3):
+        refresh_scheduler.run_pending(refresh_scheduler.clock.now)
+        retry_times.append(refresh_scheduler.queue.next_due())
+        refresh_scheduler.clock.now = retry_times[-1]
+
+    # 15 then 30 minutes later, then the hour of backoff is capped at the due time of February
+    assert retry_times == [timestamp(2024, 1, 31, 23, 15), timestamp(2024, 1, 31, 23, 45), timestamp(2024, 2, 1)]
+    assert refresh_scheduler.failures == {(PLAYER, "1"): 3}
+
+    refresh_scheduler.scrapper.failing = False
+    refresh_scheduler.run_pending(refresh_scheduler.clock.now)
+    assert refresh_scheduler.failures == {}
+
+
+def test_due_players_are_refreshed_in_batches(fixed_offset):
+    now = timestamp(2024, 1, 10)
+    refresh_scheduler = make_scheduler(now)
+    player_ids = [str(player_id) for player_id in range(250)]
+    for player_id in player_ids:
+        refresh_scheduler.schedule(PLAYER, player_id, now)
+
+    assert refresh_scheduler.run_pending(now) == 3
+    assert [len(steam_ids) for steam_ids in refresh_scheduler.scrapper.scrapped_users] == [100, 100, 50]
+    assert sum(refresh_scheduler.scrapper.scrapped_users, []) == player_ids
+
+
+def test_refreshes_are_throttled(fixed_offset):
+    now = timestamp(2024, 1, 10)
+    refresh_scheduler = make_scheduler(now, max_refreshes_per_minute=30)
+    for steam_id in ["1", "2", "3"]:
+        refresh_scheduler.schedule(FRIEND_LIST, steam_id, now)
+
+    assert refresh_scheduler.run_pending(now) == 3
+    assert refresh_scheduler.stopped.waits == [2.0, 2.0]
+    assert refresh_scheduler.scrapper.scrapped_friend_lists == ["1", "2", "3"]
+
+
+def test_items_not_refreshed_when_stopped_stay_due(fixed_offset):
+    now = timestamp(2024, 1, 10)
+    refresh_scheduler = make_scheduler(now, max_refreshes_per_minute=30)
+    refresh_scheduler.stopped.stop_after_waits = 1
+    for steam_id in ["1", "2", "3"]:
+        refresh_scheduler.schedule(FRIEND_LIST, steam_id, now)
+
+    assert refresh_scheduler.run_pending(now) == 1
+    assert refresh_scheduler.queue.pop_due(now) == [(FRIEND_LIST, "2"), (FRIEND_LIST, "3")]
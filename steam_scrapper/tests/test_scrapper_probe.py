@@ -0,0 +1,96 @@
+import datetime as dt
+
+import pytest
+
+import steam_api
+from benchmarks.memory_repo import MemoryRepo
+from models import GameplayItem, SteamProfile
+from scrapper import SteamScrapper
+
+PLAYER_ID = "76561197960265728"
+
+
+def profile(persona_state: int, last_logoff: dt.datetime, updated_at: dt.datetime) -> SteamProfile:
+    return SteamProfile(
+        steamid=PLAYER_ID,
+        persona_name="player",
+        profile_url="",
+        avatar="",
+        avatar_medium="",
+        avatar_full="",
+        last_logoff=int(last_logoff.timestamp()),
+        time_created=0,
+        persona_state=persona_state,
+        created_at=updated_at,
+        updated_at=updated_at,
+    )
+
+
+@pytest.fixture
+def library(monkeypatch):
+    """
+    Library served by the patched API, with the players whose library was downloaded.
+    """
+    library = {"playtime": 100, "fetched": [], "recently_played": []}
+
+    def fetch_player_gameplay_list(player_id):
+        library["fetched"].append(player_id)
+        return [GameplayItem(appid="10", playtime=library["playtime"])]
+
+    monkeypatch.setattr(steam_api, "fetch_player_gameplay_list", fetch_player_gameplay_list)
+    monkeypatch.setattr(
+        steam_api,
+        "fetch_recently_played_games",
+        lambda player_id: [GameplayItem(appid="10", playtime=item) for item in library["recently_played"]],
+    )
+    return library
+
+
+@pytest.fixture
+def scrapper():
+    return SteamScrapper(repo=MemoryRepo(), frequency="month", delete_previous_gameplay=False, probe_libraries=True)
+
+
+def scrap_library_at(scrapper, current_time: dt.datetime):
+    scrapper.current_time = current_time
+    return scrapper.scrap_gameplay_batch([PLAYER_ID])
+
+
+def test_offline_renewal_is_stamped_with_the_profile_fetch(scrapper, library):
+    scrap_library_at(scrapper, dt.datetime(2024, 1, 25))
+    scrapper.repo.save_player_info_list([profile(0, dt.datetime(2024, 1, 20), dt.datetime(2024, 2, 3))])
+    library["fetched"].clear()
+
+    renewed_list = scrap_library_at(scrapper, dt.datetime(2024, 2, 20))
+
+    assert library["fetched"] == []
+    assert [gameplay_info.updated_at for gameplay_info in renewed_list] == [dt.datetime(2024, 2, 3)]
+    assert renewed_list[0].created_at == dt.datetime(2024, 2, 20)
+
+
+def test_play_after_the_profile_fetch_is_fetched_in_the_next_period(scrapper, library):
+    scrap_library_at(scrapper, dt.datetime(2024, 1, 25))
+    scrapper.repo.save_player_info_list([profile(0, dt.datetime(2024, 1, 20), dt.datetime(2024, 2, 3))])
+    scrap_library_at(scrapper, dt.datetime(2024, 2, 20))
+    library["fetched"].clear()
+
+    # the player plays on February 10th, after the profile fetch of February but before its library was renewed
+    library["playtime"] = 160
+    scrapper.repo.save_player_info_list([profile(0, dt.datetime(2024, 2, 10), dt.datetime(2024, 3, 2))])
+    gameplay_list = scrap_library_at(scrapper, dt.datetime(2024, 3, 20))
+
+    assert library["fetched"] == [PLAYER_ID]
+    assert [item.playtime for item in gameplay_list[0].gameplay_list] == [160]
+
+
+def test_recently_played_renewal_is_stamped_with_the_current_time(scrapper, library):
+    scrap_library_at(scrapper, dt.datetime(2024, 1, 25))
+    # online players keep the logoff of their previous session, only the recently played games tell
+    scrapper.repo.save_player_info_list([profile(1, dt.datetime(2024, 1, 20), dt.datetime(2024, 2, 1))])
+    library["recently_played"] = [100]
+    library["fetched"].clear()
+
+    renewed_list = scrap_library_at(scrapper, dt.datetime(2024, 2, 3))
+
+    assert library["fetched"] == []
+    assert [gameplay_info.updated_at for gameplay_info in renewed_list] == [dt.datetime(2024, 2, 3)]
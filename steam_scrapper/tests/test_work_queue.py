@@ -0,0 +1,197 @@
+import datetime as dt
+import time
+
+import pytest
+
+import work_queue
+from work_queue import PROFILE, WorkQueueWorker
+
+PAST = dt.datetime(2000, 1, 1)
+
+
+def add_pending_items(repo, keys, kind=PROFILE):
+    # inserted directly, mongomock does not accept the bulk writes of enqueue_work_items with recent pymongo
+    repo.work_queue.insert_many(
+        [
+            {
+                "_id": f"{kind}:{key}",
+                "kind": kind,
+                "key": key,
+                "status": "pending",
+                "available_at": PAST,
+                "attempts": 0,
+                "payload": {},
+                "created_at": PAST,
+                "updated_at": PAST,
+            }
+            for key in keys
+        ]
+    )
+
+
+def expire_lease(repo, work_item):
+    repo.work_queue.update_one({"_id": work_item.item_id}, {"$set": {"lease_expires_at": PAST}})
+
+
+def status_of(repo, work_item) -> str:
+    return repo.work_queue.find_one({"_id": work_item.item_id})["status"]
+
+
+class FakeScrapper:
+    def __init__(self, repo=None, on_scrap=None):
+        self.repo = repo
+        self.frequency = "month"
+        self.current_time = None
+        self.on_scrap = on_scrap
+
+    def scrap_users(self, player_ids):
+        if self.on_scrap is not None:
+            self.on_scrap()
+
+
+class RecordingRepo:
+    def __init__(self):
+        self.calls = []
+
+    def apply_gameplay_retention(self, **kwargs):
+        self.calls.append(("apply_gameplay_retention", kwargs))
+
+    def clear(self):
+        self.calls.append(("clear", {}))
+
+
+def test_claim_leases_each_item_to_a_single_worker(mongo_repo):
+    add_pending_items(mongo_repo, ["1", "2", "3"])
+
+    first_claim = mongo_repo.claim_work_items("w1", kinds=[PROFILE], limit=2)
+    second_claim = mongo_repo.claim_work_items("w2", kinds=[PROFILE], limit=2)
+
+    assert len(first_claim) == 2 and len(second_claim) == 1
+    assert not {item.item_id for item in first_claim} & {item.item_id for item in second_claim}
+    assert all(item.attempts == 1 and item.status == "leased" for item in first_claim + second_claim)
+    assert mongo_repo.claim_work_items("w3", kinds=[PROFILE]) == []
+
+
+def test_claim_is_idempotent_by_claim_id(mongo_repo):
+    add_pending_items(mongo_repo, ["1", "2"])
+
+    first_claim = mongo_repo.claim_work_items("w1", kinds=[PROFILE], claim_id="claim")
+    retried_claim = mongo_repo.claim_work_items("w1", kinds=[PROFILE], claim_id="claim")
+
+    assert [item.item_id for item in retried_claim] == [item.item_id for item in first_claim]
+    assert retried_claim[0].attempts == 1
+
+
+def test_heartbeat_extends_the_lease(mongo_repo):
+    add_pending_items(mongo_repo, ["1"])
+    work_item = mongo_repo.claim_work_items("w1", kinds=[PROFILE], lease_seconds=60)[0]
+
+    assert mongo_repo.heartbeat_work_items([work_item], lease_seconds=600) == []
+    lease_expires_at = mongo_repo.work_queue.find_one({"_id": work_item.item_id})["lease_expires_at"]
+    assert lease_expires_at > work_item.lease_expires_at + dt.timedelta(seconds=500)
+
+
+def test_expired_lease_is_taken_over_by_another_worker(mongo_repo):
+    add_pending_items(mongo_repo, ["1"])
+    stale_item = mongo_repo.claim_work_items("w1", kinds=[PROFILE])[0]
+    expire_lease(mongo_repo, stale_item)
+
+    new_item = mongo_repo.claim_work_items("w2", kinds=[PROFILE])[0]
+
+    assert new_item.item_id == stale_item.item_id and new_item.attempts == 2
+    assert mongo_repo.heartbeat_work_items([stale_item]) == [stale_item.item_id]
+    assert mongo_repo.complete_work_item(stale_item) is False
+    assert mongo_repo.complete_work_item(new_item) is True
+    # completing again with the same lease succeeds
+    assert mongo_repo.complete_work_item(new_item) is True
+    assert status_of(mongo_repo, new_item) == "done"
+
+
+def test_failed_item_is_retried_then_dead_lettered(mongo_repo):
+    add_pending_items(mongo_repo, ["1"])
+    work_item = mongo_repo.claim_work_items("w1", kinds=[PROFILE], max_attempts=2)[0]
+
+    assert mongo_repo.fail_work_item(work_item, "boom", retry_delay_seconds=60, max_attempts=2) == "pending"
+    # not available before the retry delay
+    assert mongo_repo.claim_work_items("w1", kinds=[PROFILE], max_attempts=2) == []
+    mongo_repo.work_queue.update_one({"_id": work_item.item_id}, {"$set": {"available_at": PAST}})
+    work_item = mongo_repo.claim_work_items("w1", kinds=[PROFILE], max_attempts=2)[0]
+
+    assert work_item.attempts == 2
+    assert mongo_repo.fail_work_item(work_item, "boom again", retry_delay_seconds=0, max_attempts=2) == "dead"
+    assert mongo_repo.claim_work_items("w1", kinds=[PROFILE], max_attempts=2) == []
+    dead_items = mongo_repo.get_dead_work_items()
+    assert [item.item_id for item in dead_items] == [work_item.item_id]
+    assert dead_items[0].last_error == "boom again"
+
+
+def test_expired_lease_of_the_last_attempt_is_dead_lettered(mongo_repo):
+    add_pending_items(mongo_repo, ["1"])
+    work_item = mongo_repo.claim_work_items("w1", kinds=[PROFILE], max_attempts=1)[0]
+    expire_lease(mongo_repo, work_item)
+
+    assert mongo_repo.claim_work_items("w2", kinds=[PROFILE], max_attempts=1) == []
+    assert status_of(mongo_repo, work_item) == "dead"
+
+
+def test_dead_letters_are_requeued_with_their_attempts_reset(mongo_repo):
+    add_pending_items(mongo_repo, ["1"])
+    work_item = mongo_repo.claim_work_items("w1", kinds=[PROFILE], max_attempts=1)[0]
+    mongo_repo.fail_work_item(work_item, "boom", max_attempts=1)
+
+    assert mongo_repo.requeue_dead_work_items(kind=PROFILE) == 1
+    requeued_item = mongo_repo.claim_work_items("w1", kinds=[PROFILE], max_attempts=1)[0]
+    assert requeued_item.item_id == work_item.item_id and requeued_item.attempts == 1
+
+
+def test_worker_heartbeat_keeps_the_lease_of_slow_batches(mongo_repo):
+    add_pending_items(mongo_repo, ["1"])
+    competing_claims = []
+
+    def slow_scrap():
+        # processing outlasts the lease, which only the heartbeat keeps from being taken over
+        time.sleep(1.0)
+        competing_claims.extend(mongo_repo.claim_work_items("w2", kinds=[PROFILE], lease_seconds=0.5))
+
+    worker = WorkQueueWorker(mongo_repo, FakeScrapper(on_scrap=slow_scrap), worker_id="w1", lease_seconds=0.5)
+    work_items = mongo_repo.claim_work_items("w1", kinds=[PROFILE], lease_seconds=0.5)
+
+    worker.run_batch(PROFILE, work_items)
+
+    assert competing_claims == []
+    assert status_of(mongo_repo, work_items[0]) == "done"
+
+
+def test_worker_fails_the_items_of_a_raising_batch(mongo_repo):
+    add_pending_items(mongo_repo, ["1", "2"])
+
+    def failing_scrap():
+        raise RuntimeError("api down")
+
+    worker = WorkQueueWorker(mongo_repo, FakeScrapper(on_scrap=failing_scrap), worker_id="w1", max_attempts=1)
+
+    assert worker.run_once() == 2
+    assert [item.last_error for item in mongo_repo.get_dead_work_items()] == ["RuntimeError: api down"] * 2
+
+
+@pytest.mark.parametrize("retention_months", [None, 3])
+def test_worker_starts_a_period_when_it_changes(monkeypatch, retention_months):
+    monkeypatch.setattr(work_queue.config, "gameplay_retention_months", retention_months)
+    repo = RecordingRepo()
+    worker = WorkQueueWorker(queue_repo=None, scrapper=FakeScrapper(repo=repo), worker_id="w1")
+
+    worker.update_period(dt.datetime(2024, 1, 30))
+    worker.update_period(dt.datetime(2024, 1, 31))
+    assert repo.calls == []
+
+    worker.update_period(dt.datetime(2024, 2, 1))
+    expected_calls = [("clear", {})]
+    if retention_months is not None:
+        retention = {
+            "current_year": 2024,
+            "current_month": 2,
+            "retention_months": retention_months,
+            "action": work_queue.config.gameplay_retention_action,
+        }
+        expected_calls.insert(0, ("apply_gameplay_retention", retention))
+    assert repo.calls == expected_calls
@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import List, Optional, Tuple, Union
 import datetime as dt
 
 def get_last_month_and_year(current_year:str, current_month: int) -> Tuple[int, int]:
@@ -7,4 +7,34 @@ def get_last_month_and_year(current_year:str, current_month: int) -> Tuple[int,
         return (last_month, last_year)
 
 def get_last_month_and_year_from_datetime(current_datetime: dt.datetime) -> Tuple[int, int]:
-        return get_last_month_and_year(current_year=current_datetime.year, current_month=current_datetime.month)
\ No newline at end of file
+        return get_last_month_and_year(current_year=current_datetime.year, current_month=current_datetime.month)
+
+def get_next_month_and_year(current_year: int, current_month: int) -> Tuple[int, int]:
+        next_month = 1 if current_month == 12 else current_month + 1
+        next_year = current_year + 1 if current_month == 12 else current_year
+        return (next_month, next_year)
+
+def get_month_range(start_year: int, start_month: int, end_year: int, end_month: int) -> List[Tuple[int, int]]:
+        """
+        Lists the (year, month) periods from the start to the end period, both included.
+        """
+        periods = []
+        year, month = start_year, start_month
+        while (year, month) <= (end_year, end_month):
+                periods.append((year, month))
+                month, year = get_next_month_and_year(current_year=year, current_month=month)
+        return periods
+
+def to_epoch(value: Union[dt.datetime, int, None]) -> Optional[int]:
+        """
+        Converts a datetime to whole epoch seconds, naive datetimes being local time like the Steam API ones.
+        Values already in epoch seconds, like the profile dates returned by Steam, are kept.
+        """
+        if value is None:
+                return None
+        if isinstance(value, dt.datetime):
+                return int(value.timestamp())
+        return int(value)
+
+def from_epoch(value: Optional[int]) -> Optional[dt.datetime]:
+        return dt.datetime.fromtimestamp(value) if value is not None else None
@@ -0,0 +1,380 @@
+import click
+import datetime as dt
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+from typing import List, Optional
+
+from config import config
+from metrics import metrics, InstrumentedRepo
+from refresh_policy import REFRESH_POLICIES
+from scheduler import FREQUENCIES, period_start
+
+PROFILE = "profile"
+FRIEND_LIST = "friend_list"
+LIBRARY = "library"
+APP_DETAILS = "appdetails"
+WORK_KINDS = [PROFILE, FRIEND_LIST, LIBRARY, APP_DETAILS]
+# items processed per claim, profiles are fetched 100 per GetPlayerSummaries request
+CLAIM_LIMITS = {PROFILE: 100, FRIEND_LIST: 1, LIBRARY: 1, APP_DETAILS: 50}
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+RETRY_DELAY_SECONDS = 60
+POLL_SECONDS = 10
+
+metrics.describe("work_batch_duration_seconds", "Duration of the work queue batches by kind.")
+metrics.describe("work_batch_duration_errors_total", "Work queue batches that raised.")
+metrics.describe("work_items_total", "Work queue items processed by kind and result.")
+
+
+class LeaseHeartbeat(threading.Thread):
+    """
+    Extends the leases of the items being processed every third of the lease, recording the items whose
+    lease was lost, which happens when the worker stalled longer than the lease.
+    """
+
+    def __init__(self, queue_repo, work_items: List, lease_seconds: float):
+        super().__init__(name="lease-heartbeat", daemon=True)
+        self.queue_repo = queue_repo
+        self.work_items = work_items
+        self.lease_seconds = lease_seconds
+        self.lost_item_ids = set()
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.lease_seconds / 3):
+            self.lost_item_ids.update(self.queue_repo.heartbeat_work_items(self.work_items, self.lease_seconds))
+
+    def __enter__(self) -> "LeaseHeartbeat":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stopped.set()
+        self.join()
+
+
+class WorkQueueWorker:
+    """
+    Drains the work queue of a SteamMongo repo with a scrapper, so several nodes can share the scrapping,
+    each one with its own Steam API key.
+
+    Items are claimed with a lease kept alive by a heartbeat while they are processed, then completed,
+    or failed and retried later. An item is only held by one worker at a time, so the nodes never fetch
+    the same resource twice or race on the same upserts. The friend list of a player enqueued with expand
+    set enqueues the profiles, friend lists and, with fetch_friends, the libraries of the friends, and
+    every library enqueues the appdetails of its games, like scrap_all_user_data.
+
+    :param queue_repo: SteamMongo holding the work queue, not wrapped by the cache
+    :type queue_repo: SteamMongo
+    :param scrapper: scrapper saving the fetched resources
+    :type scrapper: SteamScrapper
+    :param kinds: kinds of items processed by this worker, all of them by default
+    :type kinds: List[str]
+    """
+
+    def __init__(
+        self,
+        queue_repo,
+        scrapper,
+        worker_id: str,
+        kinds: Optional[List[str]] = None,
+        lease_seconds: float = LEASE_SECONDS,
+        max_attempts: int = MAX_ATTEMPTS,
+        retry_delay_seconds: float = RETRY_DELAY_SECONDS,
+    ):
+        self.queue_repo = queue_repo
+        self.scrapper = scrapper
+        self.worker_id = worker_id
+        self.kinds = kinds or WORK_KINDS
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self.stopped = threading.Event()
+        # start of the frequency period of the last batch, the period work runs when it changes
+        self.current_period: Optional[dt.datetime] = None
+
+    # Processing
+
+    def process_profiles(self, work_items: List) -> None:
+        self.scrapper.scrap_users(",".join(work_item.key for work_item in work_items))
+
+    def process_friend_list(self, work_item) -> None:
+        friend_list = self.scrapper.scrap_friend_list(steam_id=work_item.key)
+        if friend_list is None or not work_item.payload.get("expand"):
+            return
+        friend_ids = [friend.steamid for friend in friend_list.friend_list]
+        # items of the friends done in a previous period are refreshed, the ones done in this period are not,
+        # so players in each other friend lists do not requeue each other
+        requeue_completed_before = period_start(self.scrapper.current_time, self.scrapper.frequency)
+        for kind in [PROFILE, FRIEND_LIST] + ([LIBRARY] if work_item.payload.get("fetch_friends") else []):
+            self.queue_repo.enqueue_work_items(kind, friend_ids, requeue_completed_before=requeue_completed_before)
+
+    def process_library(self, work_item) -> None:
+        gameplay_info = self.scrapper.scrap_gameplay_info(steam_id=work_item.key)
+        if gameplay_info is None:
+            return
+        app_ids = list({str(gameplay_item.appid) for gameplay_item in gameplay_info.gameplay_list})
+        self.queue_repo.enqueue_work_items(APP_DETAILS, app_ids)
+        self.scrapper.scrap_monthly_gameplay_delta(work_item.key)
+
+    def process_app_details(self, work_items: List) -> None:
+        self.scrapper.scrap_game_info(",".join(work_item.key for work_item in work_items))
+
+    def process(self, kind: str, work_items: List) -> None:
+        if kind == PROFILE:
+            self.process_profiles(work_items)
+        elif kind == APP_DETAILS:
+            self.process_app_details(work_items)
+        elif kind == FRIEND_LIST:
+            self.process_friend_list(work_items[0])
+        elif kind == LIBRARY:
+            self.process_library(work_items[0])
+        else:
+            raise ValueError(f"Unknown work item kind {kind}.")
+
+    def start_period(self, current_time: dt.datetime) -> None:
+        """
+        Runs the work of a new frequency period, like the scheduler: applies the gameplay retention and clears
+        the repo cache, whose entries all belong to the previous period.
+        """
+        repo = self.scrapper.repo
+        if config.gameplay_retention_months is not None and hasattr(repo, "apply_gameplay_retention"):
+            repo.apply_gameplay_retention(
+                current_year=current_time.year,
+                current_month=current_time.month,
+                retention_months=config.gameplay_retention_months,
+                action=config.gameplay_retention_action,
+            )
+        if hasattr(repo, "clear"):
+            repo.clear()
+
+    def update_period(self, current_time: dt.datetime) -> None:
+        period = period_start(current_time, self.scrapper.frequency)
+        if self.current_period is not None and period != self.current_period:
+            self.start_period(current_time)
+        self.current_period = period
+
+    def run_batch(self, kind: str, work_items: List) -> None:
+        """
+        Processes items claimed together, completing them, or failing them all when the batch raised.
+        """
+        self.scrapper.current_time = dt.datetime.now()
+        self.update_period(self.scrapper.current_time)
+        error = None
+        with LeaseHeartbeat(self.queue_repo, work_items, self.lease_seconds) as heartbeat:
+            try:
+                with metrics.timer("work_batch_duration", kind=kind):
+                    self.process(kind, work_items)
+            except Exception as exc:
+                logging.exception(f"Work batch of {len(work_items)} {kind} item(s) failed.")
+                error = f"{type(exc).__name__}: {exc}"
+        for work_item in work_items:
+            if error is not None:
+                result = self.queue_repo.fail_work_item(
+                    work_item, error, retry_delay_seconds=self.retry_delay_seconds, max_attempts=self.max_attempts
+                )
+            else:
+                result = "done" if self.queue_repo.complete_work_item(work_item) else None
+            if result is None or work_item.item_id in heartbeat.lost_item_ids:
+                logging.warning(f"Lease of {work_item.item_id} was lost, another worker processes it again.")
+                result = "lease_lost"
+            metrics.inc("work_items_total", kind=kind, result=result)
+
+    def run_once(self) -> int:
+        """
+        Claims and processes one batch of every kind of the worker, returning the number of items processed.
+        """
+        processed_items = 0
+        for kind in self.kinds:
+            if self.stopped.is_set():
+                break
+            work_items = self.queue_repo.claim_work_items(
+                self.worker_id,
+                kinds=[kind],
+                limit=CLAIM_LIMITS[kind],
+                lease_seconds=self.lease_seconds,
+                max_attempts=self.max_attempts,
+            )
+            if work_items:
+                self.run_batch(kind, work_items)
+                processed_items += len(work_items)
+        return processed_items
+
+    def run(self, exit_when_empty: bool = False, poll_seconds: float = POLL_SECONDS) -> int:
+        """
+        Processes batches until stopped, waiting poll_seconds whenever the queue has nothing available,
+        or returning at that point with exit_when_empty. Returns the number of items processed.
+        """
+        processed_items = 0
+        while not self.stopped.is_set():
+            batch_items = self.run_once()
+            processed_items += batch_items
+            if not batch_items:
+                if exit_when_empty:
+                    break
+                self.stopped.wait(poll_seconds)
+        return processed_items
+
+    def stop(self, *args) -> None:
+        logging.info("Stopping the worker after the current batch...")
+        self.stopped.set()
+
+
+def connect_queue_repo():
+    from repos.mongo_repo import SteamMongo
+
+    if config.mongodb_url is None:
+        raise ValueError("Missing MongoDB URL Env Variable.")
+    return SteamMongo(
+        mongo_url=config.mongodb_url,
+        gameplay_partitioned=config.gameplay_partitioned,
+        friend_list_history=config.friend_list_history,
+        app_players_index=config.app_players_index,
+    )
+
+
+@click.group()
+def work_queue():
+    pass
+
+
+@work_queue.command()
+@click.argument("player_ids", type=str)
+@click.option("--fetch_friends/--dont_fetch_friends", default=False)
+@click.option("--requeue_done", is_flag=True, default=False, help="Requeues the items done in a previous run.")
+def enqueue(player_ids, fetch_friends, requeue_done):
+    """
+    Enqueues the profile, friend list and library of the informed players.
+    """
+    queue_repo = connect_queue_repo()
+    player_id_list = player_ids.split(",")
+    requeue_completed_before = dt.datetime.now() if requeue_done else None
+    added = queue_repo.enqueue_work_items(
+        PROFILE, player_id_list, requeue_completed_before=requeue_completed_before
+    )
+    added += queue_repo.enqueue_work_items(
+        FRIEND_LIST,
+        player_id_list,
+        payload={"expand": True, "fetch_friends": fetch_friends},
+        requeue_completed_before=requeue_completed_before,
+    )
+    added += queue_repo.enqueue_work_items(
+        LIBRARY, player_id_list, requeue_completed_before=requeue_completed_before
+    )
+    logging.info(f"{added} work item(s) enqueued for {len(player_id_list)} player(s).")
+
+
+@work_queue.command()
+@click.argument("steam_key", envvar="STEAM_KEY", type=str)
+@click.option("--worker_id", type=str, help="Defaults to the host name and process id.")
+@click.option("--kind", "kinds", type=click.Choice(WORK_KINDS), multiple=True, help="Kinds processed, all by default.")
+@click.option("--frequency", type=click.Choice(FREQUENCIES), default="month")
+@click.option("--lease_seconds", type=click.IntRange(min=10), default=LEASE_SECONDS)
+@click.option("--max_attempts", type=click.IntRange(min=1), default=MAX_ATTEMPTS)
+@click.option("--exit_when_empty", is_flag=True, default=False, help="Stops once no item is available.")
+@click.option("--cache_size", default=1024, type=int, help="Repo cache entries of the worker, 0 disables it.")
+@click.option(
+    "--refresh_policy", type=click.Choice(list(REFRESH_POLICIES)), default="fixed",
+    help="How often the friend lists and libraries are refreshed, activity lengthens it for inactive players.")
+@click.option(
+    "--probe_libraries", is_flag=True, default=False,
+    help="Checks cheap signals before fetching a library, renewing the unchanged ones instead.")
+@click.option("--app_catalogue_path", type=str, help="App catalogue used to prefill and triage the game info.")
+@click.option("--metrics_textfile", type=str, help="Prometheus textfile written with the worker metrics.")
+@click.option("--metrics_json", type=str, help="JSON summary written with the worker metrics.")
+def worker(
+    steam_key,
+    worker_id,
+    kinds,
+    frequency,
+    lease_seconds,
+    max_attempts,
+    exit_when_empty,
+    cache_size,
+    refresh_policy,
+    probe_libraries,
+    app_catalogue_path,
+    metrics_textfile,
+    metrics_json,
+):
+    """
+    Processes the work queue items until SIGTERM or SIGINT, with the Steam API key of this node.
+    """
+    from repos.cached_repo import CachedRepo
+    from scrapper import SteamScrapper
+    from app_catalogue import load_app_catalogue
+
+    # every node can use its own key, the steam_api calls read it from the config
+    config.steam_key = steam_key
+    queue_repo = connect_queue_repo()
+    repo = InstrumentedRepo(queue_repo)
+    if cache_size > 0:
+        repo = CachedRepo(repo=repo, max_size=cache_size)
+    steam_scrapper = SteamScrapper(
+        repo=repo,
+        frequency=frequency,
+        delete_previous_gameplay=config.gameplay_retention_months is None,
+        refresh_policy=REFRESH_POLICIES[refresh_policy](),
+        probe_libraries=probe_libraries,
+        app_catalogue=load_app_catalogue(app_catalogue_path),
+    )
+    queue_worker = WorkQueueWorker(
+        queue_repo,
+        steam_scrapper,
+        worker_id=worker_id or f"{socket.gethostname()}-{os.getpid()}",
+        kinds=list(kinds) or None,
+        lease_seconds=lease_seconds,
+        max_attempts=max_attempts,
+    )
+    signal.signal(signal.SIGTERM, queue_worker.stop)
+    signal.signal(signal.SIGINT, queue_worker.stop)
+    logging.info(f"Worker {queue_worker.worker_id} started for {', '.join(queue_worker.kinds)}.")
+    try:
+        processed_items = queue_worker.run(exit_when_empty=exit_when_empty)
+        logging.info(f"Worker {queue_worker.worker_id} stopped after {processed_items} item(s).")
+    finally:
+        metrics.write_outputs(textfile_path=metrics_textfile, json_path=metrics_json)
+
+
+@work_queue.command()
+def stats():
+    """
+    Logs the number of work queue items by kind and status.
+    """
+    for kind, counts in sorted(connect_queue_repo().count_work_items().items()):
+        logging.info(f"{kind}: " + ", ".join(f"{status} {count}" for status, count in counts.items()))
+
+
+@work_queue.command("dead_letters")
+@click.option("--kind", type=click.Choice(WORK_KINDS))
+@click.option("--requeue", is_flag=True, default=False, help="Moves the dead letters back to pending.")
+def dead_letters(kind, requeue):
+    """
+    Logs the items that used all their attempts, and requeues them with --requeue.
+    """
+    queue_repo = connect_queue_repo()
+    for work_item in queue_repo.get_dead_work_items(kind=kind):
+        logging.info(f"{work_item.item_id} after {work_item.attempts} attempt(s): {work_item.last_error}")
+    if requeue:
+        logging.info(f"{queue_repo.requeue_dead_work_items(kind=kind)} dead letter(s) requeued.")
+
+
+def configure_logging():
+    logging.getLogger("pymongo").setLevel(logging.CRITICAL)
+    logging.getLogger("backoff").setLevel(logging.CRITICAL)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setLevel(logging.INFO)
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s - %(message)s")
+    handler.setFormatter(formatter)
+    root.addHandler(handler)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    work_queue()